@@ -0,0 +1,77 @@
+"""
+convConn_benchmark.py 
+
+Benchmark of convergent connectivity (convConn) for convergence values from 10 to 10,000:
+compares the sampler used to select presyn cells (Floyd's algorithm vs previous rejection sampling),
+and the total time to generate the connections of a network of point neurons
+
+Usage: python convConn_benchmark.py
+
+Contributors: salvadordura@gmail.com
+"""
+
+from time import time
+from netpyne import specs, sim
+
+numPre = 20000  # num of presyn cells
+numPost = 100  # num of postsyn cells
+convergences = [10, 100, 1000, 10000]
+
+
+###############################################################################
+# Sampler: k unique presyn indices out of numPre 
+###############################################################################
+def benchmarkSampler():
+    from neuron import h
+
+    net = sim.Network()
+    r = h.Random()
+    print('\nSampler (%d presyn cells, %d postsyn cells):' % (numPre, numPost))
+    print('  %12s %18s %18s' % ('convergence', 'randUniqueInt (s)', '_randSample (s)'))
+    for convergence in convergences:
+        start = time()
+        for postGid in range(numPost):
+            r.Random123(1, postGid, 1)
+            net.randUniqueInt(r, convergence, 0, numPre-1)
+        timeOld = time() - start
+
+        start = time()
+        for postGid in range(numPost):
+            r.Random123(1, postGid, 1)
+            net._randSample(r, numPre, convergence)
+        timeNew = time() - start
+
+        print('  %12d %18.3f %18.3f' % (convergence, timeOld, timeNew))
+
+
+###############################################################################
+# Network: connection time of convConn rule 
+###############################################################################
+def benchmarkNetwork():
+    print('\nNetwork connection time (%d presyn cells, %d postsyn cells):' % (numPre, numPost))
+    times = {}
+    for convergence in convergences:
+        netParams = specs.NetParams()
+        netParams.popParams['pre'] = {'cellModel': 'NetStim', 'numCells': numPre, 'rate': 10, 'noise': 0.5}
+        netParams.popParams['post'] = {'cellModel': 'IntFire2', 'numCells': numPost}
+        netParams.connParams['pre->post'] = {'preConds': {'pop': 'pre'}, 'postConds': {'pop': 'post'},
+            'convergence': convergence, 'weight': 0.001, 'delay': 'dist_3D/propVelocity'}
+
+        simConfig = specs.SimConfig()
+        simConfig.duration = 0
+        simConfig.timing = True
+        simConfig.createNEURONObj = False  # only measure generation of connections
+
+        sim.initialize(netParams=netParams, simConfig=simConfig)
+        sim.net.createPops()
+        sim.net.createCells()
+        sim.net.connectCells()
+        times[convergence] = sim.timingData['connectTime']
+
+    print('  %12s %18s' % ('convergence', 'connect time (s)'))
+    for convergence in convergences:
+        print('  %12d %18.3f' % (convergence, times[convergence]))
+
+
+benchmarkSampler()
+benchmarkNetwork()
@@ -0,0 +1,54 @@
+"""
+popPlacement_benchmark.py
+
+Benchmark of population placement for populations of 10^6 cells: time to create the cells of
+fixed-number, density (constant and ynorm-dependent) and grid populations (locations of all cells
+calculated at once, then cell objects created for the cells of this node)
+
+Usage: python popPlacement_benchmark.py  (or mpiexec -n 4 nrniv -python -mpi popPlacement_benchmark.py)
+
+Contributors: salvadordura@gmail.com
+"""
+
+from netpyne import specs, sim
+
+numCells = 1000000
+
+# network of 1 mm^3, so density (cells/mm^3) = number of cells
+popParams = {
+    'fixedNum': {'cellModel': 'IntFire2', 'numCells': numCells},
+    'density': {'cellModel': 'IntFire2', 'density': numCells},
+    'densityFunc': {'cellModel': 'IntFire2', 'density': '%d*ynorm' % (2*numCells), 'ynormRange': [0.0, 1.0]},  # ~10^6 cells after pruning
+    'grid': {'cellModel': 'IntFire2', 'gridSpacing': 10.0}}  # 101^3 grid points
+
+
+###############################################################################
+# Population placement: time to create cells of each population
+###############################################################################
+def benchmarkPlacement():
+    times = {}
+    cellsPop = {}
+    for label,params in popParams.iteritems():
+        netParams = specs.NetParams()
+        netParams.sizeX = netParams.sizeY = netParams.sizeZ = 1000.0
+        netParams.popParams[label] = params
+
+        simConfig = specs.SimConfig()
+        simConfig.duration = 0
+        simConfig.timing = True
+        simConfig.createNEURONObj = False  # only measure placement and creation of cell objects
+
+        sim.initialize(netParams=netParams, simConfig=simConfig)
+        sim.net.createPops()
+        sim.net.createCells()
+        times[label] = sim.timingData['createTime']
+        cellsPop[label] = sim.net.lastGid  # cells of all nodes
+
+    if sim.rank == 0:
+        print('\nPopulation placement (%d nodes):' % (sim.nhosts))
+        print('  %12s %12s %18s' % ('population', 'num cells', 'create time (s)'))
+        for label in popParams:
+            print('  %12s %12d %18.3f' % (label, cellsPop[label], times[label]))
+
+
+benchmarkPlacement()
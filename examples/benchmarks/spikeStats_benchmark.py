@@ -0,0 +1,42 @@
+"""
+spikeStats_benchmark.py
+
+Benchmark of spike train stats (rate, ISI mean and CV, local variation, Fano factor and bursts of each cell)
+calculated from the spike index (spikes sorted by gid) for 10^5 to 10^7 spikes of 10^5 cells
+
+Usage: python spikeStats_benchmark.py
+
+Contributors: salvadordura@gmail.com
+"""
+
+from time import time
+import numpy as np
+from netpyne.spikeindex import SpikeIndex
+
+numCells = 100000
+duration = 10000.0  # ms
+numSpikesList = [100000, 1000000, 10000000]
+
+
+###############################################################################
+# Spike stats: time to build spike index and calculate stats of all cells
+###############################################################################
+def benchmarkSpikeStats():
+    rand = np.random.RandomState(0)
+    print('\nSpike stats (%d cells, %.0f ms):' % (numCells, duration))
+    print('  %12s %18s %18s' % ('num spikes', 'index time (s)', 'stats time (s)'))
+    for numSpikes in numSpikesList:
+        spkt = np.sort(rand.uniform(0, duration, numSpikes))
+        spkid = rand.randint(0, numCells, numSpikes).astype(float)
+
+        start = time()
+        spikeIndex = SpikeIndex(spkt, spkid)
+        indexTime = time() - start
+
+        start = time()
+        spikeIndex.stats(range(numCells), [0, duration])
+        statsTime = time() - start
+        print('  %12d %18.3f %18.3f' % (numSpikes, indexTime, statsTime))
+
+
+benchmarkSpikeStats()
@@ -0,0 +1,118 @@
+"""
+checkpoint_test.py 
+
+Test of simulation checkpoints: runs a network with noisy NetStim inputs without interruption, and split in 2 runs
+(first run stops after saving the checkpoint at half the duration, as if preempted; second run resumes with 
+sim.restoreCheckpoint()), and checks the spikes and voltage traces of both are identical
+
+Usage: python checkpoint_test.py  (runs each part in a separate process)
+
+Contributors: salvadordura@gmail.com
+"""
+
+import os
+import sys
+import subprocess
+import pickle
+import numpy as np
+
+duration = 1000.0  # ms
+checkpointInterval = 100.0  # ms
+
+
+###############################################################################
+# Network and simulation parameters
+###############################################################################
+def createNetwork(filename):
+    from netpyne import specs, sim
+
+    netParams = specs.NetParams()
+    netParams.popParams['PYR'] = {'cellModel': 'HH', 'cellType': 'PYR', 'numCells': 50}
+    netParams.cellParams['PYR'] = {'conds': {'cellModel': 'HH', 'cellType': 'PYR'}, 'secs': {'soma': {
+        'geom': {'diam': 18.8, 'L': 18.8, 'Ra': 123.0}, 
+        'mechs': {'hh': {'gnabar': 0.12, 'gkbar': 0.036, 'gl': 0.003, 'el': -70}}}}}
+    netParams.synMechParams['AMPA'] = {'mod': 'Exp2Syn', 'tau1': 0.1, 'tau2': 1.0, 'e': 0}
+    netParams.stimSourceParams['bkg'] = {'type': 'NetStim', 'rate': 20, 'noise': 0.5, 'start': 1}
+    netParams.stimTargetParams['bkg->PYR'] = {'source': 'bkg', 'conds': {'pop': 'PYR'}, 'weight': 0.1, 'delay': 'uniform(1,5)'}
+    netParams.connParams['PYR->PYR'] = {'preConds': {'pop': 'PYR'}, 'postConds': {'pop': 'PYR'},
+        'weight': 0.002, 'delay': '0.2+normal(13.0,1.4)', 'threshold': 10, 'convergence': 'uniform(1,15)'}
+
+    simConfig = specs.SimConfig()
+    simConfig.duration = duration
+    simConfig.dt = 0.025
+    simConfig.recordCells = [0, 10, 20]
+    simConfig.recordTraces = {'V_soma': {'sec': 'soma', 'loc': 0.5, 'var': 'v'}}
+    simConfig.recordStep = 0.1
+    simConfig.checkpointInterval = checkpointInterval
+    simConfig.filename = filename
+
+    sim.create(netParams, simConfig)
+
+
+###############################################################################
+# Save spikes and traces gathered from all nodes
+###############################################################################
+def saveResults(filename):
+    from netpyne import sim
+
+    sim.gatherData()
+    if sim.rank == 0:
+        data = {'spkt': np.array(sim.allSimData['spkt']), 'spkid': np.array(sim.allSimData['spkid']), 
+            'V_soma': {cell: np.array(v) for cell,v in sim.allSimData['V_soma'].iteritems()}}
+        with open(filename+'_results.pkl', 'wb') as fileObj:
+            pickle.dump(data, fileObj)
+
+
+###############################################################################
+# Parts of test (each run in a separate process)
+###############################################################################
+def runFull():
+    from netpyne import sim
+    createNetwork('ckpt_full')
+    sim.runSimWithCheckpoints()
+    saveResults('ckpt_full')
+
+
+def runInterrupted():
+    from netpyne import sim
+    createNetwork('ckpt_split')
+
+    def checkpointAndStop(t):
+        sim.saveCheckpoint()
+        if t >= duration/2:
+            print('  Stopping run at t = %0.1f ms (emulating preemption)' % (t))
+            os._exit(0)
+
+    sim.runSimWithIntervalFunc(checkpointInterval, checkpointAndStop)
+
+
+def runRestored():
+    from netpyne import sim
+    createNetwork('ckpt_split')
+    sim.restoreCheckpoint()
+    saveResults('ckpt_split')
+
+
+def compareResults():
+    results = []
+    for filename in ['ckpt_full', 'ckpt_split']:
+        with open(filename+'_results.pkl', 'rb') as fileObj:
+            results.append(pickle.load(fileObj))
+    full, split = results
+
+    sameSpikes = np.array_equal(full['spkt'], split['spkt']) and np.array_equal(full['spkid'], split['spkid'])
+    sameTraces = sorted(full['V_soma']) == sorted(split['V_soma']) and \
+        all(np.array_equal(full['V_soma'][cell], split['V_soma'][cell]) for cell in full['V_soma'])
+    print('\nSpikes: %d (uninterrupted) vs %d (split); identical: %s' % (len(full['spkt']), len(split['spkt']), sameSpikes))
+    print('Voltage traces identical: %s' % (sameTraces))
+    return sameSpikes and sameTraces
+
+
+if __name__ == '__main__':
+    parts = {'full': runFull, 'interrupted': runInterrupted, 'restored': runRestored}
+    if len(sys.argv) > 1:
+        parts[sys.argv[1]]()
+    else:
+        for part in ['full', 'interrupted', 'restored']:
+            subprocess.check_call([sys.executable, __file__, part])
+        sys.exit(0 if compareResults() else 1)
@@ -12,12 +12,14 @@ if __gui__:
     import matplotlib.pyplot as plt
     from matplotlib import gridspec
     from matplotlib import mlab
+    from matplotlib.colors import colorConverter
 import numpy as np
 from scipy import array, cumsum
 import scipy as sp
 from numbers import Number
 import math
 import functools
+from spikeindex import SpikeIndex, spikeStats, statsKeys
 
 import warnings
 warnings.filterwarnings("ignore")
@@ -176,38 +178,55 @@ def _smooth1d(x,window_len=11,window='hanning'):
 
 
 ######################################################################################################################################################
-## Get subset of cells and netstims indicated by include list
+## Round number to n significant figures
 ######################################################################################################################################################
-def getCellsInclude(include):
+def _roundFigures(x, n):
+    return round(x, -int(np.floor(np.log10(abs(x)))) + (n - 1)) if x != 0 else 0 
+
+
+######################################################################################################################################################
+## Get index of cells (sorted gids and gids of each pop) used to select cells; rebuilt if cells changed (eg. gathered or loaded again)
+######################################################################################################################################################
+def _getCellsIndex(allCells, popIndex='pop'):
     import sim
 
-    allCells = sim.net.allCells
-    allNetStimLabels = sim.net.params.stimSourceParams.keys()
-    cellGids = []
-    cells = []
-    netStimLabels = []
-    for condition in include:
-        if condition == 'all':  # all cells + Netstims 
-            cellGids = [c['gid'] for c in allCells]
-            cells = list(allCells)
-            netStimLabels = list(allNetStimLabels)
-            return cells, cellGids, netStimLabels
+    cellsIndex = getattr(sim, 'cellsIndex', None)
+    if cellsIndex is None or cellsIndex['allCells'] is not allCells or cellsIndex['numCells'] != len(allCells):
+        if isinstance(allCells, dict):  # tags of each cell (key = gid)
+            gids = [gid for gid in allCells if gid != 'format']
+            pops = [allCells[gid][popIndex] for gid in gids]
+        else:  # list of cells
+            gids = [cell['gid'] for cell in allCells]
+            pops = [cell['tags']['pop'] for cell in allCells]
+        gids = np.array(gids, dtype=int)
+        order = np.argsort(gids, kind='mergesort')
+        popGids = {}  # gids of each pop (in order of allCells, used for relative indices)
+        for pop,gid in zip(pops, gids):
+            popGids.setdefault(pop, []).append(gid)
+        cellsIndex = sim.cellsIndex = {'allCells': allCells, 'numCells': len(allCells), 'sortedGids': gids[order], 'order': order,
+            'popGids': {pop: np.array(popGidList, dtype=int) for pop,popGidList in popGids.iteritems()}, 'includeCache': {}}
+    return cellsIndex
 
-        elif condition == 'allCells':  # all cells 
-            cellGids = [c['gid'] for c in allCells]
-            cells = list(allCells)
 
-        elif condition == 'allNetStims':  # all cells + Netstims 
-            netStimLabels = list(allNetStimLabels)
+######################################################################################################################################################
+## Get gids (sorted array) of cells indicated by include list, using index of cells
+######################################################################################################################################################
+def _getGidsInclude(include, cellsIndex, netStimLabels=None):
+    emptyGids = np.array([], dtype=int)
+    gidArrays = []
+    for condition in include:
+        if condition == 'all' or (condition == 'allCells' and netStimLabels is None):  # all cells
+            return cellsIndex['sortedGids']
+
+        elif condition == 'allCells':  # all cells (conditions continue for netstims)
+            gidArrays.append(cellsIndex['sortedGids'])
 
-        elif isinstance(condition, int):  # cell gid 
-            cellGids.append(condition)
+        elif isinstance(condition, (int, np.integer)) and not isinstance(condition, bool):  # cell gid 
+            gidArrays.append(np.array([condition], dtype=int))
         
         elif isinstance(condition, basestring):  # entire pop
-            if condition in allNetStimLabels:
-                netStimLabels.append(condition)
-            else:
-                cellGids.extend([c['gid'] for c in allCells if c['tags']['pop']==condition])
+            if netStimLabels is None or condition not in netStimLabels:
+                gidArrays.append(cellsIndex['popGids'].get(condition, emptyGids))
         
         # subset of a pop with relative indices
         # when load from json gets converted to list (added as exception)
@@ -216,84 +235,122 @@ def getCellsInclude(include):
         and len(condition)==2 
         and isinstance(condition[0], basestring) 
         and isinstance(condition[1], (list,int)))):  
-            cellsPop = [c['gid'] for c in allCells if c['tags']['pop']==condition[0]]
+            cellsPop = cellsIndex['popGids'].get(condition[0], emptyGids)
             if isinstance(condition[1], list):
-                cellGids.extend([gid for i,gid in enumerate(cellsPop) if i in condition[1]])
+                gidArrays.append(cellsPop[[i for i in condition[1] if isinstance(i, int) and 0 <= i < len(cellsPop)]])
             elif isinstance(condition[1], int):
-                cellGids.extend([gid for i,gid in enumerate(cellsPop) if i==condition[1]])
-
-        elif isinstance(condition, list):  # subset
-            for subcond in condition:
-                if isinstance(subcond, int):  # cell gid 
-                    cellGids.append(subcond)
-        
-                elif isinstance(subcond, basestring):  # entire pop
-                    if subcond in allNetStimLabels:
-                        netStimLabels.append(subcond)
-                    else:
-                        cellGids.extend([c['gid'] for c in allCells if c['tags']['pop']==subcond])
+                gidArrays.append(cellsPop[condition[1]:condition[1]+1] if condition[1] >= 0 else emptyGids)
 
-    cellGids = sim.unique(cellGids)  # unique values
-    cells = [cell for cell in allCells if cell['gid'] in cellGids]
-    cells = sorted(cells, key=lambda k: k['gid'])
+        elif isinstance(condition, list) and netStimLabels is not None:  # subset
+            gidArrays.append(_getGidsInclude(condition, cellsIndex, netStimLabels))
 
-    return cells, cellGids, netStimLabels
+    return np.unique(np.concatenate(gidArrays)) if gidArrays else emptyGids
 
 
 ######################################################################################################################################################
 ## Get subset of cells and netstims indicated by include list
 ######################################################################################################################################################
-def getCellsIncludeTags(include, tags, tagsFormat=None):
-    allCells = tags.copy()
-    cellGids = []
+def getCellsInclude(include):
+    import sim
 
-    # using list with indices
-    if tagsFormat or 'format' in allCells: 
-        if not tagsFormat: tagsFormat = allCells.pop('format')
-        popIndex = tagsFormat.index('pop')
+    allCells = sim.net.allCells
+    allNetStimLabels = sim.net.params.stimSourceParams.keys()
+    cellsIndex = _getCellsIndex(allCells)
 
+    cacheKey = repr(include)  # repeated include specs (eg. across plots) resolved once
+    if cacheKey not in cellsIndex['includeCache']:
+        netStimLabels = []
         for condition in include:
-            if condition in  ['all', 'allCells']:  # all cells 
-                cellGids = allCells.keys()
-                return cellGids
+            if condition in ['all', 'allNetStims']:  # all Netstims 
+                netStimLabels = list(allNetStimLabels)
+            elif isinstance(condition, basestring) and condition in allNetStimLabels:
+                netStimLabels.append(condition)
+            elif isinstance(condition, list) and not (len(condition)==2 and isinstance(condition[0], basestring) and isinstance(condition[1], (list,int))):
+                netStimLabels.extend([subcond for subcond in condition if isinstance(subcond, basestring) and subcond in allNetStimLabels])
+            if condition == 'all':
+                break
+        cellGids = _getGidsInclude(include, cellsIndex, allNetStimLabels)
+
+        # cells with these gids (sorted by gid)
+        sortedGids = cellsIndex['sortedGids']
+        pos = np.searchsorted(sortedGids, cellGids)
+        found = pos < len(sortedGids)
+        found[found] = sortedGids[pos[found]] == cellGids[found]
+        cells = [allCells[i] for i in cellsIndex['order'][pos[found]]]
+        cellsIndex['includeCache'][cacheKey] = (cells, cellGids, netStimLabels)
+
+    cells, cellGids, netStimLabels = cellsIndex['includeCache'][cacheKey]
+    return list(cells), cellGids.copy(), list(netStimLabels)
 
-            elif isinstance(condition, int):  # cell gid 
-                cellGids.append(condition)
-            
-            elif isinstance(condition, basestring):  # entire pop
-                cellGids.extend([gid for gid,c in allCells.iteritems() if c[popIndex]==condition])
-            
-            elif isinstance(condition, tuple):  # subset of a pop with relative indices
-                cellsPop = [gid for gid,c in allCells.iteritems() if c[popIndex]==condition[0]]
-                if isinstance(condition[1], list):
-                    cellGids.extend([gid for i,gid in enumerate(cellsPop) if i in condition[1]])
-                elif isinstance(condition[1], int):
-                    cellGids.extend([gid for i,gid in enumerate(cellsPop) if i==condition[1]])
 
+######################################################################################################################################################
+## Get subset of cells and netstims indicated by include list
+######################################################################################################################################################
+def getCellsIncludeTags(include, tags, tagsFormat=None):
+    # using list with indices
+    if tagsFormat or 'format' in tags: 
+        if not tagsFormat: tagsFormat = tags['format']
+        popIndex = tagsFormat.index('pop')
     # using dict with keys
     else:
-    
-        for condition in include:
-            if condition in  ['all', 'allCells']:  # all cells 
-                cellGids = allCells.keys()
-                return cellGids
+        popIndex = 'pop'
 
-            elif isinstance(condition, int):  # cell gid 
-                cellGids.append(condition)
-            
-            elif isinstance(condition, basestring):  # entire pop
-                cellGids.extend([gid for gid,c in allCells.iteritems() if c['pop']==condition])
-            
-            elif isinstance(condition, tuple):  # subset of a pop with relative indices
-                cellsPop = [gid for gid,c in allCells.iteritems() if c['pop']==condition[0]]
-                if isinstance(condition[1], list):
-                    cellGids.extend([gid for i,gid in enumerate(cellsPop) if i in condition[1]])
-                elif isinstance(condition[1], int):
-                    cellGids.extend([gid for i,gid in enumerate(cellsPop) if i==condition[1]])
+    cellsIndex = _getCellsIndex(tags, popIndex)
+    cacheKey = repr(include)
+    if cacheKey not in cellsIndex['includeCache']:
+        cellsIndex['includeCache'][cacheKey] = _getGidsInclude([condition for condition in include if not isinstance(condition, list)], cellsIndex)
+
+    return cellsIndex['includeCache'][cacheKey].copy()
+
+
+######################################################################################################################################################
+## Get spike index (spikes sorted by gid with CSR offsets) of sim.allSimData; rebuilt if spikes changed (eg. gathered or loaded again)
+######################################################################################################################################################
+def getSpikeIndex():
+    import sim
+
+    spkt, spkid = sim.allSimData['spkt'], sim.allSimData['spkid']
+    spikeIndex = getattr(sim, 'spikeIndex', None)
+    if spikeIndex is None or not spikeIndex.isCurrent(spkt, spkid):
+        popGids = {pop: popData['cellGids'] for pop,popData in getattr(sim.net, 'allPops', {}).iteritems() if 'cellGids' in popData}
+        sim.spikeIndex = SpikeIndex(spkt, spkid, popGids)
+    return sim.spikeIndex
+
+
+######################################################################################################################################################
+## Get spike train stats (rate, ISI mean and CV, LV, Fano factor and bursts) of each cell in include 
+######################################################################################################################################################
+def getSpikeStats (include = ['allCells'], timeRange = None, burstISI = 10.0, fanoBin = 100.0):
+    ''' 
+    Calculate spike train stats of each cell
+        - include (['all',|'allCells','allNetStims',|,120,|,'E1'|,('L2', 56)|,('L5',[4,5,6])]): Cells and NetStims to include (default: ['allCells'])
+        - timeRange ([start:stop]): Time range of spikes; if None uses whole simulation (default: None)
+        - burstISI (float): Max ISI (ms) between consecutive spikes of a burst (default: 10.0)
+        - fanoBin (float): Bin size (ms) of spike counts used to calculate the Fano factor (default: 100.0)
+
+        - Returns dict with arrays (one value per cell, sorted by gid; followed by NetStims with gid -1): 'gid', 'numSpikes', 'rate' (Hz), 
+        'isiMean' (ms), 'isiCV', 'lv' (local variation), 'fano', 'numBursts', 'burstFraction' (fraction of spikes in bursts)
+    '''
+
+    import sim
+
+    cells, cellGids, netStimLabels = getCellsInclude(include)
+    if timeRange is None:
+        timeRange = [0,sim.cfg.duration]
+
+    cellStats = getSpikeIndex().stats(cellGids, timeRange, burstISI, fanoBin)
 
-    cellGids = [int(x) for x in set(cellGids)]  # unique values
+    # Add NetStim spike trains
+    if 'stims' in sim.allSimData and len(netStimLabels) > 0:
+        netStimTrains = [stimSpks for cell,stims in sim.allSimData['stims'].iteritems() for stimLabel,stimSpks in stims.iteritems() if stimLabel in netStimLabels]
+        if len(netStimTrains) > 0:
+            spkinds = np.repeat(np.arange(len(netStimTrains)), [len(stimSpks) for stimSpks in netStimTrains])
+            spkts = np.concatenate([np.asarray(stimSpks, dtype=float) for stimSpks in netStimTrains])
+            netStimStats = spikeStats(spkinds, spkts, timeRange, burstISI, fanoBin)
+            netStimStats['gid'] = -np.ones(len(netStimStats['gid']), dtype=int)
+            cellStats = {key: np.concatenate((cellStats[key], netStimStats[key])) for key in statsKeys}
 
-    return cellGids
+    return cellStats
 
 
 ######################################################################################################################################################
@@ -349,7 +406,7 @@ def calculateRate (include = ['allCells', 'eachPop'], peakBin = 5, timeRange = N
         # Select cells to include
         if len(cellGids) > 0:
             try:
-                spkinds,spkts = zip(*[(spkgid,spkt) for spkgid,spkt in zip(sim.allSimData['spkid'],sim.allSimData['spkt']) if spkgid in cellGids])
+                spkinds,spkts = getSpikeIndex().spikes(cellGids, sortByTime=True)
             except:
                 spkinds,spkts = [],[]
         else: 
@@ -380,8 +437,8 @@ def calculateRate (include = ['allCells', 'eachPop'], peakBin = 5, timeRange = N
             histoCount = histoCount * float((1000.0 / peakBin)) / float((len(cellGids)+numNetStims)) # convert to firing rate
             peak.append(float(max(histoCount)))
 
-        spktsRange = [spkt for spkt in spkts if timeRange[0] <= spkt <= timeRange[1]]
-        avg.append(float(len(spktsRange)) / float((len(cellGids)+numNetStims)) / float((timeRange[1]-timeRange[0])) * 1000.0)
+        numSpikes = getSpikeStats([subset], timeRange)['numSpikes'].sum()
+        avg.append(float(numSpikes) / float((len(cellGids)+numNetStims)) / float((timeRange[1]-timeRange[0])) * 1000.0)
 
     return include, avg, peak
 
@@ -572,8 +629,8 @@ def plotSyncs (include =['allCells', 'eachPop'], timeRanges = None, timeRangeLab
 ######################################################################################################################################################
 @exception
 def plotRaster (include = ['allCells'], timeRange = None, maxSpikes = 1e8, orderBy = 'gid', orderInverse = False, labels = 'legend', popRates = False,
-        spikeHist = None, spikeHistBin = 5, syncLines = False, lw = 2, marker = '|', markerSize=5, popColors = None, figSize = (10,8), dpi = 100, saveData = None, saveFig = None, 
-        showFig = True): 
+        spikeHist = None, spikeHistBin = 5, syncLines = False, lw = 2, marker = '|', markerSize=5, popColors = None, render = 'scatter', figSize = (10,8), dpi = 100, 
+        saveData = None, saveFig = None, showFig = True): 
     ''' 
     Raster plot of network cells 
         - include (['all',|'allCells',|'allNetStims',|,120,|,'E1'|,('L2', 56)|,('L5',[4,5,6])]): Cells to include (default: 'allCells')
@@ -589,6 +646,8 @@ def plotRaster (include = ['allCells'], timeRange = None, maxSpikes = 1e8, order
         - lw (integer): Line width for each spike (default: 2)
         - marker (char): Marker for each spike (default: '|')
         - popColors (dict): Dictionary with color (value) used for each population (key) (default: None)
+        - render ('scatter'|'image'): Plot each spike as a marker, or plot image with spikes binned into pixels of (cells x time), 
+            with pixel resolution given by figSize and dpi; 'image' is faster for large numbers of spikes (default: 'scatter')
         - figSize ((width, height)): Size of figure (default: (10,8))
         - dpi (int): Dots per inch to save fig (default: 100)
         - saveData (None|True|'fileName'): File name where to save the final data used to generate the figure; 
@@ -613,12 +672,12 @@ def plotRaster (include = ['allCells'], timeRange = None, maxSpikes = 1e8, order
     if popColors: popColorsTmp.update(popColors)
     popColors = popColorsTmp
     if len(cellGids) > 0:
-        gidColors = {cell['gid']: popColors[cell['tags']['pop']] for cell in cells}  # dict with color for each gid
         try:
-            spkgids,spkts = zip(*[(spkgid,spkt) for spkgid,spkt in zip(sim.allSimData['spkid'],sim.allSimData['spkt']) if spkgid in cellGids])
+            spkgids,spkts = getSpikeIndex().spikes(cellGids, sortByTime=True)
         except:
-            spkgids, spkts = [], []
-        spkgidColors = [gidColors[spkgid] for spkgid in spkgids]
+            spkgids, spkts = np.array([], dtype=int), np.array([])
+        cellPopInds = np.array([popLabels.index(cell['tags']['pop']) for cell in cells])  # pop of each cell (cells sorted by gid)
+        spkPopInds = cellPopInds[np.searchsorted(cellGids, spkgids)]  # pop of each spike
 
     # Order by
     if len(cellGids) > 0:
@@ -641,29 +700,28 @@ def plotRaster (include = ['allCells'], timeRange = None, maxSpikes = 1e8, order
 
 
         #sortedGids = {gid:i for i, (y, gid) in enumerate(sorted(zip(yorder, cellGids)))}
-        spkinds = [sortedGids[gid]  for gid in spkgids]
+        cellInds = np.array([sortedGids[gid] for gid in cellGids])  # y position of each cell (cells sorted by gid)
+        spkinds = cellInds[np.searchsorted(cellGids, spkgids)]
 
     else:
-        spkts = []
-        spkinds = []
-        spkgidColors = []
+        spkts = np.array([])
+        spkinds = np.array([], dtype=int)
+        spkPopInds = np.array([], dtype=int)
         ylabelText = ''
 
     # Add NetStim spikes
-    spkts,spkgidColors = list(spkts), list(spkgidColors)
     numCellSpks = len(spkts)
     numNetStims = 0
     for netStimLabel in netStimLabels:
         netStimSpks = [spk for cell,stims in sim.allSimData['stims'].iteritems() \
             for stimLabel,stimSpks in stims.iteritems() for spk in stimSpks if stimLabel == netStimLabel]
         if len(netStimSpks) > 0:
-            lastInd = max(spkinds) if len(spkinds)>0 else 0
+            lastInd = spkinds.max() if len(spkinds)>0 else 0
             spktsNew = netStimSpks 
             spkindsNew = [lastInd+1+i for i in range(len(netStimSpks))]
-            spkts.extend(spktsNew)
-            spkinds.extend(spkindsNew)
-            for i in range(len(spktsNew)): 
-                spkgidColors.append(popColors['NetStims'])
+            spkts = np.concatenate((spkts, spktsNew))
+            spkinds = np.concatenate((spkinds, spkindsNew)).astype(int)
+            spkPopInds = np.concatenate((spkPopInds, [popLabels.index('NetStims')]*len(spktsNew))).astype(int)
             numNetStims += 1
         else:
             pass
@@ -683,17 +741,18 @@ def plotRaster (include = ['allCells'], timeRange = None, maxSpikes = 1e8, order
     elif timeRange is None:
         timeRange = [0,sim.cfg.duration]
     else:
-        spkinds,spkts,spkgidColors = zip(*[(spkind,spkt,spkgidColor) for spkind,spkt,spkgidColor in zip(spkinds,spkts,spkgidColors) 
-        if timeRange[0] <= spkt <= timeRange[1]])
+        inRange = (spkts >= timeRange[0]) & (spkts <= timeRange[1])
+        spkinds,spkts,spkPopInds = spkinds[inRange], spkts[inRange], spkPopInds[inRange]
 
     # Limit to maxSpikes
     if (len(spkts)>maxSpikes):
         print('  Showing only the first %i out of %i spikes' % (maxSpikes, len(spkts))) # Limit num of spikes
         if numNetStims: # sort first if have netStims
-            spkts, spkinds, spkgidColors = zip(*sorted(zip(spkts, spkinds, spkgidColors)))
-        spkts = spkts[:maxSpikes]
-        spkinds = spkinds[:maxSpikes]
-        spkgidColors = spkgidColors[:maxSpikes]
+            order = np.argsort(spkts, kind='mergesort')
+            spkts, spkinds, spkPopInds = spkts[order], spkinds[order], spkPopInds[order]
+        spkts = spkts[:int(maxSpikes)]
+        spkinds = spkinds[:int(maxSpikes)]
+        spkPopInds = spkPopInds[:int(maxSpikes)]
         timeRange[1] =  max(spkts)
 
     # Calculate spike histogram 
@@ -710,7 +769,29 @@ def plotRaster (include = ['allCells'], timeRange = None, maxSpikes = 1e8, order
         gs = gridspec.GridSpec(2, 1,height_ratios=[2,1])
         ax1=plt.subplot(gs[0])
  
-    ax1.scatter(spkts, spkinds, lw=lw, s=markerSize, marker=marker, color = spkgidColors) # Create raster  
+    numRows = len(cells)+numNetStims
+    if render == 'image':  # image with spikes binned into (cells x time) pixels, colored by pop; cost independent of num of spikes 
+        numImageRows = max(min(numRows, int(figSize[1]*dpi)), 1)
+        numImageCols = max(int(figSize[0]*dpi), 1)
+        inImage = (spkinds >= 0) & (spkinds < numRows)  # NetStim spikes beyond last row are out of y-axis limits
+        pixelRows = ((spkinds[inImage] + 0.5) * numImageRows / numRows).astype(int)
+        pixelCols = np.minimum(((spkts[inImage] - timeRange[0]) * numImageCols / float(timeRange[1]-timeRange[0])).astype(int), numImageCols-1)
+        pixels = pixelRows * numImageCols + pixelCols
+        pixelPops = spkPopInds[inImage]
+        colorSum = np.zeros((numImageRows*numImageCols, 3))
+        countSum = np.zeros(numImageRows*numImageCols)
+        for ipop,popLabel in enumerate(popLabels):  # 2D histogram of spikes of each pop
+            popCounts = np.bincount(pixels[pixelPops == ipop], minlength=numImageRows*numImageCols)
+            colorSum += popCounts[:, np.newaxis] * np.array(colorConverter.to_rgb(popColors[popLabel]))
+            countSum += popCounts
+        image = np.ones((numImageRows*numImageCols, 4))  # RGBA; transparent pixels without spikes
+        image[:, 3] = countSum > 0
+        image[countSum > 0, :3] = colorSum[countSum > 0] / countSum[countSum > 0, np.newaxis]
+        ax1.imshow(image.reshape(numImageRows, numImageCols, 4), origin='lower', aspect='auto', interpolation='nearest',
+            extent=[timeRange[0], timeRange[1], -0.5, numRows-0.5])
+    else:
+        spkgidColors = [popColors[popLabels[ipop]] for ipop in spkPopInds]
+        ax1.scatter(spkts, spkinds, lw=lw, s=markerSize, marker=marker, color = spkgidColors) # Create raster  
     ax1.set_xlim(timeRange)
     
     # Plot stats
@@ -730,10 +811,11 @@ def plotRaster (include = ['allCells'], timeRange = None, maxSpikes = 1e8, order
                 if numCellSpks == 0:
                     avgRates[pop] = 0
                 else:
-                    avgRates[pop] = len([spkid for spkid in spkinds[:numCellSpks-1] if sim.net.allCells[int(spkid)]['tags']['pop']==pop])/popNum/tsecs
+                    popGids = [cell['gid'] for cell in cells if cell['tags']['pop'] == pop]
+                    avgRates[pop] = len(getSpikeIndex().spikes(popGids, timeRange=timeRange)[0])/popNum/tsecs
         if numNetStims:
             popNumCells[-1] = numNetStims
-            avgRates['NetStims'] = len([spkid for spkid in spkinds[numCellSpks:]])/numNetStims/tsecs 
+            avgRates['NetStims'] = np.sum(spkPopInds == popLabels.index('NetStims'))/float(numNetStims)/tsecs 
 
     # Plot synchrony lines 
     if syncLines: 
@@ -798,9 +880,9 @@ def plotRaster (include = ['allCells'], timeRange = None, maxSpikes = 1e8, order
 
     # save figure data
     if saveData:
-        figData = {'spkTimes': spkts, 'spkInds': spkinds, 'spkColors': spkgidColors, 'cellGids': cellGids, 'sortedGids': sortedGids, 'numNetStims': numNetStims, 
+        figData = {'spkTimes': spkts.tolist(), 'spkInds': spkinds.tolist(), 'spkColors': [popColors[popLabels[ipop]] for ipop in spkPopInds], 'cellGids': cellGids.tolist(), 'sortedGids': sortedGids, 'numNetStims': numNetStims, 
         'include': include, 'timeRange': timeRange, 'maxSpikes': maxSpikes, 'orderBy': orderBy, 'orderInverse': orderInverse, 'spikeHist': spikeHist,
-        'syncLines': syncLines}
+        'syncLines': syncLines, 'render': render}
 
         _saveFigData(figData, saveData, 'raster')
  
@@ -878,7 +960,7 @@ def plotSpikeHist (include = ['allCells', 'eachPop'], timeRange = None, binSize
         # Select cells to include
         if len(cellGids) > 0:
             try:
-                spkinds,spkts = zip(*[(spkgid,spkt) for spkgid,spkt in zip(sim.allSimData['spkid'],sim.allSimData['spkt']) if spkgid in cellGids])
+                spkinds,spkts = getSpikeIndex().spikes(cellGids, sortByTime=True)
             except:
                 spkinds,spkts = [],[]
         else: 
@@ -975,7 +1057,7 @@ def plotSpikeStats (include = ['allCells', 'eachPop'], timeRange = None, graphTy
             Note: one line per item, not grouped (default: ['allCells', 'eachPop'])
         - timeRange ([start:stop]): Time range of spikes shown; if None shows all (default: None)
         - graphType ('boxplot'): Type of graph to use (default: 'boxplot')
-        - stats (['rate', |'isicv'| 'sync'| 'pairsync']): Measure to plot stats on (default: ['rate', 'isicv'])
+        - stats (['rate', |'isicv'| 'isimean'| 'lv'| 'fano'| 'burst'| 'sync'| 'pairsync']): Measure to plot stats on (default: ['rate', 'isicv'])
         - popColors (dict): Dictionary with color (value) used for each population (key) (default: None)
         - figSize ((width, height)): Size of figure (default: (10,8))
         - saveData (None|True|'fileName'): File name where to save the final data used to generate the figure;
@@ -1012,6 +1094,11 @@ def plotSpikeStats (include = ['allCells', 'eachPop'], timeRange = None, graphTy
     if timeRange is None:
         timeRange = [0,sim.cfg.duration]
 
+    # stats calculated by getSpikeStats
+    statLabels = {'rate': 'Rate (Hz)', 'isicv': 'Irregularity (ISI CV)', 'isimean': 'Mean ISI (ms)', 'lv': 'Local variation (LV)', 
+                'fano': 'Fano factor', 'burst': 'Fraction of spikes in bursts'}
+    statKeys = {'rate': 'rate', 'isicv': 'isiCV', 'isimean': 'isiMean', 'lv': 'lv', 'fano': 'fano', 'burst': 'burstFraction'}
+
     for stat in stats:
         # create fig
         fig,ax1 = plt.subplots(figsize=figSize)
@@ -1022,52 +1109,17 @@ def plotSpikeStats (include = ['allCells', 'eachPop'], timeRange = None, graphTy
         # Calculate data for each entry in include
         for iplot,subset in enumerate(include):
 
-            cells, cellGids, netStimLabels = getCellsInclude([subset])
-            numNetStims = 0
-
-            # Select cells to include
-            if len(cellGids) > 0:
-                try:
-                    spkinds,spkts = zip(*[(spkgid,spkt) for spkgid,spkt in zip(sim.allSimData['spkid'],sim.allSimData['spkt']) if spkgid in cellGids])
-                except:
-                    spkinds,spkts = [],[]
-            else: 
-                spkinds,spkts = [],[]
-
-            # Add NetStim spikes
-            spkts, spkinds = list(spkts), list(spkinds)
-            numNetStims = 0
-            if 'stims' in sim.allSimData:
-                for netStimLabel in netStimLabels:
-                    netStimSpks = [spk for cell,stims in sim.allSimData['stims'].iteritems() \
-                    for stimLabel,stimSpks in stims.iteritems() for spk in stimSpks if stimLabel == netStimLabel]
-                    if len(netStimSpks) > 0:
-                        lastInd = max(spkinds) if len(spkinds)>0 else 0
-                        spktsNew = netStimSpks 
-                        spkindsNew = [lastInd+1+i for i in range(len(netStimSpks))]
-                        spkts.extend(spktsNew)
-                        spkinds.extend(spkindsNew)
-                        numNetStims += 1
-
-            try:
-                spkts,spkinds = zip(*[(spkt, spkind) for spkt, spkind in zip(spkts, spkinds) if timeRange[0] <= spkt <= timeRange[1]])
-            except:
-                pass
-
-            # rate stats
-            if stat == 'rate':
-                toRate = 1e3/(timeRange[1]-timeRange[0])
-                rates = [spkinds.count(gid)*toRate for gid in set(spkinds)] if len(spkinds)>0 else [0] #cellGids] #set(spkinds)] 
-                statData.insert(0, rates)
-                xlabel = 'Rate (Hz)'
-
-            # Inter-spike interval (ISI) coefficient of variation (CV) stats
-            elif stat == 'isicv':
-                xlabel = 'Irregularity (ISI CV)'
-                spkmat = [[spkt for spkind,spkt in zip(spkinds,spkts) if spkind==gid] for gid in set(spkinds)]
-                isimat = [[t - s for s, t in zip(spks, spks[1:])] for spks in spkmat]
-                isicv = [np.std(x) / np.mean(x) if len(x)>0 else [0] for x in isimat if len(x)>0] 
-                statData.insert(0, isicv) 
+            # rate, ISI and burst stats (per cell)
+            if stat in statLabels:
+                xlabel = statLabels[stat]
+                cellStats = getSpikeStats([subset], timeRange)
+                if stat == 'rate':
+                    values = cellStats['rate'][cellStats['numSpikes'] > 0]  # cells with spikes
+                else:
+                    values = cellStats[statKeys[stat]]
+                    values = values[~np.isnan(values)]  # cells with enough spikes
+                if stat == 'rate' and len(values) == 0: values = [0]
+                statData.insert(0, list(values))
 
             # synchrony
             elif stat in ['sync', 'pairsync']:
@@ -1077,8 +1129,10 @@ def plotSpikeStats (include = ['allCells', 'eachPop'], timeRange = None, graphTy
                     print "Error: plotSpikeStats() requires the PySpike python package to calculate synchrony (try: pip install pyspike)"
                     return 0
 
-                
-                spkmat = [pyspike.SpikeTrain([spkt for spkind,spkt in zip(spkinds,spkts) if spkind==gid], timeRange) for gid in set(spkinds)]
+                cells, cellGids, netStimLabels = getCellsInclude([subset])
+                spkinds,spkts = getSpikeIndex().spikes(cellGids, timeRange=timeRange)  # sorted by gid and time
+                cellStarts = np.unique(spkinds, return_index=True)[1]
+                spkmat = [pyspike.SpikeTrain(list(cellSpkts), timeRange) for cellSpkts in np.split(spkts, cellStarts[1:])] if len(spkts) > 0 else []
                 if stat == 'sync':
                     xlabel = 'Synchrony'# (SPIKE-Sync measure)' # see http://www.scholarpedia.org/article/Measures_of_spike_train_synchrony
                     syncMat = [pyspike.spike_sync(spkmat)]
@@ -1224,7 +1278,7 @@ def plotRatePSD (include = ['allCells', 'eachPop'], timeRange = None, binSize =
         # Select cells to include
         if len(cellGids) > 0:
             try:
-                spkinds,spkts = zip(*[(spkgid,spkt) for spkgid,spkt in zip(sim.allSimData['spkid'],sim.allSimData['spkt']) if spkgid in cellGids])
+                spkinds,spkts = getSpikeIndex().spikes(cellGids, sortByTime=True)
             except:
                 spkinds,spkts = [],[]
         else: 
@@ -1667,7 +1721,7 @@ def plotShape (includePost = ['all'], includePre = ['all'], showSyns = False, sh
 ######################################################################################################################################################
 @exception
 def plotLFP (electrodes = ['avg', 'all'], plots = ['timeSeries', 'PSD', 'spectrogram', 'locations'], timeRange = None, NFFT = 256, noverlap = 128, 
-    nperseg = 256, maxFreq = 100, smooth = 0, separation = 1.0, includeAxon=True, figSize = (8,8), saveData = None, saveFig = None, showFig = True): 
+    nperseg = 256, maxFreq = 100, smooth = 0, separation = 1.0, includeAxon=True, pops = None, figSize = (8,8), saveData = None, saveFig = None, showFig = True): 
     ''' 
     Plot LFP
         - electrodes (list): List of electrodes to include; 'avg'=avg of all electrodes; 'all'=each electrode separately (default: ['avg', 'all'])
@@ -1680,6 +1734,8 @@ def plotLFP (electrodes = ['avg', 'all'], plots = ['timeSeries', 'PSD', 'spectro
         - smooth (int): Window size for smoothing LFP; no smoothing if 0 (default: 0)
         - separation (float): Separation factor between time-resolved LFP plots; multiplied by max LFP value (default: 1.0)
         - includeAxon (boolean): Whether to show the axon in the location plot (default: True)
+        - pops (None|'all'|list): Populations (or groups of cells, see simConfig.saveLFPPops) whose LFP is shown together with the 
+            total LFP in the time series and PSD plots; 'all' = all stored in sim.allSimData['LFPPops'] (default: None)
         - figSize ((width, height)): Size of figure (default: (10,8))
         - saveData (None|True|'fileName'): File name where to save the final data used to generate the figure; 
             if set to True uses filename from simConfig (default: None)
@@ -1698,6 +1754,18 @@ def plotLFP (electrodes = ['avg', 'all'], plots = ['timeSeries', 'PSD', 'spectro
 
     lfp = np.array(sim.allSimData['LFP'])
 
+    # LFP of each pop (or group of cells)
+    popsLFP = []  # (pop, LFP) in order shown
+    if pops:
+        allPopsLFP = sim.allSimData.get('LFPPops', {})
+        if not allPopsLFP:
+            print('  LFP of pops not available; set simConfig.saveLFPPops to store it')
+        for pop in (sorted(allPopsLFP, key=str) if pops == 'all' else pops):
+            if pop in allPopsLFP:
+                popsLFP.append((pop, np.array(allPopsLFP[pop])))
+            elif str(pop) in allPopsLFP:  # keys converted to str when saved to file
+                popsLFP.append((pop, np.array(allPopsLFP[str(pop)])))
+
     # time range
     if timeRange is None:
         timeRange = [0,sim.cfg.duration]
@@ -1728,12 +1796,19 @@ def plotLFP (electrodes = ['avg', 'all'], plots = ['timeSeries', 'PSD', 'spectro
                 lfpPlot = lfp[:, elec]
                 color = colorList[i%len(colorList)]
                 lw=1.0
-            plt.plot(t, -lfpPlot+(i*ydisp), color=color, linewidth=lw)
+            if popsLFP:  # total LFP in black, and LFP of each pop
+                color = 'k'
+                for ipop,(pop,popLFP) in enumerate(popsLFP):
+                    popLFPPlot = np.mean(popLFP, axis=1) if elec == 'avg' else popLFP[:, elec]
+                    plt.plot(t, -popLFPPlot+(i*ydisp), color=colorList[ipop%len(colorList)], linewidth=lw*0.75, 
+                        label=str(pop) if i == 0 else None)
+            plt.plot(t, -lfpPlot+(i*ydisp), color=color, linewidth=lw, label='total' if popsLFP and i == 0 else None)
             plt.text(-0.07*timeRange[1], (i*ydisp), elec, color=color, ha='center', va='top', fontsize=fontsiz, fontweight='bold')
 
         ax = plt.gca()
 
         # format plot
+        if popsLFP: plt.legend(fontsize=fontsiz-4, loc='upper right', frameon=False)
         plt.text(-0.14*timeRange[1], (len(electrodes)*ydisp)/2.0, 'LFP electrode', color='k', ha='left', va='bottom', fontsize=fontsiz, rotation=90)
         plt.ylim(-offset, (len(electrodes))*ydisp)
         ax.invert_yaxis()
@@ -1784,16 +1859,21 @@ def plotLFP (electrodes = ['avg', 'all'], plots = ['timeSeries', 'PSD', 'spectro
                 lw=1.5
             
             Fs = int(1000.0/sim.cfg.recordStep)
-            power = mlab.psd(lfpPlot, Fs=Fs, NFFT=NFFT, detrend=mlab.detrend_none, window=mlab.window_hanning, 
-                noverlap=noverlap, pad_to=None, sides='default', scale_by_freq=None)
-
-            if smooth:
-                signal = _smooth1d(10*np.log10(power[0]), smooth)
-            else:
-                signal = 10*np.log10(power[0])
-            freqs = power[1]
+            if popsLFP: color = 'k'  # total LFP in black, and LFP of each pop
+            lfpSignals = [('total', lfpPlot, color)] + [(pop, np.mean(popLFP, axis=1) if elec == 'avg' else popLFP[:, elec], 
+                colorList[ipop%len(colorList)]) for ipop,(pop,popLFP) in enumerate(popsLFP)]
+            for label,lfpSignal,lfpColor in lfpSignals:
+                power = mlab.psd(lfpSignal, Fs=Fs, NFFT=NFFT, detrend=mlab.detrend_none, window=mlab.window_hanning, 
+                    noverlap=noverlap, pad_to=None, sides='default', scale_by_freq=None)
+
+                if smooth:
+                    signal = _smooth1d(10*np.log10(power[0]), smooth)
+                else:
+                    signal = 10*np.log10(power[0])
+                freqs = power[1]
 
-            plt.plot(freqs[freqs<maxFreq], signal[freqs<maxFreq], linewidth=lw, color=color)
+                plt.plot(freqs[freqs<maxFreq], signal[freqs<maxFreq], linewidth=lw, color=lfpColor, label=str(label))
+            if popsLFP and i == 0: plt.legend(fontsize=fontsiz-4, loc='upper right', frameon=False)
             plt.xlim([0, maxFreq])
             plt.title('Electrode %s'%(str(elec)), fontsize=fontsiz-2)
             plt.ylabel('dB/Hz', fontsize=fontsiz)
@@ -1893,6 +1973,7 @@ def plotLFP (electrodes = ['avg', 'all'], plots = ['timeSeries', 'PSD', 'spectro
     if saveData:
         figData = {'LFP': lfp, 'electrodes': electrodes, 'timeRange': timeRange,
          'saveData': saveData, 'saveFig': saveFig, 'showFig': showFig}
+        if popsLFP: figData['LFPPops'] = {str(pop): popLFP for pop,popLFP in popsLFP}
     
         _saveFigData(figData, saveData, 'lfp')
 
@@ -1903,317 +1984,269 @@ def plotLFP (electrodes = ['avg', 'all'], plots = ['timeSeries', 'PSD', 'spectro
     return figs
 
 ######################################################################################################################################################
-## Support function for plotConn() - calculate conn using data from sim object
+## Support function for getConnMatrix() - arrays of the conns of post cells (one python pass over the conns)
 ######################################################################################################################################################
+def _getConnArrays(cellsConns, preGidIndex, synMechIndex, weightIndex, delayIndex, preLabelIndex, synOrConn, synMech):
+    ''' 
+    Return dict with arrays of postGid, preGid (-1 for NetStims), weight, delay, synMech and preLabel (label of NetStims, None for cells) 
+    of the conns of each (postGid, conns) in cellsConns; conns can use long (dict) or compact (list) format 
+    '''
+    allConns = [conn for postGid,cellConns in cellsConns for conn in cellConns]
+    connArrays = {'postGid': np.repeat(np.array([postGid for postGid,cellConns in cellsConns], dtype=int), [len(cellConns) for postGid,cellConns in cellsConns]),
+        'preGid': np.array([-1 if isinstance(conn[preGidIndex], basestring) else conn[preGidIndex] for conn in allConns], dtype=int)}
+
+    # keep only first conn from each presyn cell (as 'NetStim' preGid, one for all NetStims)
+    if synOrConn == 'conn' and len(allConns) > 0:
+        connKeys = connArrays['postGid'] * (connArrays['preGid'].max()+2) + connArrays['preGid'] + 1
+        keep = np.sort(np.unique(connKeys, return_index=True)[1])
+        allConns = [allConns[i] for i in keep]
+        connArrays = {key: values[keep] for key,values in connArrays.iteritems()}
+
+    connArrays['synMech'] = np.array([conn[synMechIndex] for conn in allConns], dtype=object)
+    connArrays['weight'] = np.array([conn[weightIndex] for conn in allConns], dtype=float)
+    connArrays['delay'] = np.array([conn[delayIndex] for conn in allConns], dtype=float)
+    connArrays['preLabel'] = np.array([None]*len(allConns), dtype=object)
+    for i in np.flatnonzero(connArrays['preGid'] == -1):
+        if isinstance(allConns[i], list):
+            connArrays['preLabel'][i] = allConns[i][preLabelIndex] if preLabelIndex >= 0 else 'NetStim'
+        else:
+            connArrays['preLabel'][i] = allConns[i].get(preLabelIndex, 'NetStim')
 
-def __plotConnCalculateFromSim__(includePre, includePost, feature, orderBy, groupBy, groupByInterval, synOrConn, synMech):
-
-    import sim
+    if synMech:
+        keep = np.array([connSynMech in synMech for connSynMech in connArrays['synMech']], dtype=bool)
+        connArrays = {key: values[keep] for key,values in connArrays.iteritems()}
 
-    def list_of_dict_unique_by_key(seq, key):
-        seen = set()
-        seen_add = seen.add
-        return [x for x in seq if x[key] not in seen and not seen_add(x[key])]
+    return connArrays
 
-    # adapt indices/keys based on compact vs long conn format
-    if sim.cfg.compactConnFormat: 
-        connsFormat = sim.cfg.compactConnFormat
 
-        # set indices of fields to read compact format (no keys)
-        missing = []
-        preGidIndex = connsFormat.index('preGid') if 'preGid' in connsFormat else missing.append('preGid')
-        synMechIndex = connsFormat.index('synMech') if 'synMech' in connsFormat else missing.append('synMech')
-        weightIndex = connsFormat.index('weight') if 'weight' in connsFormat else missing.append('weight')
-        delayIndex = connsFormat.index('delay') if 'delay' in connsFormat else missing.append('delay')
-        preLabelIndex = connsFormat.index('preLabel') if 'preLabel' in connsFormat else -1
-        
-        if len(missing) > 0:
-            print "  Error: cfg.compactConnFormat missing:"
-            print missing
-            return None, None, None 
-    else:  
-        # using long conn format (dict)
-        preGidIndex = 'preGid' 
-        synMechIndex = 'synMech'
-        weightIndex = 'weight'
-        delayIndex = 'delay'
-        preLabelIndex = 'preLabel'
-
-    # Calculate pre and post cells involved
-    cellsPre, cellGidsPre, netStimPopsPre = getCellsInclude(includePre)
-    if includePre == includePost:
-        cellsPost, cellGidsPost, netStimPopsPost = cellsPre, cellGidsPre, netStimPopsPre 
-    else:
-        cellsPost, cellGidsPost, netStimPopsPost = getCellsInclude(includePost) 
-
-    if isinstance(synMech, basestring): synMech = [synMech]  # make sure synMech is a list
-    
-    # Calculate matrix if grouped by cell
-    if groupBy == 'cell': 
-        if feature in ['weight', 'delay', 'numConns']: 
-            connMatrix = np.zeros((len(cellGidsPre), len(cellGidsPost)))
-            countMatrix = np.zeros((len(cellGidsPre), len(cellGidsPost)))
-        else: 
-            print 'Conn matrix with groupBy="cell" only supports features= "weight", "delay" or "numConns"'
-            return fig
-        cellIndsPre = {cell['gid']: ind for ind,cell in enumerate(cellsPre)}
-        cellIndsPost = {cell['gid']: ind for ind,cell in enumerate(cellsPost)}
+######################################################################################################################################################
+## Support function for getConnMatrix() - index of each gid in sorted array of gids (-1 if not included)
+######################################################################################################################################################
+def _getGidInds(gids, sortedGids):
+    inds = np.searchsorted(sortedGids, gids)
+    inds[inds >= len(sortedGids)] = 0
+    found = sortedGids[inds] == gids if len(sortedGids) > 0 else np.zeros(len(gids), dtype=bool)
+    return np.where(found & (gids >= 0), inds, -1)
 
-        # Order by
-        if len(cellsPre) > 0 and len(cellsPost) > 0:
-            if orderBy not in cellsPre[0]['tags'] or orderBy not in cellsPost[0]['tags']:  # if orderBy property doesn't exist or is not numeric, use gid
-                orderBy = 'gid'
-            elif not isinstance(cellsPre[0]['tags'][orderBy], Number) or not isinstance(cellsPost[0]['tags'][orderBy], Number): 
-                orderBy = 'gid' 
-        
-            if orderBy == 'gid': 
-                yorderPre = [cell[orderBy] for cell in cellsPre]
-                yorderPost = [cell[orderBy] for cell in cellsPost]
-            else:
-                yorderPre = [cell['tags'][orderBy] for cell in cellsPre]
-                yorderPost = [cell['tags'][orderBy] for cell in cellsPost]
-
-            sortedGidsPre = {gid:i for i,(y,gid) in enumerate(sorted(zip(yorderPre,cellGidsPre)))}
-            cellIndsPre = sortedGidsPre
-            if includePre == includePost:
-                sortedGidsPost = sortedGidsPre
-                cellIndsPost = cellIndsPre
-            else:
-                sortedGidsPost = {gid:i for i,(y,gid) in enumerate(sorted(zip(yorderPost,cellGidsPost)))}
-                cellIndsPost = sortedGidsPost
 
+######################################################################################################################################################
+## Support function for getConnMatrix() - group conn matrices (pre x post cells) into (pre x post groups) using sparse group indicator matrices
+######################################################################################################################################################
+def _groupConnMatrices(matrices, groupsPre, numGroupsPre, groupsPost, numGroupsPost):
+    from scipy.sparse import csr_matrix
 
-        # Calculate conn matrix
-        for cell in cellsPost:  # for each postsyn cell
+    def indicatorMatrix(groups, numGroups):  # (cells x groups) matrix with 1 if cell in group (group -1 = not included)
+        groups = np.asarray(groups, dtype=int)
+        cells = np.flatnonzero(groups >= 0)
+        return csr_matrix((np.ones(len(cells)), (cells, groups[cells])), shape=(len(groups), numGroups))
 
-            if synOrConn=='syn':
-                cellConns = cell['conns'] # include all synapses 
-            else:
-                cellConns = list_of_dict_unique_by_key(cell['conns'], preGidIndex)
+    groupMatPre = indicatorMatrix(groupsPre, numGroupsPre).T.tocsr()
+    groupMatPost = indicatorMatrix(groupsPost, numGroupsPost)
+    return [groupMatPre.dot(matrix).dot(groupMatPost).toarray() for matrix in matrices]
 
-            if synMech:
-                cellConns = [conn for conn in cellConns if conn[synMechIndex] in synMech]
 
-            for conn in cellConns:
-                if conn[preGidIndex] != 'NetStim' and conn[preGidIndex] in cellIndsPre:
-                    if feature in ['weight', 'delay']: 
-                        if conn[preGidIndex] in cellIndsPre:
-                            connMatrix[cellIndsPre[conn[preGidIndex]], cellIndsPost[cell['gid']]] += conn[feature]
-                    countMatrix[cellIndsPre[conn[preGidIndex]], cellIndsPost[cell['gid']]] += 1
+######################################################################################################################################################
+## Support function for getConnMatrix() - calculate conn matrix of feature from conn arrays using sparse (pre x post cells) matrices
+######################################################################################################################################################
+def _calculateConnMatrix(connArrays, gidsPre, gidsPost, tagsPre, tagsPost, popOrder, netStimPopsPre, netStimPopsPost, 
+                        feature, orderBy, groupBy, groupByInterval, sparse):
+    ''' 
+    gidsPre, gidsPost: sorted arrays of gids of pre and post cells; tagsPre, tagsPost: functions returning list of values of a tag of pre/post cells
+    (in gid order; None if tag not available); popOrder: list of pops used to order pops
+    '''
+    from scipy.sparse import coo_matrix
+
+    # sparse matrices (pre cells + NetStim pops x post cells) with num of conns and sum of weights and delays
+    preInds = _getGidInds(connArrays['preGid'], gidsPre)
+    postInds = _getGidInds(connArrays['postGid'], gidsPost)
+    isNetStim = connArrays['preGid'] == -1
+    netStimInds = {pop: len(gidsPre)+i for i,pop in enumerate(netStimPopsPre)}
+    preInds[isNetStim] = [netStimInds.get(preLabel, -1) for preLabel in connArrays['preLabel'][isNetStim]]
+    valid = (preInds >= 0) & (postInds >= 0)
+    shape = (len(gidsPre)+len(netStimPopsPre), len(gidsPost))
+    countMatrix, weightMatrix, delayMatrix = [coo_matrix((values[valid], (preInds[valid], postInds[valid])), shape=shape).tocsr() 
+                                            for values in [np.ones(len(preInds)), connArrays['weight'], connArrays['delay']]]
+
+    def isNumericTag(tags, tag):  # tag available and numeric in first cell
+        values = tags(tag)
+        return values is not None and (len(values) == 0 or isinstance(values[0], Number))
 
-        if feature in ['weight', 'delay']: connMatrix = connMatrix / countMatrix 
-        elif feature in ['numConns']: connMatrix = countMatrix 
+    # Calculate matrix if grouped by cell
+    if groupBy == 'cell': 
+        if feature not in ['weight', 'delay', 'numConns']: 
+            print 'Conn matrix with groupBy="cell" only supports features= "weight", "delay" or "numConns"'
+            return None, None, None 
 
-        pre, post = cellsPre, cellsPost 
+        # Order by
+        if len(gidsPre) == 0 or len(gidsPost) == 0 or not isNumericTag(tagsPre, orderBy) or not isNumericTag(tagsPost, orderBy):  
+            orderBy = 'gid'  # if orderBy property doesn't exist or is not numeric, use gid
+        orderPre = np.lexsort((gidsPre, tagsPre(orderBy))) if orderBy != 'gid' else np.arange(len(gidsPre))
+        orderPost = np.lexsort((gidsPost, tagsPost(orderBy))) if orderBy != 'gid' else np.arange(len(gidsPost))
+        matrices = [matrix[:len(gidsPre)][orderPre][:, orderPost].tocsr() for matrix in [countMatrix, weightMatrix, delayMatrix]]
+
+        if feature == 'numConns': 
+            connMatrix = matrices[0]
+        else:  # avg weight or delay per conn
+            connMatrix = (matrices[1] if feature == 'weight' else matrices[2]).multiply(matrices[0].power(-1)).tocsr()
+        if not sparse:
+            connMatrix = connMatrix.toarray()
+            if feature != 'numConns': connMatrix[matrices[0].toarray() == 0] = np.nan  # no conns
+
+        return connMatrix, gidsPre[orderPre], gidsPost[orderPost]
 
     # Calculate matrix if grouped by pop
     elif groupBy == 'pop': 
         
         # get list of pops
-        popsTempPre = list(set([cell['tags']['pop'] for cell in cellsPre]))
-        popsPre = [pop for pop in sim.net.allPops if pop in popsTempPre]+netStimPopsPre
+        popsOfPre, popsOfPost = tagsPre('pop'), tagsPost('pop')
+        popsPre = [pop for pop in popOrder if pop in set(popsOfPre)]+netStimPopsPre
         popIndsPre = {pop: ind for ind,pop in enumerate(popsPre)}
+        popsPost = [pop for pop in popOrder if pop in set(popsOfPost)]+netStimPopsPost
+        popIndsPost = {pop: ind for ind,pop in enumerate(popsPost)}
+        groupsPre = [popIndsPre[pop] for pop in popsOfPre] + [popIndsPre[pop] for pop in netStimPopsPre]
+        groupsPost = [popIndsPost[pop] for pop in popsOfPost]
 
-        if includePre == includePost:
-            popsPost = popsPre
-            popIndsPost = popIndsPre
-        else:
-            popsTempPost = list(set([cell['tags']['pop'] for cell in cellsPost]))
-            popsPost = [pop for pop in sim.net.allPops if pop in popsTempPost]+netStimPopsPost
-            popIndsPost = {pop: ind for ind,pop in enumerate(popsPost)}
-        
-        # initialize matrices
-        if feature in ['weight', 'strength']: 
-            weightMatrix = np.zeros((len(popsPre), len(popsPost)))
-        elif feature == 'delay': 
-            delayMatrix = np.zeros((len(popsPre), len(popsPost)))
-        countMatrix = np.zeros((len(popsPre), len(popsPost)))
-        
         # calculate max num conns per pre and post pair of pops
-        numCellsPopPre = {}
-        for pop in popsPre:
-            if pop in netStimPopsPre:
-                numCellsPopPre[pop] = -1
-            else:
-                numCellsPopPre[pop] = len([cell for cell in cellsPre if cell['tags']['pop']==pop])
-
-        if includePre == includePost:
-            numCellsPopPost = numCellsPopPre
-        else:
-            numCellsPopPost = {}
-            for pop in popsPost:
-                if pop in netStimPopsPost:
-                    numCellsPopPost[pop] = -1
-                else:
-                    numCellsPopPost[pop] = len([cell for cell in cellsPost if cell['tags']['pop']==pop])
+        numCellsPre = np.bincount(np.array(groupsPre[:len(gidsPre)], dtype=int), minlength=len(popsPre))
+        numCellsPost = np.bincount(np.array(groupsPost, dtype=int), minlength=len(popsPost))
+        numCellsPopPre = {pop: -1 if pop in netStimPopsPre else numCellsPre[ipop] for ipop,pop in enumerate(popsPre)}
+        numCellsPopPost = {pop: -1 if pop in netStimPopsPost else numCellsPost[ipop] for ipop,pop in enumerate(popsPost)}
 
         maxConnMatrix = np.zeros((len(popsPre), len(popsPost)))
-        if feature == 'convergence': maxPostConnMatrix = np.zeros((len(popsPre), len(popsPost)))
-        if feature == 'divergence': maxPreConnMatrix = np.zeros((len(popsPre), len(popsPost)))
+        maxPostConnMatrix = np.zeros((len(popsPre), len(popsPost)))
+        maxPreConnMatrix = np.zeros((len(popsPre), len(popsPost)))
         for prePop in popsPre:
             for postPop in popsPost: 
                 if numCellsPopPre[prePop] == -1: numCellsPopPre[prePop] = numCellsPopPost[postPop]
                 maxConnMatrix[popIndsPre[prePop], popIndsPost[postPop]] = numCellsPopPre[prePop]*numCellsPopPost[postPop]
-                if feature == 'convergence': maxPostConnMatrix[popIndsPre[prePop], popIndsPost[postPop]] = numCellsPopPost[postPop]
-                if feature == 'divergence': maxPreConnMatrix[popIndsPre[prePop], popIndsPost[postPop]] = numCellsPopPre[prePop]
-        
-        # Calculate conn matrix
-        for cell in cellsPost:  # for each postsyn cell
-
-            if synOrConn=='syn':
-                cellConns = cell['conns'] # include all synapses 
-            else:
-                cellConns = list_of_dict_unique_by_key(cell['conns'], preGidIndex)
-
-            if synMech:
-                cellConns = [conn for conn in cellConns if conn[synMechIndex] in synMech]
-
-            for conn in cellConns:
-                if conn[preGidIndex] == 'NetStim':
-                    prePopLabel = conn[preLabelIndex] if preLabelIndex in conn else 'NetStim'
-                else:
-                    preCell = next((cell for cell in cellsPre if cell['gid']==conn[preGidIndex]), None)
-                    prePopLabel = preCell['tags']['pop'] if preCell else None
-                
-                if prePopLabel in popIndsPre:
-                    if feature in ['weight', 'strength']: 
-                        weightMatrix[popIndsPre[prePopLabel], popIndsPost[cell['tags']['pop']]] += conn[weightIndex]
-                    elif feature == 'delay': 
-                        delayMatrix[popIndsPre[prePopLabel], popIndsPost[cell['tags']['pop']]] += conn[delayIndex] 
-                    countMatrix[popIndsPre[prePopLabel], popIndsPost[cell['tags']['pop']]] += 1    
+                maxPostConnMatrix[popIndsPre[prePop], popIndsPost[postPop]] = numCellsPopPost[postPop]
+                maxPreConnMatrix[popIndsPre[prePop], popIndsPost[postPop]] = numCellsPopPre[prePop]
 
         pre, post = popsPre, popsPost 
     
     # Calculate matrix if grouped by numeric tag (eg. 'y')
-    elif groupBy in sim.net.allCells[0]['tags'] and isinstance(sim.net.allCells[0]['tags'][groupBy], Number):
+    elif isNumericTag(tagsPre, groupBy) and isNumericTag(tagsPost, groupBy) and groupBy != 'gid':
         if not isinstance(groupByInterval, Number):
             print 'groupByInterval not specified'
-            return
+            return None, None, None
   
         # group cells by 'groupBy' feature (eg. 'y') in intervals of 'groupByInterval')
-        cellValuesPre = [cell['tags'][groupBy] for cell in cellsPre]
-        minValuePre = _roundFigures(groupByInterval * np.floor(min(cellValuesPre) / groupByInterval), 3)
-        maxValuePre  = _roundFigures(groupByInterval * np.ceil(max(cellValuesPre) / groupByInterval), 3)        
-        groupsPre = np.arange(minValuePre, maxValuePre, groupByInterval)
-        groupsPre = [_roundFigures(x,3) for x in groupsPre]
-
-        if includePre == includePost:
-            groupsPost = groupsPre       
-        else:
-            cellValuesPost = [cell['tags'][groupBy] for cell in cellsPost]
-            minValuePost = _roundFigures(groupByInterval * np.floor(min(cellValuesPost) / groupByInterval), 3)
-            maxValuePost  = _roundFigures(groupByInterval * np.ceil(max(cellValuesPost) / groupByInterval), 3)        
-            groupsPre = np.arange(minValuePost, maxValuePost, groupByInterval)
-            groupsPre = [_roundFigures(x,3) for x in groupsPost]
-
+        def cellGroups(values):  # groups (start of interval) and group index of each cell
+            if len(values) == 0: 
+                return [], []
+            minValue = _roundFigures(groupByInterval * np.floor(min(values) / groupByInterval), 3)
+            maxValue  = _roundFigures(groupByInterval * np.ceil(max(values) / groupByInterval), 3)        
+            groups = [_roundFigures(x,3) for x in np.arange(minValue, maxValue, groupByInterval)]
+            values = np.array(values, dtype=float)
+            inds = np.searchsorted(groups, values, side='right') - 1
+            inInterval = (inds >= 0) & (values < np.array(groups+[np.inf])[inds] + groupByInterval)  # groupStart <= value < groupStart+groupByInterval
+            return groups, np.where(inInterval, inds, -1)
+
+        groupsPre, groupsOfPre = cellGroups(tagsPre(groupBy))
+        groupsPost, groupsOfPost = cellGroups(tagsPost(groupBy))
 
         if len(groupsPre) < 2 or len(groupsPost) < 2: 
             print 'groupBy %s with groupByInterval %s results in <2 groups'%(str(groupBy), str(groupByInterval))
-            return
-        groupIndsPre = {group: ind for ind,group in enumerate(groupsPre)}
-        groupIndsPost = {group: ind for ind,group in enumerate(groupsPost)}
-        
-        # initialize matrices
-        if feature in ['weight', 'strength']: 
-            weightMatrix = np.zeros((len(groupsPre), len(groupsPost)))
-        elif feature == 'delay': 
-            delayMatrix = np.zeros((len(groupsPre), len(groupsPost)))
-        countMatrix = np.zeros((len(groupsPre), len(groupsPost)))
+            return None, None, None
+        groupsOfPre = list(groupsOfPre) + [-1]*len(netStimPopsPre)  # NetStims not included
 
-        # calculate max num conns per pre and post pair of pops
-        numCellsGroupPre = {}
-        for groupPre in groupsPre:
-            numCellsGroupPre[groupPre] = len([cell for cell in cellsPre if groupPre <= cell['tags'][groupBy] < (groupPre+groupByInterval)])
-        
-        if includePre == includePost:
-            numCellsGroupPost = numCellsGroupPre  
-        else:
-            numCellsGroupPost = {}
-            for groupPost in groupsPost:
-                numCellsGroupPost[groupPost] = len([cell for cell in cellsPost if groupPost <= cell['tags'][groupBy] < (groupPost+groupByInterval)])
-
-
-        maxConnMatrix = np.zeros((len(groupsPre), len(groupsPost)))
-        if feature == 'convergence': maxPostConnMatrix = np.zeros((len(groupsPre), len(groupsPost)))
-        if feature == 'divergence': maxPreConnMatrix = np.zeros((len(groupsPre), len(groupsPost)))
-        for preGroup in groupsPre:
-            for postGroup in groupsPost: 
-                if numCellsGroupPre[preGroup] == -1: numCellsGroupPre[preGroup] = numCellsGroupPost[postGroup]
-                maxConnMatrix[groupIndsPre[preGroup], groupIndsPost[postGroup]] = numCellsGroupPre[preGroup]*numCellsGroupPost[postGroup]
-                if feature == 'convergence': maxPostConnMatrix[groupIndsPre[prePop], groupIndsPost[postGroup]] = numCellsPopPost[postGroup]
-                if feature == 'divergence': maxPreConnMatrix[groupIndsPre[preGroup], groupIndsPost[postGroup]] = numCellsPopPre[preGroup]
-        
-        # Calculate conn matrix
-        for cell in cellsPost:  # for each postsyn cell
-            if synOrConn=='syn':
-                cellConns = cell['conns'] # include all synapses 
-            else:
-                cellConns = list_of_dict_unique_by_key(cell['conns'], preGidIndex)
-
-            if synMech:
-                cellConns = [conn for conn in cellConns if conn[synMechIndex] in synMech]
-
-            for conn in cellConns:
-                if conn[preGidIndex] == 'NetStim':
-                    prePopLabel = -1  # maybe add in future
-                else:
-                    preCell = next((c for c in cellsPre if cell['gid']==conn[preGidIndex]), None)
-                    if preCell:
-                        preGroup = _roundFigures(groupByInterval * np.floor(preCell['tags'][groupBy] / groupByInterval), 3)
-                    else:
-                        None
-
-                postGroup = _roundFigures(groupByInterval * np.floor(cell['tags'][groupBy] / groupByInterval), 3)
-
-                #print groupInds
-                if preGroup in groupIndsPre:
-                    if feature in ['weight', 'strength']: 
-                        weightMatrix[groupIndsPre[preGroup], groupIndsPost[postGroup]] += conn[weightIndex]
-                    elif feature == 'delay': 
-                        delayMatrix[groupIndsPre[preGroup], groupIndsPost[postGroup]] += conn[delayIndex] 
-                    countMatrix[groupIndsPre[preGroup], groupIndsPost[postGroup]] += 1   
+        # calculate max num conns per pre and post pair of groups
+        numCellsPre = np.bincount(np.array([group for group in groupsOfPre if group >= 0], dtype=int), minlength=len(groupsPre))
+        numCellsPost = np.bincount(groupsOfPost[groupsOfPost >= 0], minlength=len(groupsPost))
+        maxConnMatrix = np.outer(numCellsPre, numCellsPost).astype(float)
+        maxPostConnMatrix = np.tile(numCellsPost, (len(groupsPre), 1)).astype(float)
+        maxPreConnMatrix = np.tile(numCellsPre[:, np.newaxis], (1, len(groupsPost))).astype(float)
 
         pre, post = groupsPre, groupsPost 
+        groupsPre, groupsPost = groupsOfPre, groupsOfPost
 
     # no valid groupBy
     else:  
         print 'groupBy (%s) is not valid'%(str(groupBy))
-        return
+        return None, None, None
 
-    if groupBy != 'cell':
-        if feature == 'weight': 
-            connMatrix = weightMatrix / countMatrix  # avg weight per conn (fix to remove divide by zero warning) 
-        elif feature == 'delay': 
-            connMatrix = delayMatrix / countMatrix
-        elif feature == 'numConns':
-            connMatrix = countMatrix
-        elif feature in ['probability', 'strength']:
-            connMatrix = countMatrix / maxConnMatrix  # probability
-            if feature == 'strength':
-                connMatrix = connMatrix * weightMatrix  # strength
-        elif feature == 'convergence':
-            connMatrix = countMatrix / maxPostConnMatrix
-        elif feature == 'divergence':
-            connMatrix = countMatrix / maxPreConnMatrix
+    # sum conns of cells of each group
+    countMatrix, weightMatrix, delayMatrix = _groupConnMatrices([countMatrix, weightMatrix, delayMatrix], groupsPre, len(pre), groupsPost, len(post))
+
+    if feature == 'weight': 
+        connMatrix = weightMatrix / countMatrix  # avg weight per conn (fix to remove divide by zero warning) 
+    elif feature == 'delay': 
+        connMatrix = delayMatrix / countMatrix
+    elif feature == 'numConns':
+        connMatrix = countMatrix
+    elif feature in ['probability', 'strength']:
+        connMatrix = countMatrix / maxConnMatrix  # probability
+        if feature == 'strength':
+            connMatrix = connMatrix * weightMatrix  # strength
+    elif feature == 'convergence':
+        connMatrix = countMatrix / maxPostConnMatrix
+    elif feature == 'divergence':
+        connMatrix = countMatrix / maxPreConnMatrix
 
     return connMatrix, pre, post
 
 
+######################################################################################################################################################
+## Support function for plotConn() - calculate conn using data from sim object
+######################################################################################################################################################
+
+def __plotConnCalculateFromSim__(includePre, includePost, feature, orderBy, groupBy, groupByInterval, synOrConn, synMech, sparse=False):
+
+    import sim
+
+    # adapt indices/keys based on compact vs long conn format
+    if sim.cfg.compactConnFormat: 
+        connsFormat = sim.cfg.compactConnFormat
+
+        # set indices of fields to read compact format (no keys)
+        missing = []
+        preGidIndex = connsFormat.index('preGid') if 'preGid' in connsFormat else missing.append('preGid')
+        synMechIndex = connsFormat.index('synMech') if 'synMech' in connsFormat else missing.append('synMech')
+        weightIndex = connsFormat.index('weight') if 'weight' in connsFormat else missing.append('weight')
+        delayIndex = connsFormat.index('delay') if 'delay' in connsFormat else missing.append('delay')
+        preLabelIndex = connsFormat.index('preLabel') if 'preLabel' in connsFormat else -1
+        
+        if len(missing) > 0:
+            print "  Error: cfg.compactConnFormat missing:"
+            print missing
+            return None, None, None 
+    else:  
+        # using long conn format (dict)
+        preGidIndex = 'preGid' 
+        synMechIndex = 'synMech'
+        weightIndex = 'weight'
+        delayIndex = 'delay'
+        preLabelIndex = 'preLabel'
+
+    # Calculate pre and post cells involved
+    cellsPre, cellGidsPre, netStimPopsPre = getCellsInclude(includePre)
+    if includePre == includePost:
+        cellsPost, cellGidsPost, netStimPopsPost = cellsPre, cellGidsPre, netStimPopsPre 
+    else:
+        cellsPost, cellGidsPost, netStimPopsPost = getCellsInclude(includePost) 
+
+    if isinstance(synMech, basestring): synMech = [synMech]  # make sure synMech is a list
+
+    def cellTags(cells):  # function returning values of tag of cells
+        return lambda tag: [cell['gid'] for cell in cells] if tag == 'gid' else \
+            [cell['tags'][tag] for cell in cells] if len(cells) == 0 or tag in cells[0]['tags'] else None
+
+    connArrays = _getConnArrays([(cell['gid'], cell['conns']) for cell in cellsPost], preGidIndex, synMechIndex, weightIndex, delayIndex, preLabelIndex, synOrConn, synMech)
+    
+    return _calculateConnMatrix(connArrays, cellGidsPre, cellGidsPost, cellTags(cellsPre), cellTags(cellsPost), list(sim.net.allPops), netStimPopsPre, netStimPopsPost,
+                                feature, orderBy, groupBy, groupByInterval, sparse)
+
+
 ######################################################################################################################################################
 ## Support function for plotConn() - calculate conn using data from files with short format (no keys)
 ######################################################################################################################################################
 
-def __plotConnCalculateFromFile__(includePre, includePost, feature, orderBy, groupBy, groupByInterval, synOrConn, synMech, connsFile, tagsFile):
+def __plotConnCalculateFromFile__(includePre, includePost, feature, orderBy, groupBy, groupByInterval, synOrConn, synMech, connsFile, tagsFile, sparse=False):
     
     import sim
     import json
     from time import time    
 
-    def list_of_dict_unique_by_key(seq, index):
-        seen = set()
-        seen_add = seen.add
-        return [x for x in seq if x[index] not in seen and not seen_add(x[index])]
-
     # load files with tags and conns
     start = time()
     tags, conns = None, None
@@ -2259,121 +2292,48 @@ def __plotConnCalculateFromFile__(includePre, includePost, feature, orderBy, gro
         return None, None, None 
 
     if isinstance(synMech, basestring): synMech = [synMech]  # make sure synMech is a list
-    
-    # Calculate matrix if grouped by cell
-    if groupBy == 'cell': 
-        print 'plotConn from file for groupBy=cell not implemented yet'
-        return None, None, None 
 
-    # Calculate matrix if grouped by pop
-    elif groupBy == 'pop': 
-        
-        # get list of pops
-        print '    Obtaining list of populations ...'
-        popsPre = list(set([tags[gid][popIndex] for gid in cellGidsPre]))
-        popIndsPre = {pop: ind for ind,pop in enumerate(popsPre)}
-        netStimPopsPre = []  # netstims not yet supported
-        netStimPopsPost = []
+    def cellTags(gids):  # function returning values of tag of cells
+        return lambda tag: list(gids) if tag == 'gid' else \
+            [tags[gid][tagsFormat.index(tag)] for gid in gids] if tag in tagsFormat else None
 
-        if includePre == includePost:
-            popsPost = popsPre
-            popIndsPost = popIndsPre
-        else:
-            popsPost = list(set([tags[gid][popIndex] for gid in cellGidsPost]))
-            popIndsPost = {pop: ind for ind,pop in enumerate(popsPost)}
-        
-        # initialize matrices
-        if feature in ['weight', 'strength']: 
-            weightMatrix = np.zeros((len(popsPre), len(popsPost)))
-        elif feature == 'delay': 
-            delayMatrix = np.zeros((len(popsPre), len(popsPost)))
-        countMatrix = np.zeros((len(popsPre), len(popsPost)))
-        
-        # calculate max num conns per pre and post pair of pops
-        print '    Calculating max num conns for each pair of population ...'
-        numCellsPopPre = {}
-        for pop in popsPre:
-            if pop in netStimPopsPre:
-                numCellsPopPre[pop] = -1
-            else:
-                numCellsPopPre[pop] = len([gid for gid in cellGidsPre if tags[gid][popIndex]==pop])
+    print '    Calculating weights, strength, prob, delay etc matrices ...'
+    connArrays = _getConnArrays([(gid, conns.get(gid, [])) for gid in cellGidsPost], preGidIndex, synMechIndex, weightIndex, delayIndex, preLabelIndex, synOrConn, synMech)
+    popOrder = sim.unique([tags[gid][popIndex] for gid in cellGidsPre] + [tags[gid][popIndex] for gid in cellGidsPost])  # netstims not yet supported
 
-        if includePre == includePost:
-            numCellsPopPost = numCellsPopPre
-        else:
-            numCellsPopPost = {}
-            for pop in popsPost:
-                if pop in netStimPopsPost:
-                    numCellsPopPost[pop] = -1
-                else:
-                    numCellsPopPost[pop] = len([gid for gid in cellGidsPost if tags[gid][popIndex]==pop])
-
-        maxConnMatrix = np.zeros((len(popsPre), len(popsPost)))
-        if feature == 'convergence': maxPostConnMatrix = np.zeros((len(popsPre), len(popsPost)))
-        if feature == 'divergence': maxPreConnMatrix = np.zeros((len(popsPre), len(popsPost)))
-        for prePop in popsPre:
-            for postPop in popsPost: 
-                if numCellsPopPre[prePop] == -1: numCellsPopPre[prePop] = numCellsPopPost[postPop]
-                maxConnMatrix[popIndsPre[prePop], popIndsPost[postPop]] = numCellsPopPre[prePop]*numCellsPopPost[postPop]
-                if feature == 'convergence': maxPostConnMatrix[popIndsPre[prePop], popIndsPost[postPop]] = numCellsPopPost[postPop]
-                if feature == 'divergence': maxPreConnMatrix[popIndsPre[prePop], popIndsPost[postPop]] = numCellsPopPre[prePop]
-        
-        # Calculate conn matrix
-        print '    Calculating weights, strength, prob, delay etc matrices ...'
-        for postGid in cellGidsPost:  # for each postsyn cell
-            print '     cell %d'%(int(postGid))
-            if synOrConn=='syn':
-                cellConns = conns[postGid] # include all synapses 
-            else:
-                cellConns = list_of_dict_unique_by_index(conns[postGid], preGidIndex)
-
-            if synMech:
-                cellConns = [conn for conn in cellConns if conn[synMechIndex] in synMech]
-
-            for conn in cellConns:
-                if conn[preGidIndex] == 'NetStim':
-                    prePopLabel = conn[preLabelIndex] if preLabelIndex >=0 else 'NetStims'
-                else:
-                    preCellGid = next((gid for gid in cellGidsPre if gid==conn[preGidIndex]), None)
-                    prePopLabel = tags[preCellGid][popIndex] if preCellGid else None
-                
-                if prePopLabel in popIndsPre:
-                    if feature in ['weight', 'strength']: 
-                        weightMatrix[popIndsPre[prePopLabel], popIndsPost[tags[postGid][popIndex]]] += conn[weightIndex]
-                    elif feature == 'delay': 
-                        delayMatrix[popIndsPre[prePopLabel], popIndsPost[tags[postGid][popIndex]]] += conn[delayIndex] 
-                    countMatrix[popIndsPre[prePopLabel], popIndsPost[tags[postGid][popIndex]]] += 1    
+    connMatrix, pre, post = _calculateConnMatrix(connArrays, cellGidsPre, cellGidsPost, cellTags(cellGidsPre), cellTags(cellGidsPost), popOrder, [], [],
+                                                feature, orderBy, groupBy, groupByInterval, sparse)
+    print '    plotting ...'
+    return connMatrix, pre, post
 
-        pre, post = popsPre, popsPost 
-    
-    # Calculate matrix if grouped by numeric tag (eg. 'y')
-    elif groupBy in sim.net.allCells[0]['tags'] and isinstance(sim.net.allCells[0]['tags'][groupBy], Number):
-        print 'plotConn from file for groupBy=[arbitrary property] not implemented yet'
-        return None, None, None 
 
-    # no valid groupBy
-    else:  
-        print 'groupBy (%s) is not valid'%(str(groupBy))
-        return
+######################################################################################################################################################
+## Get connectivity matrix
+######################################################################################################################################################
+def getConnMatrix (includePre = ['all'], includePost = ['all'], feature = 'strength', orderBy = 'gid', groupBy = 'pop', groupByInterval = None, 
+                synOrConn = 'syn', synMech = None, connsFile = None, tagsFile = None, sparse = False):
+    ''' 
+    Calculate connectivity matrix
+        - includePre (['all',|'allCells','allNetStims',|,120,|,'E1'|,('L2', 56)|,('L5',[4,5,6])]): Presynaptic cells (default: ['all'])
+        - includePost (['all',|'allCells','allNetStims',|,120,|,'E1'|,('L2', 56)|,('L5',[4,5,6])]): Postsynaptic cells (default: ['all'])
+        - feature ('weight'|'delay'|'numConns'|'probability'|'strength'|'convergence'|'divergence'): Feature of conns in matrix; 
+            the only features applicable to groupBy='cell' are 'weight', 'delay' and 'numConns';  'strength' = weight * probability (default: 'strength')
+        - orderBy ('gid'|'y'|'ynorm'|...): Unique numeric cell property to order rows and columns by (requires groupBy='cell') (default: 'gid')
+        - groupBy ('pop'|'cell'|'y'|: Matrix for individual cells, populations, or by other numeric tag such as 'y' (default: 'pop')
+        - groupByInterval (int or float): Interval of groupBy feature to group cells by, e.g. 100 to group by cortical depth in steps of 100 um (default: None)
+        - synOrConn ('syn'|'conn'): Use synapses or connections; note 1 connection can have multiple synapses (default: 'syn')
+        - synMech (['AMPA', 'GABAA',...]): Include only conns with these syn mechs (default: None)
+        - connsFile, tagsFile (None|'fileName'): json files with conns and tags (compact format) used instead of sim data (default: None)
+        - sparse (True|False): Return scipy.sparse CSR matrix (only conns stored) if groupBy='cell' (default: False)
 
-    if groupBy != 'cell':
-        if feature == 'weight': 
-            connMatrix = weightMatrix / countMatrix  # avg weight per conn (fix to remove divide by zero warning) 
-        elif feature == 'delay': 
-            connMatrix = delayMatrix / countMatrix
-        elif feature == 'numConns':
-            connMatrix = countMatrix
-        elif feature in ['probability', 'strength']:
-            connMatrix = countMatrix / maxConnMatrix  # probability
-            if feature == 'strength':
-                connMatrix = connMatrix * weightMatrix  # strength
-        elif feature == 'convergence':
-            connMatrix = countMatrix / maxPostConnMatrix
-        elif feature == 'divergence':
-            connMatrix = countMatrix / maxPreConnMatrix
+        - Returns conn matrix (pre x post), and pre and post labels: pops (groupBy='pop'), start of intervals (groupBy tag) 
+          or gids in order of rows/columns (groupBy='cell'); None if error
+    '''
 
-    print '    plotting ...'
-    return connMatrix, pre, post
+    if connsFile and tagsFile:
+        return __plotConnCalculateFromFile__(includePre, includePost, feature, orderBy, groupBy, groupByInterval, synOrConn, synMech, connsFile, tagsFile, sparse)
+    else:
+        return __plotConnCalculateFromSim__(includePre, includePost, feature, orderBy, groupBy, groupByInterval, synOrConn, synMech, sparse)
 
 
 ######################################################################################################################################################
@@ -2408,10 +2368,7 @@ def plotConn (includePre = ['all'], includePost = ['all'], feature = 'strength',
 
     print('Plotting connectivity matrix...')
 
-    if connsFile and tagsFile:
-        connMatrix, pre, post = __plotConnCalculateFromFile__(includePre, includePost, feature, orderBy, groupBy, groupByInterval, synOrConn, synMech, connsFile, tagsFile)
-    else:
-        connMatrix, pre, post = __plotConnCalculateFromSim__(includePre, includePost, feature, orderBy, groupBy, groupByInterval, synOrConn, synMech)
+    connMatrix, pre, post = getConnMatrix(includePre, includePost, feature, orderBy, groupBy, groupByInterval, synOrConn, synMech, connsFile, tagsFile)
 
 
     if connMatrix is None:
@@ -2698,13 +2655,13 @@ def calculateDisynaptic(includePost = ['allCells'], includePre = ['allCells'], i
     print '  Calculating disynaptic connections...'
     # loading from json files    
     if tags and conns:
-        cellsPreGids = getCellsIncludeTags(includePre, tags)
-        cellsPrePreGids = getCellsIncludeTags(includePrePre, tags)
+        cellsPreGids = set(getCellsIncludeTags(includePre, tags))
+        cellsPrePreGids = set(getCellsIncludeTags(includePrePre, tags))
         cellsPostGids = getCellsIncludeTags(includePost, tags)
 
         preGidIndex = conns['format'].index('preGid') if 'format' in conns else 0
         for postGid in cellsPostGids:
-            preGidsAll = [conn[preGidIndex] for conn in conns[postGid] if isinstance(conn[preGidIndex], Number) and conn[preGidIndex] in cellsPreGids+cellsPrePreGids]
+            preGidsAll = [conn[preGidIndex] for conn in conns[postGid] if isinstance(conn[preGidIndex], Number) and conn[preGidIndex] in cellsPreGids|cellsPrePreGids]
             preGids = [gid for gid in preGidsAll if gid in cellsPreGids]
             for preGid in preGids:
                 prePreGids = [conn[preGidIndex] for conn in conns[preGid] if conn[preGidIndex] in cellsPrePreGids]
@@ -2724,11 +2681,12 @@ def calculateDisynaptic(includePost = ['allCells'], includePre = ['allCells'], i
 
         _, cellsPreGids, _ =  getCellsInclude(includePre)
         _, cellsPrePreGids, _ = getCellsInclude(includePrePre)
+        cellsPreGids, cellsPrePreGids = set(cellsPreGids), set(cellsPrePreGids)
         cellsPost, _, _ = getCellsInclude(includePost)
 
         for postCell in cellsPost:
             print postCell['gid']
-            preGidsAll = [conn[preGidIndex] for conn in postCell['conns'] if isinstance(conn[preGidIndex], Number) and conn[preGidIndex] in cellsPreGids+cellsPrePreGids]
+            preGidsAll = [conn[preGidIndex] for conn in postCell['conns'] if isinstance(conn[preGidIndex], Number) and conn[preGidIndex] in cellsPreGids|cellsPrePreGids]
             preGids = [gid for gid in preGidsAll if gid in cellsPreGids]
             for preGid in preGids:
                 preCell = sim.net.allCells[preGid]
@@ -2793,7 +2751,7 @@ def nTE(cells1 = [], cells2 = [], spks1 = None, spks2 = None, timeRange = None,
         # Select cells to include
         if len(cellGids) > 0:
             try:
-                spkts = [spkt for spkgid,spkt in zip(sim.allSimData['spkid'],sim.allSimData['spkt']) if spkgid in cellGids]
+                spkts = list(getSpikeIndex().spikes(cellGids, sortByTime=True)[1])
             except:
                 spkts = []
         else: 
@@ -2819,7 +2777,7 @@ def nTE(cells1 = [], cells2 = [], spks1 = None, spks2 = None, timeRange = None,
         # Select cells to include
         if len(cellGids) > 0:
             try:
-                spkts = [spkt for spkgid,spkt in zip(sim.allSimData['spkid'],sim.allSimData['spkt']) if spkgid in cellGids]
+                spkts = list(getSpikeIndex().spikes(cellGids, sortByTime=True)[1])
             except:
                 spkts = []
         else: 
@@ -2900,7 +2858,7 @@ def granger(cells1 = [], cells2 = [], spks1 = None, spks2 = None, label1 = 'spkT
         # Select cells to include
         if len(cellGids) > 0:
             try:
-                spkts = [spkt for spkgid,spkt in zip(sim.allSimData['spkid'],sim.allSimData['spkt']) if spkgid in cellGids]
+                spkts = list(getSpikeIndex().spikes(cellGids, sortByTime=True)[1])
             except:
                 spkts = []
         else: 
@@ -2926,7 +2884,7 @@ def granger(cells1 = [], cells2 = [], spks1 = None, spks2 = None, label1 = 'spkT
         # Select cells to include
         if len(cellGids) > 0:
             try:
-                spkts = [spkt for spkgid,spkt in zip(sim.allSimData['spkid'],sim.allSimData['spkt']) if spkgid in cellGids]
+                spkts = list(getSpikeIndex().spikes(cellGids, sortByTime=True)[1])
             except:
                 spkts = []
         else: 
@@ -10,7 +10,8 @@ from numbers import Number
 from copy import deepcopy
 from time import sleep
 from neuron import h # Import NEURON
-from specs import Dict
+from specs import Dict, SharedDict
+from conntable import CellConns
 import numpy as np
 
 
@@ -24,9 +25,12 @@ class Cell (object):
     ''' Generic class for neuron models '''
     
     def __init__ (self, gid, tags):
+        import sim
+
         self.gid = gid  # global cell id 
         self.tags = tags  # dictionary of cell tags/attributes 
-        self.conns = []  # list of connections
+        connTable = getattr(getattr(sim, 'net', None), 'connTable', None)
+        self.conns = connTable.cellConns(gid) if connTable is not None else []  # list of connections (or view of conns stored in table)
         self.stims = []  # list of stimuli
 
 
@@ -94,6 +98,12 @@ class Cell (object):
             if sim.cfg.verbose: print('  Created %s NetStim for cell gid=%d'% (params['source'], self.gid))
         
         if sim.cfg.createNEURONObj:
+            if params['type'] == 'VecStim':  # Poisson spike train generated up front and played by VecStim (no Random)
+                sourceStims = [stim for stim in self.stims if stim['source'] == params['source']]
+                trainIndex = next((i for i,stim in enumerate(sourceStims) if stim is stimContainer), len(sourceStims))
+                stimContainer['hNetStim'], stimContainer['hSpkTimes'] = sim.net.createVecStim(params, self.gid, trainIndex)
+                return stimContainer['hNetStim']
+
             rand = h.Random()
             stimContainer['hRandom'] = rand  # add netcon object to dict in conns list
 
@@ -124,6 +134,7 @@ class Cell (object):
         import sim
 
         odict = self.__dict__.copy() # copy the dict since we change it
+        if isinstance(odict['conns'], CellConns): odict['conns'] = odict['conns'].todicts()  # conns stored in table
         odict = sim.copyReplaceItemObj(odict, keystart='h', newval=None)  # replace h objects with None so can be pickled
         odict = sim.copyReplaceItemObj(odict, keystart='NeuroML', newval='---Removed_NeuroML_obj---')  # replace NeuroML objects with str so can be pickled
         return odict
@@ -232,21 +243,12 @@ class CompartCell (Cell):
     def create (self):
         import sim
 
+        if sim.cfg.compiledCellRules:  # rule matches cached per signature of tags and NEURON objects created from compiled plans
+            self._createFromPlans()
+            return
+
         for propLabel, prop in sim.net.params.cellParams.iteritems():  # for each set of cell properties
-            conditionsMet = 1
-            for (condKey,condVal) in prop['conds'].iteritems():  # check if all conditions are met
-                if isinstance(condVal, list): 
-                    if isinstance(condVal[0], Number):
-                        if self.tags.get(condKey) < condVal[0] or self.tags.get(condKey) > condVal[1]:
-                            conditionsMet = 0
-                            break
-                    elif isinstance(condVal[0], basestring):
-                        if self.tags.get(condKey) not in condVal:
-                            conditionsMet = 0
-                            break 
-                elif self.tags.get(condKey) != condVal: 
-                    conditionsMet = 0
-                    break
+            conditionsMet = self._condsMet(prop['conds'])
             if conditionsMet:  # if all conditions are met, set values for this cell
                 if sim.cfg.includeParamsLabel:
                     if 'label' not in self.tags:
@@ -254,11 +256,116 @@ class CompartCell (Cell):
                     else:
                         self.tags['label'].append(propLabel)  # add label of cell property set to list of property sets for this cell
                 if sim.cfg.createPyStruct:
-                    self.createPyStruct(prop)
+                    self.createPyStruct(prop, propLabel)
                 if sim.cfg.createNEURONObj:
                     self.createNEURONObj(prop)  # add sections, mechanisms, synaptic mechanisms, geometry and topolgy specified by this property set
 
 
+    def _condsMet (self, conds):
+        for (condKey,condVal) in conds.iteritems():  # check if all conditions are met
+            if isinstance(condVal, list): 
+                if isinstance(condVal[0], Number):
+                    if self.tags.get(condKey) < condVal[0] or self.tags.get(condKey) > condVal[1]:
+                        return 0
+                elif isinstance(condVal[0], basestring):
+                    if self.tags.get(condKey) not in condVal:
+                        return 0
+            elif self.tags.get(condKey) != condVal: 
+                return 0
+        return 1
+
+
+    def _createFromPlans (self):
+        import sim
+
+        cellParams = sim.net.params.cellParams
+        condKeys = sim.net.cellRuleCondKeys
+        if condKeys is None:  # tags used in the conds of any rule
+            condKeys = sim.net.cellRuleCondKeys = sorted(set(condKey for prop in cellParams.values() for condKey in prop['conds']))
+        try:
+            signature = tuple(self.tags.get(condKey) for condKey in condKeys)
+            propLabels = sim.net.cellRuleMatches.get(signature)
+        except TypeError:  # unhashable tag value (eg. list)
+            signature, propLabels = None, None
+        if propLabels is None:
+            propLabels = [propLabel for propLabel, prop in cellParams.iteritems() if self._condsMet(prop['conds'])]
+            if signature is not None:
+                sim.net.cellRuleMatches[signature] = propLabels
+
+        for propLabel in propLabels:
+            prop = cellParams[propLabel]
+            if sim.cfg.includeParamsLabel:
+                self.tags.setdefault('label', []).append(propLabel)  # add label of cell property set to list of property sets for this cell
+            if sim.cfg.createPyStruct:
+                self.createPyStruct(prop, propLabel)
+            if sim.cfg.createNEURONObj:
+                if propLabel not in sim.net.cellRulePlans:
+                    sim.net.cellRulePlans[propLabel] = self._compileRule(prop)
+                self._createNEURONObjFromPlan(sim.net.cellRulePlans[propLabel])
+
+
+    def _compileRule (self, prop):
+        ''' Construction plan of rule: per section, lists of values to set (scalar mech params set for whole section at once) '''
+        plan = []
+        for sectName,sectParams in prop['secs'].iteritems():
+            secPlan = dict({'name': sectName, 'geom': [], 'pt3d': None, 'mechs': [], 'ions': sectParams.get('ions', {}), 
+                'synMechs': sectParams.get('synMechs', []), 'pointps': sectParams.get('pointps', {}), 'topol': sectParams.get('topol')})
+            for geomParamName,geomParamValue in sectParams.get('geom', {}).iteritems():
+                if not type(geomParamValue) in [list, dict]:  # skip any list or dic params
+                    secPlan['geom'].append((geomParamName, geomParamValue))
+            if 'pt3d' in sectParams.get('geom', {}):
+                secPlan['pt3d'] = np.array([pt3d[:4] for pt3d in sectParams['geom']['pt3d']], dtype=float).reshape(-1, 4)
+            for mechName,mechParams in sectParams.get('mechs', {}).iteritems():
+                secParams, segParams = [], []  # params with same value in all segments, and params with value per segment
+                for mechParamName,mechParamValue in mechParams.iteritems():
+                    if type(mechParamValue) in [list] and len(mechParamValue) == 1:
+                        mechParamValue = mechParamValue[0]
+                    if type(mechParamValue) in [list]:
+                        segParams.append((mechParamName, mechParamValue))
+                    elif mechParamValue is not None:  # avoid setting None values
+                        secParams.append(('%s_%s' % (mechParamName, mechName), mechParamValue))
+                secPlan['mechs'].append((mechName, secParams, segParams))
+            plan.append(secPlan)
+        return plan
+
+
+    def _createNEURONObjFromPlan (self, plan):
+        for secPlan in plan:
+            sectName = secPlan['name']
+            if sectName not in self.secs:
+                self.secs[sectName] = Dict()  # create sect dict if doesn't exist
+            sec = self.secs[sectName]
+            if sec.get('hSec') in [None, {}, []]: 
+                sec['hSec'] = h.Section(name=sectName, cell=self)  # create h Section object
+            hSec = sec['hSec']
+
+            for geomParamName,geomParamValue in secPlan['geom']:
+                setattr(hSec, geomParamName, geomParamValue)
+            if secPlan['pt3d'] is not None:
+                h.pt3dclear(sec=hSec)
+                pt3ds = secPlan['pt3d'] + [self.tags['x'], -self.tags['y'], self.tags['z'], 0.0]  # Neuron y-axis positive = upwards, so cortical depth = neg
+                for x,y,z,diam in pt3ds.tolist():
+                    h.pt3dadd(x, y, z, diam, sec=hSec)
+
+            for mechName,secParams,segParams in secPlan['mechs']:
+                sec.setdefault('mechs', Dict()).setdefault(mechName, Dict())
+                hSec.insert(mechName)
+                for rangeVarName,value in secParams:
+                    setattr(hSec, rangeVarName, value)  # sets value in all segments
+                for mechParamName,mechParamValue in segParams:
+                    for iseg,seg in enumerate(hSec):
+                        if mechParamValue[iseg] is not None:
+                            setattr(getattr(seg, mechName), mechParamName, mechParamValue[iseg])
+
+            if secPlan['ions'] or secPlan['synMechs'] or secPlan['pointps']:  # less common; created as in createNEURONObj
+                self.createNEURONObj({'secs': {sectName: {'ions': secPlan['ions'], 'synMechs': secPlan['synMechs'], 'pointps': secPlan['pointps']}}})
+
+        for secPlan in plan:  # topology (ensures all sections exist)
+            if secPlan['topol']:
+                topol = secPlan['topol']
+                self.secs[secPlan['name']]['hSec'].connect(self.secs[topol['parentSec']]['hSec'], topol['parentX'], topol['childX'])  # make topol connection
+
+
     def modify (self, prop):
         import sim
 
@@ -288,16 +395,34 @@ class CompartCell (Cell):
                 self.createNEURONObj(prop)  # add sections, mechanisms, synaptic mechanisms, geometry and topolgy specified by this property set
 
 
-    def createPyStruct (self, prop):
+    def createPyStruct (self, prop, ruleLabel=None):
+        import sim
+
+        sharedSpecs = None
+        if ruleLabel and sim.cfg.sharedCellSpecs:  # reference specs shared by all cells created from this rule
+            if ruleLabel not in sim.net.cellRuleSpecs:
+                sim.net.cellRuleSpecs[ruleLabel] = self._shareRuleSpecs(prop)
+            sharedSpecs = sim.net.cellRuleSpecs[ruleLabel]
+
         # set params for all sections
         for sectName,sectParams in prop['secs'].iteritems(): 
             # create section
             if sectName not in self.secs:
                 self.secs[sectName] = Dict()  # create section dict
             sec = self.secs[sectName]  # pointer to section
+
+            sharedParts = []  # parts of section set to shared spec (others are added to modifiable copy)
+            if sharedSpecs:
+                for part,spec in sharedSpecs[sectName].iteritems():
+                    if part not in sec:
+                        sec[part] = spec
+                        sharedParts.append(part)
+            for part in ['mechs', 'ions', 'geom', 'topol']:
+                if part in sectParams and part not in sharedParts:
+                    self._unshareSecPart(sec, part)
             
             # add distributed mechanisms 
-            if 'mechs' in sectParams:
+            if 'mechs' in sectParams and 'mechs' not in sharedParts:
                 for mechName,mechParams in sectParams['mechs'].iteritems(): 
                     if 'mechs' not in sec:
                         sec['mechs'] = Dict()
@@ -307,7 +432,7 @@ class CompartCell (Cell):
                         sec['mechs'][mechName][mechParamName] = mechParamValue
             
             # add ion info 
-            if 'ions' in sectParams:
+            if 'ions' in sectParams and 'ions' not in sharedParts:
                 for ionName,ionParams in sectParams['ions'].iteritems(): 
                     if 'ions' not in sec:
                         sec['ions'] = Dict()
@@ -336,7 +461,7 @@ class CompartCell (Cell):
 
 
             # add geometry params 
-            if 'geom' in sectParams:
+            if 'geom' in sectParams and 'geom' not in sharedParts:
                 for geomParamName,geomParamValue in sectParams['geom'].iteritems():  
                     if 'geom' not in sec:
                         sec['geom'] = Dict()
@@ -351,7 +476,7 @@ class CompartCell (Cell):
                         sec['geom']['pt3d'].append(pt3d)
 
             # add topolopgy params
-            if 'topol' in sectParams:
+            if 'topol' in sectParams and 'topol' not in sharedParts:
                 if 'topol' not in sec:
                     sec['topol'] = Dict()
                 for topolParamName,topolParamValue in sectParams['topol'].iteritems(): 
@@ -375,6 +500,21 @@ class CompartCell (Cell):
             self.secLists.update(prop['secLists'])  # diction of section lists
 
 
+    def _shareRuleSpecs (self, prop):
+        ''' Returns read-only specs (geom, mechs, ions and topol) of each section of rule, built as in createPyStruct ''' 
+        template = CompartCell.__new__(CompartCell)
+        template.secs = Dict()
+        template.createPyStruct({'secs': {sectName: {part: sectParams[part] for part in ['mechs', 'ions', 'geom', 'topol'] if part in sectParams} 
+            for sectName,sectParams in prop['secs'].iteritems()}})
+        return {sectName: {part: SharedDict(sec[part]) for part in sec} for sectName,sec in template.secs.iteritems()}
+
+
+    def _unshareSecPart (self, sec, part):
+        ''' Replace shared spec of section part (eg. 'mechs') with modifiable copy (before modifying it) '''
+        if isinstance(sec.get(part), SharedDict):
+            sec[part] = sec[part].copy()
+
+
     def initV (self): 
         for sec in self.secs.values():
             if 'vinit' in sec:
@@ -490,7 +630,7 @@ class CompartCell (Cell):
     def addStimsNEURONObj(self):
         # assumes python structure exists
         for stimParams in self.stims:
-            if stimParams['type'] == 'NetStim':
+            if stimParams['type'] in ['NetStim', 'VecStim']:
                 self.addNetStim(stimParams, stimContainer=stimParams)
        
             elif stimParams['type'] in ['IClamp', 'VClamp', 'SEClamp', 'AlphaSynapse']:
@@ -945,11 +1085,11 @@ class CompartCell (Cell):
                             break
 
                 if conditionsMet:  # if all conditions are met, set values for this cell
-                    if stim['type'] == 'NetStim':  # for netstims, find associated netcon
+                    if stim['type'] in ['NetStim', 'VecStim']:  # for netstims, find associated netcon
                         conn = next((conn for conn in self.conns if conn['source'] == stim['source']), None)
                     if sim.cfg.createPyStruct:
                         for paramName, paramValue in {k: v for k,v in params.iteritems() if k not in ['conds','cellConds']}.iteritems():
-                            if stim['type'] == 'NetStim' and paramName in ['weight', 'delay', 'threshold']:
+                            if stim['type'] in ['NetStim', 'VecStim'] and paramName in ['weight', 'delay', 'threshold']:
                                 conn[paramName] = paramValue
                             else:
                                 stim[paramName] = paramValue
@@ -969,6 +1109,11 @@ class CompartCell (Cell):
                                         setattr(stim['hNetStim'], 'interval', stim['interval'])
                                     else:
                                         setattr(stim['h'+stim['type']], paramName, paramValue)
+                                elif stim['type'] == 'VecStim':  # spike train already generated, only netcon params can be modified
+                                    if paramName == 'weight':
+                                        conn['hNetcon'].weight[0] = paramValue
+                                    elif paramName in ['delay', 'threshold']:
+                                        setattr(conn['hNetcon'], paramName, paramValue)
                                 else:
                                     setattr(stim['h'+stim['type']], paramName, paramValue)
                             except:
@@ -991,7 +1136,7 @@ class CompartCell (Cell):
 
         if not 'loc' in params: params['loc'] = 0.5  # default stim location 
 
-        if params['type'] == 'NetStim':
+        if params['type'] in ['NetStim', 'VecStim']:
             if not 'start' in params: params['start'] = 0  # add default start time
             if not 'number' in params: params['number'] = 1e9  # add default number 
 
@@ -1014,6 +1159,9 @@ class CompartCell (Cell):
                 'number': params['number'],
                 'start': params['start'],
                 'seed': params['seed'] if 'seed' in params else sim.cfg.seeds['stim']}
+            if params['type'] == 'VecStim':  # Poisson trains (noise not used); optionally shared from pool of trains
+                netStimParams.pop('noise')
+                netStimParams['poolSize'] = params.get('poolSize')
         
             self.addConn(connParams, netStimParams)
        
@@ -1288,19 +1436,29 @@ class CompartCell (Cell):
         self._segCoords['p1'] = p3dsoma + morphSegCoords['p1']
 
     def setImembPtr(self): 
-        """Set PtrVector to point to the i_membrane_"""
-        jseg = 0
+        """Set pointers to the i_membrane_ of this cell's segments in the node PtrVector (sim.net.lfpImembPtr)"""
+        import sim
+
+        jseg = sim.net.lfpSegOffsets[sim.net.lfpCellInds[self.gid]]
         for sec in self.secs.values():
             hSec = sec['hSec']
             for iseg, seg in enumerate(hSec):
-                self.imembPtr.pset(jseg, seg._ref_i_membrane_)  # notice the underscore at the end (in nA)
+                sim.net.lfpImembPtr.pset(jseg, seg._ref_i_membrane_)  # notice the underscore at the end (in nA)
                 jseg += 1
                 
 
     def getImemb(self):
-        """Gather membrane currents from PtrVector into imVec (does not need a loop!)"""
-        self.imembPtr.gather(self.imembVec)
-        return self.imembVec.as_numpy()  # (nA)
+        """Gather membrane currents of node from PtrVector and return this cell's segments"""
+        import sim
+
+        if not hasattr(sim.net, 'lfpImembPtr') or self.gid not in sim.net.lfpCellInds:
+            print 'Error: membrane currents of cell %d not available; LFP recording needs to be set up (cfg.recordLFP)' % (self.gid)
+            return None
+        if not sim.net.lfpImembPtrSet:
+            self.setImembPtr()
+        sim.net.lfpImembPtr.gather(sim.net.lfpImembVec)
+        i = sim.net.lfpCellInds[self.gid]
+        return sim.net.lfpImembVec.as_numpy()[sim.net.lfpSegOffsets[i]:sim.net.lfpSegOffsets[i+1]].copy()  # (nA)
 
 
     def updateShape(self):
@@ -1311,6 +1469,7 @@ class CompartCell (Cell):
                 
         for sec in self.secs.values():
             if 'pt3d' not in sec['geom']:  # only cells that didn't have pt3d before
+                self._unshareSecPart(sec, 'geom')
                 sec['geom']['pt3d'] = []
                 sec['hSec'].push()
                 n3d = int(h.n3d())  # get number of n3d points in each section
@@ -0,0 +1,194 @@
+
+"""
+celltable.py
+
+Contains CellTable class: columnar store of cell tags with indexes used to find cells matching conditions
+
+Contributors: salvadordura@gmail.com
+"""
+
+from numbers import Number
+import numpy as np
+
+
+###############################################################################
+#
+# CELL TABLE CLASS
+#
+###############################################################################
+class CellTable (object):
+    ''' Columnar store of cell tags (gids, coordinates and categorical tags) with indexes to find cells matching conditions '''
+
+    coordTags = ['x', 'y', 'z', 'xnorm', 'ynorm', 'znorm']  # tags with range conditions [min, max)
+    categTags = ['pop', 'cellType', 'cellModel']  # tags indexed when creating the table (rest are indexed when first queried)
+
+    def __init__ (self, allCellTags):
+        self.cellTags = allCellTags  # dict with tags of each cell (key = gid), or CellTagsView of packed columns
+        columns = getattr(allCellTags, 'columns', None)  # packed columns (eg. gathered from all nodes)
+
+        # gid and coordinate columns, and sorted indexes
+        self.coords = {}
+        self.coordOrder = {}
+        self.coordSorted = {}
+        if columns is not None:
+            self.gids = columns['gid']
+        else:
+            self.gids = np.array(sorted(allCellTags), dtype=int)  # gid of each row
+        for coord in self.coordTags:
+            if columns is not None:
+                self.coords[coord] = columns[coord]
+            else:
+                values = [allCellTags[gid].get(coord, None) for gid in self.gids]
+                self.coords[coord] = np.array([v if isinstance(v, Number) else np.nan for v in values], dtype=float)
+            self.coordOrder[coord] = np.argsort(self.coords[coord], kind='mergesort')
+            self.coordSorted[coord] = self.coords[coord][self.coordOrder[coord]]
+
+        # categorical columns (codes) and hash indexes
+        self.categories = {}
+        self.codes = {}
+        self.index = {}
+        for tag in self.categTags:
+            self._indexTag(tag)
+
+
+    def __len__ (self):
+        return len(self.gids)
+
+
+    def _indexTag (self, tag):
+        ''' Create column of categorical codes and index (value -> rows) for tag '''
+        if isinstance(self.cellTags, CellTagsView):
+            values = self.cellTags.tagValues(tag)  # obtained from pop tags without creating dicts
+        else:
+            values = [self.cellTags[gid].get(tag, None) for gid in self.gids]
+        try:
+            categories = sorted(set(values))
+        except TypeError:  # unhashable values (eg. lists); will scan tags
+            self.index[tag] = None
+            return
+        codeOf = {value: i for i,value in enumerate(categories)}
+        codes = np.array([codeOf[value] for value in values], dtype=int)
+        order = np.argsort(codes, kind='mergesort')  # keeps rows sorted within each category
+        bounds = np.searchsorted(codes[order], np.arange(len(categories)+1))
+
+        self.categories[tag] = categories
+        self.codes[tag] = codes
+        self.index[tag] = {value: order[bounds[i]:bounds[i+1]] for i,value in enumerate(categories)}
+
+
+    def _condRows (self, condKey, condValue):
+        ''' Return sorted array of rows matching a single condition '''
+        # range of coordinates [min, max) using sorted index
+        if condKey in self.coordTags:
+            start = np.searchsorted(self.coordSorted[condKey], condValue[0], 'left')
+            end = np.searchsorted(self.coordSorted[condKey], condValue[1], 'left')
+            return np.sort(self.coordOrder[condKey][start:max(start, end)])
+
+        # value or list of values using hash index
+        if condKey not in self.index:
+            self._indexTag(condKey)
+        index = self.index[condKey]
+        if index is not None:
+            try:
+                if isinstance(condValue, list):
+                    rows = [index[value] for value in condValue if value in index]
+                    return np.unique(np.concatenate(rows)) if rows else np.array([], dtype=int)
+                else:
+                    return index.get(condValue, np.array([], dtype=int))
+            except TypeError:  # unhashable condition value
+                pass
+
+        # scan tags
+        if isinstance(condValue, list):
+            return np.array([i for i,gid in enumerate(self.gids) if self.cellTags[gid].get(condKey, None) in condValue], dtype=int)
+        else:
+            return np.array([i for i,gid in enumerate(self.gids) if self.cellTags[gid].get(condKey, None) == condValue], dtype=int)
+
+
+    def query (self, conds):
+        ''' Return sorted array of gids of cells matching all conditions (dict with tag: value, list of values or [min,max) range for coordinates) '''
+        rows = None
+        for condKey,condValue in conds.iteritems():
+            condRows = self._condRows(condKey, condValue)
+            rows = condRows if rows is None else np.intersect1d(rows, condRows, assume_unique=True)
+            if len(rows) == 0:
+                break
+        if rows is None:  # no conditions, so all cells
+            return self.gids.copy()
+        return self.gids[rows]
+
+
+    def rows (self, gids):
+        ''' Return array of rows of gids (None if any gid not in table) '''
+        gids = np.asarray(gids, dtype=int)
+        rows = np.searchsorted(self.gids, gids)
+        if len(gids) and (rows.max() >= len(self.gids) or not np.array_equal(self.gids[rows], gids)):
+            return None
+        return rows
+
+
+    def getCoords (self, gids):
+        ''' Return dict with array of each coordinate for gids (None if any gid not in table) '''
+        rows = self.rows(gids)
+        if rows is None:
+            return None
+        return {coord: values[rows] for coord,values in self.coords.iteritems()}
+
+
+    def getCellsTags (self, gids):
+        ''' Return dict with tags of each gid '''
+        return {gid: self.cellTags[gid] for gid in gids.tolist()}
+
+
+###############################################################################
+#
+# CELL TAGS VIEW CLASS
+#
+###############################################################################
+class CellTagsView (object):
+    ''' Read-only dict-like view (key = gid) of the tags of cells stored as packed columns (gid, pop code and coordinates);
+    tags of each cell are created on access from the tags of its population '''
+
+    def __init__ (self, columns, popTags):
+        self.columns = columns  # dict of arrays sorted by gid: 'gid', 'pop' (code = index in popTags) and coordinates
+        self.popTags = popTags  # list with tags copied from each population to its cells
+
+    def __len__ (self):
+        return len(self.columns['gid'])
+
+    def __iter__ (self):
+        return iter(self.columns['gid'].tolist())
+
+    def __contains__ (self, gid):
+        return self._row(gid) is not None
+
+    def __getitem__ (self, gid):
+        row = self._row(gid)
+        if row is None:
+            raise KeyError(gid)
+        tags = dict(self.popTags[self.columns['pop'][row]])
+        for coord in CellTable.coordTags:
+            tags[coord] = float(self.columns[coord][row])
+        return tags
+
+    def _row (self, gid):
+        gids = self.columns['gid']
+        row = np.searchsorted(gids, gid)
+        return int(row) if row < len(gids) and gids[row] == gid else None
+
+    def get (self, gid, default=None):
+        return self[gid] if gid in self else default
+
+    def keys (self):
+        return self.columns['gid'].tolist()
+
+    def iteritems (self):
+        for gid in self:
+            yield gid, self[gid]
+
+    def tagValues (self, tag):
+        ''' Return list with value of tag for each cell (row) '''
+        if tag in CellTable.coordTags:
+            return self.columns[tag].tolist()
+        popValues = [tags.get(tag, None) for tags in self.popTags]
+        return [popValues[code] for code in self.columns['pop'].tolist()]
@@ -0,0 +1,282 @@
+
+"""
+conntable.py
+
+Contains ConnTable class: columnar store (struct of arrays) of the conns of the cells in a node, optionally backed by memory-mapped files;
+and CellConns and ConnView classes: list-like view of the conns of a cell (cell.conns) and dict-like view of each conn
+
+Contributors: salvadordura@gmail.com
+"""
+
+from numbers import Number
+from array import array
+import os
+import numpy as np
+
+
+###############################################################################
+#
+# CONN TABLE CLASS
+#
+###############################################################################
+class ConnTable (object):
+    ''' Columnar store (struct of arrays) of the conns of the cells in a node; columns can be memory-mapped files '''
+
+    numColumns = {'postGid': np.int32, 'preGid': np.int32, 'weight': np.float32, 'delay': np.float32, 'threshold': np.float32,
+        'loc': np.float64}  # loc kept as float64 since compared to loc of synMechs
+    codeColumns = ['synMech', 'sec', 'label', 'preLabel']  # categorical values stored as codes (index in categories)
+    hObjColumns = ['hNetcon']  # NEURON objects stored as index in hObjs list
+    netStimPreGid = -1  # preGid code of NetStims ('NetStim')
+    missingInt = -2  # missing value of int columns (nan for float columns)
+
+    def __init__ (self, folder=None, label='conns', capacity=1024):
+        self.folder = folder  # folder of memory-mapped files (None = keep columns in memory)
+        self.label = label  # prefix of memory-mapped files
+        self.size = 0  # number of conns
+        self.capacity = 0  # allocated rows
+        self.columns = {}
+        self.categories = {key: [] for key in self.codeColumns}  # values of each categorical column
+        self.codeOf = {key: {} for key in self.codeColumns}  # code of each value
+        self.hObjs = []  # NEURON objects (eg. NetCons)
+        self.extra = {}  # dict with other keys of conn (eg. shape, plast, hSTDP) or values that can't be stored in columns (key = row)
+
+        self.columnTypes = dict(self.numColumns)
+        self.columnTypes.update({key: np.int32 for key in self.codeColumns+self.hObjColumns})
+        if self.folder:
+            if not os.path.exists(self.folder):
+                os.makedirs(self.folder)
+            for key in self.columnTypes:
+                open(self._filename(key), 'wb').close()  # remove data of previous tables
+        self._resize(capacity)
+
+
+    def __len__ (self):
+        return self.size
+
+
+    def _filename (self, key):
+        return os.path.join(self.folder, '%s_%s.dat' % (self.label, key))
+
+
+    def _resize (self, capacity):
+        ''' Allocate capacity rows in all columns (keeping current data) '''
+        for key,dtype in self.columnTypes.iteritems():
+            if self.folder:  # extend file and map again
+                if key in self.columns:
+                    self.columns[key].flush()
+                with open(self._filename(key), 'r+b') as fileObj:
+                    fileObj.truncate(capacity*np.dtype(dtype).itemsize)
+                self.columns[key] = np.memmap(self._filename(key), dtype=dtype, mode='r+', shape=(capacity,))
+            else:
+                column = np.empty(capacity, dtype=dtype)
+                if key in self.columns:
+                    column[:self.size] = self.columns[key][:self.size]
+                self.columns[key] = column
+        self.capacity = capacity
+
+
+    def _missing (self, key):
+        return np.nan if np.issubdtype(self.columnTypes[key], np.floating) else self.missingInt
+
+
+    def _encode (self, key, value):
+        ''' Return value stored in column for key, or None if value can't be stored in column '''
+        if key == 'preGid':
+            if value == 'NetStim':
+                return self.netStimPreGid
+            elif isinstance(value, Number) and not isinstance(value, bool) and int(value) == value and value >= 0:
+                return int(value)
+        elif key in self.numColumns:
+            if isinstance(value, Number) and not isinstance(value, bool):
+                return value
+        elif key in self.codeColumns:
+            try:
+                if value not in self.codeOf[key]:
+                    self.codeOf[key][value] = len(self.categories[key])
+                    self.categories[key].append(value)
+                return self.codeOf[key][value]
+            except TypeError:  # unhashable value (eg. list)
+                return None
+        elif key in self.hObjColumns:
+            self.hObjs.append(value)
+            return len(self.hObjs)-1
+        return None
+
+
+    def _decode (self, key, value):
+        if key == 'preGid':
+            return 'NetStim' if value == self.netStimPreGid else int(value)
+        elif key in self.numColumns:
+            return int(value) if key == 'postGid' else float(value)
+        elif key in self.codeColumns:
+            return self.categories[key][value]
+        elif key in self.hObjColumns:
+            return self.hObjs[value]
+
+
+    def _isMissing (self, key, value):
+        return value != value if np.issubdtype(self.columnTypes[key], np.floating) else value == self.missingInt
+
+
+    def addConn (self, postGid, conn):
+        ''' Add conn (dict) of cell postGid; returns row '''
+        if self.size == self.capacity:
+            self._resize(2*self.capacity)
+        row = self.size
+        self.size += 1
+        for key in self.columns:
+            self.columns[key][row] = self._missing(key)
+        self.columns['postGid'][row] = postGid
+        for key,value in conn.iteritems():
+            self.setValue(row, key, value)
+        return row
+
+
+    def setValue (self, row, key, value):
+        if key == 'postGid':
+            return
+        column = self.columns.get(key)
+        encoded = self._encode(key, value) if column is not None else None
+        if encoded is None:  # stored as other key
+            if column is not None:
+                column[row] = self._missing(key)
+            self.extra.setdefault(row, {})[key] = value
+        else:
+            column[row] = encoded
+            if row in self.extra:
+                self.extra[row].pop(key, None)
+
+
+    def getValue (self, row, key):
+        extra = self.extra.get(row)
+        if extra and key in extra:
+            return extra[key]
+        column = self.columns.get(key)
+        if column is None or key == 'postGid':
+            raise KeyError(key)
+        value = column[row]
+        if self._isMissing(key, value):
+            raise KeyError(key)
+        return self._decode(key, value)
+
+
+    def rowKeys (self, row):
+        keys = [key for key,column in self.columns.iteritems() if key != 'postGid' and not self._isMissing(key, column[row])]
+        return keys + list(self.extra.get(row, {}))
+
+
+    def cellConns (self, gid):
+        ''' Return empty list-like view to store the conns of cell gid '''
+        return CellConns(self, gid)
+
+
+    def column (self, key):
+        ''' Return array with values of column for all conns (codes for categorical columns) '''
+        return self.columns[key][:self.size]
+
+
+    def flush (self):
+        ''' Write memory-mapped columns to disk '''
+        if self.folder:
+            for column in self.columns.values():
+                column.flush()
+
+
+###############################################################################
+#
+# CELL CONNS CLASS
+#
+###############################################################################
+class CellConns (object):
+    ''' List-like view of the conns of a cell stored in a ConnTable (items are dict-like ConnView objects) '''
+
+    def __init__ (self, table, gid):
+        self.table = table
+        self.gid = gid
+        self.rows = array('i')  # rows of table with conns of this cell
+
+    def __len__ (self):
+        return len(self.rows)
+
+    def __iter__ (self):
+        for row in self.rows:
+            yield ConnView(self.table, row)
+
+    def __getitem__ (self, index):
+        if isinstance(index, slice):
+            return [ConnView(self.table, row) for row in self.rows[index]]
+        return ConnView(self.table, self.rows[index])
+
+    def __repr__ (self):
+        return repr(self.todicts())
+
+    def append (self, conn):
+        self.rows.append(self.table.addConn(self.gid, conn))
+
+    def todicts (self):
+        ''' Return list of dicts with conns of this cell '''
+        return [conn.todict() for conn in self]
+
+
+###############################################################################
+#
+# CONN VIEW CLASS
+#
+###############################################################################
+class ConnView (object):
+    ''' Dict-like view (with dot notation) of a conn stored in a ConnTable '''
+
+    __slots__ = ['table', 'row']
+
+    def __init__ (self, table, row):
+        object.__setattr__(self, 'table', table)
+        object.__setattr__(self, 'row', row)
+
+    def __getitem__ (self, key):
+        return self.table.getValue(self.row, key)
+
+    def __setitem__ (self, key, value):
+        self.table.setValue(self.row, key, value)
+
+    def __getattr__ (self, key):
+        try:
+            return self.table.getValue(self.row, key)
+        except KeyError:
+            raise AttributeError(key)
+
+    def __setattr__ (self, key, value):
+        self.table.setValue(self.row, key, value)
+
+    def __contains__ (self, key):
+        return key in self.keys()
+
+    def __iter__ (self):
+        return iter(self.keys())
+
+    def __len__ (self):
+        return len(self.keys())
+
+    def __repr__ (self):
+        return repr(self.todict())
+
+    def get (self, key, default=None):
+        try:
+            return self.table.getValue(self.row, key)
+        except KeyError:
+            return default
+
+    def keys (self):
+        return self.table.rowKeys(self.row)
+
+    def values (self):
+        return [self[key] for key in self.keys()]
+
+    def items (self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def iteritems (self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def todict (self):
+        return dict(self.items())
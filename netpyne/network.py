@@ -11,7 +11,10 @@ from matplotlib.pylab import array, sin, cos, tan, exp, sqrt, mean, inf, dstack,
 from time import time, sleep
 from numbers import Number
 from copy import copy
+import numpy as np
 from specs import ODict
+from celltable import CellTable
+from conntable import ConnTable
 from neuron import h  # import NEURON
 
 class Network (object):
@@ -25,6 +28,11 @@ class Network (object):
         # params that can be expressed using string-based functions in connections
         self.connStringFuncParams = ['weight', 'delay', 'synsPerConn', 'loc']  
 
+        # params with string-based functions that can be evaluated over arrays of cells, and functions allowed in them
+        self.connStringFuncVecParams = ['weight', 'delay', 'loc', 'probability', 'convergence', 'divergence']
+        self.connStringFuncVecNames = ['exp', 'sqrt', 'sin', 'cos', 'tan', 'abs', 'inf']
+        self.connStrFuncMode = {}  # mode used to evaluate string-based functions of each conn rule ('vectorized' or 'per-pair')
+
         # params that can be expressed using string-based functions in stims
         self.stimStringFuncParams = ['delay', 'dur', 'amp', 'gain', 'rstim', 'tau1', 'tau2', 
         'onset', 'tau', 'gmax', 'e', 'i', 'interval', 'rate', 'number', 'start', 'noise']  
@@ -42,6 +50,13 @@ class Network (object):
         self.gid2lid = {} # Empty dict for storing GID -> local index (key = gid; value = local id) -- ~x6 faster than .index() 
         self.lastGid = 0  # keep track of last cell gid 
         self.lastGapId = 0  # keep track of last gap junction gid 
+        self.cellTable = None  # columnar table of cell tags with indexes (built when required to find cells)
+        self.connTable = None  # columnar table of conns of cells in this node (if cfg.connTable)
+        self.vecStimPool = {}  # VecStims and Vectors of spike trains shared by stims of VecStim sources with poolSize (key = (source, index))
+        self.cellRuleCondKeys = None  # tags used in conds of cellParams rules (if cfg.compiledCellRules)
+        self.cellRuleMatches = {}  # labels of cellParams rules matching each signature of cell tags (if cfg.compiledCellRules)
+        self.cellRulePlans = {}  # compiled construction plan of each cellParams rule (if cfg.compiledCellRules)
+        self.cellRuleSpecs = {}  # read-only section specs shared by cells created from each cellParams rule (if cfg.sharedCellSpecs)
 
 
     ###############################################################################
@@ -71,6 +86,24 @@ class Network (object):
         sim.timing('start', 'createTime')
         if sim.rank==0: 
             print("\nCreating network of %i cell populations on %i hosts..." % (len(self.pops), sim.nhosts)) 
+
+        if sim.cfg.balanceCells:  # distribute cells by cost, measured in previous run (file saved by sim.saveCellCosts) or estimated
+            sim.hostLoads = [0.0]*sim.nhosts
+            sim.cellCosts = {}
+            if isinstance(sim.cfg.balanceCells, basestring):
+                import json
+                with open(sim.cfg.balanceCells, 'r') as fileObj:
+                    sim.cellCosts = {int(gid): cost for gid,cost in json.load(fileObj).iteritems()}
+
+        if sim.cfg.compiledCellRules:  # cellParams may have changed since cells were last created
+            self.cellRuleCondKeys = None
+            self.cellRuleMatches = {}
+            self.cellRulePlans = {}
+        self.cellRuleSpecs = {}
+
+        if sim.cfg.connTable:  # store conns of cells in columnar table (in memory or memory-mapped files in folder)
+            folder = sim.cfg.connTable if isinstance(sim.cfg.connTable, basestring) else None
+            self.connTable = ConnTable(folder=folder, label='conns_node%d' % sim.rank)
         
         for ipop in self.pops.values(): # For each pop instantiate the network cells (objects of class 'Cell')
             newCells = ipop.createCells() # create cells for this pop using Pop method
@@ -96,7 +129,7 @@ class Network (object):
                 print('Adding stims...')
                 
             if sim.nhosts > 1: # Gather tags from all cells 
-                allCellTags = sim._gatherAllCellTags()  
+                allCellTags = sim._gatherAllCellTagsCompact() if sim.cfg.compactCellTags else sim._gatherAllCellTags()
             else:
                 allCellTags = {cell.gid: cell.tags for cell in self.cells}
             # allPopTags = {i: pop.tags for i,pop in enumerate(self.pops)}  # gather tags from pops so can connect NetStim pops
@@ -109,22 +142,14 @@ class Network (object):
                 
                 source = sources.get(target['source'])
 
-                postCellsTags = allCellTags
-                for condKey,condValue in target['conds'].iteritems():  # Find subset of cells that match postsyn criteria
-                    if condKey in ['x','y','z','xnorm','ynorm','znorm']:
-                        postCellsTags = {gid: tags for (gid,tags) in postCellsTags.iteritems() if condValue[0] <= tags.get(condKey, None) < condValue[1]}  # dict with post Cell objects}  # dict with pre cell tags
-                    elif condKey == 'cellList':
-                        pass
-                    elif isinstance(condValue, list): 
-                        postCellsTags = {gid: tags for (gid,tags) in postCellsTags.iteritems() if tags.get(condKey, None) in condValue}  # dict with post Cell objects
-                    else:
-                        postCellsTags = {gid: tags for (gid,tags) in postCellsTags.iteritems() if tags.get(condKey, None) == condValue}  # dict with post Cell objects
-                
+                # find cells that match conditions
+                cellTable = self._getCellTable(allCellTags)
+                postGids = cellTable.query({condKey: condValue for condKey,condValue in target['conds'].iteritems() if condKey != 'cellList'})
+
                 # subset of cells from selected pops (by relative indices)                     
                 if 'cellList' in target['conds']:
-                    orderedPostGids = sorted(postCellsTags.keys())
-                    gidList = [orderedPostGids[i] for i in target['conds']['cellList']]
-                    postCellsTags = {gid: tags for (gid,tags) in postCellsTags.iteritems() if gid in gidList}
+                    postGids = postGids[target['conds']['cellList']]
+                postCellsTags = cellTable.getCellsTags(postGids)
 
                 # initialize randomizer in case used in string-based function (see issue #89 for more details)
                 self.rand.Random123(sim.id32('stim_'+source['type']), sim.id32('%d%d'%(len(postCellsTags), sum(postCellsTags))), sim.cfg.seeds['stim'])
@@ -144,7 +169,7 @@ class Network (object):
                         params['sec'] = strParams['secList'][postCellGid] if 'secList' in strParams else target['sec']
                         params['loc'] = strParams['locList'][postCellGid] if 'locList' in strParams else target['loc']
                          
-                        if source['type'] == 'NetStim': # for NetStims add weight+delay or default values
+                        if source['type'] in ['NetStim', 'VecStim']: # for NetStims (and VecStims) add weight+delay or default values
                             params['weight'] = strParams['weightList'][postCellGid] if 'weightList' in strParams else target.get('weight', 1.0)
                             params['delay'] = strParams['delayList'][postCellGid] if 'delayList' in strParams else target.get('delay', 1.0)
                             params['synsPerConn'] = strParams['synsPerConnList'][postCellGid] if 'synsPerConnList' in strParams else target.get('synsPerConn', 1)
@@ -161,7 +186,7 @@ class Network (object):
                         for sourceParam in source: # copy source params
                             params[sourceParam] = strParams[sourceParam+'List'][postCellGid] if sourceParam+'List' in strParams else source.get(sourceParam)
 
-                        if source['type'] == 'NetStim':
+                        if source['type'] in ['NetStim', 'VecStim']:
                             self._addCellStim(params, postCell)  # call method to add connections (sort out synMechs first)
                         else:
                             postCell.addStim(params)  # call cell method to add connection
@@ -208,6 +233,52 @@ class Network (object):
 
 
 
+    ###############################################################################
+    ### Create VecStim playing Poisson spike train generated up front (shared by stims if source has poolSize)
+    ###############################################################################
+    def createVecStim (self, params, gid, trainIndex=0):
+        import sim
+
+        seed = params.get('seed', sim.cfg.seeds['stim'])
+        sourceId = sim.id32('vecstim_'+params['source'])
+        if params.get('poolSize'):  # train of pool selected for this stim (same in all nodes); pool trains created once per node
+            index = np.random.RandomState([sim.id32('vecstim_pool_'+params['source']), gid, trainIndex, seed]).randint(params['poolSize'])
+            key = (params['source'], index)
+            if key in self.vecStimPool:
+                return self.vecStimPool[key]
+            seeds = [sourceId, int(params['poolSize']), index, seed]
+        else:  # train of this stim
+            key = None
+            seeds = [sourceId, gid, trainIndex, seed]
+
+        spkTimes = self._poissonSpikeTimes(params['rate'], params.get('start', 0.0), sim.cfg.duration, params.get('number'), seeds)
+        vec = h.Vector().from_python(spkTimes)
+        vecStim = h.VecStim()
+        vecStim.play(vec)
+        if key:
+            self.vecStimPool[key] = (vecStim, vec)
+        return vecStim, vec
+
+
+    ###############################################################################
+    ### Poisson spike times (ms) with rate (Hz) constant or list of [time, rate] (piecewise constant) 
+    ###############################################################################
+    def _poissonSpikeTimes (self, rate, start, stop, number, seeds):
+        rng = np.random.RandomState(seeds)  # reproducible for each gid and seed
+        rateSegments = sorted(rate) if isinstance(rate, (list, tuple)) else [[start, rate]]
+        spkTimes = []
+        for i,(segStart, segRate) in enumerate(rateSegments):
+            segEnd = rateSegments[i+1][0] if i+1 < len(rateSegments) else stop
+            segStart, segEnd = max(segStart, start), min(segEnd, stop)
+            if segEnd > segStart and segRate > 0:
+                numSpks = rng.poisson(segRate * (segEnd - segStart) / 1000.0)
+                spkTimes.append(np.sort(rng.uniform(segStart, segEnd, numSpks)))
+        spkTimes = np.concatenate(spkTimes) if spkTimes else np.array([])
+        if number is not None:
+            spkTimes = spkTimes[:int(number)]
+        return spkTimes
+
+
     ###############################################################################
     # Convert stim param string to function
     ###############################################################################
@@ -508,7 +579,7 @@ class Network (object):
             print('Making connections...')
 
         if sim.nhosts > 1: # Gather tags from all cells 
-            allCellTags = sim._gatherAllCellTags()  
+            allCellTags = sim._gatherAllCellTagsCompact() if sim.cfg.compactCellTags else sim._gatherAllCellTags()
         else:
             allCellTags = {cell.gid: cell.tags for cell in self.cells}
         allPopTags = {-i: pop.tags for i,pop in enumerate(self.pops.values())}  # gather tags from pops so can connect NetStim pops
@@ -537,6 +608,10 @@ class Network (object):
                 else: connParam['connFunc'] = 'fullConn'  # convergence function
             connFunc = getattr(self, connParam['connFunc'])  # get function name from params
 
+            # use vectorized engine for probabilistic conns (per rule, via simConfig or if maxDist; not compatible with disynapticBias)
+            connParam['vectorized'] = (bool(connParam.get('vectorized', sim.cfg.vectorizedConn)) or 'maxDist' in connParam) and connParam['connFunc'] == 'probConn' \
+                                        and not isinstance(connParam.get('disynapticBias', None), Number)
+
             # process string-based funcs and call conn function
             if preCellsTags and postCellsTags:
                 # initialize randomizer in case used in string-based function (see issue #89 for more details)
@@ -598,18 +673,8 @@ class Network (object):
     ###############################################################################
     def _findCellsCondition(self, allCellTags, conds):
         try: 
-            cellsTags = dict(allCellTags)
-            for condKey,condValue in conds.iteritems():  # Find subset of cells that match presyn criteria
-                if condKey in ['x','y','z','xnorm','ynorm','znorm']:
-                    cellsTags = {gid: tags for (gid,tags) in cellsTags.iteritems() if condValue[0] <= tags.get(condKey, None) < condValue[1]}  # dict with pre cell tags
-                    prePops = {}
-                else:
-                    if isinstance(condValue, list): 
-                        cellsTags = {gid: tags for (gid,tags) in cellsTags.iteritems() if tags.get(condKey, None) in condValue}  # dict with pre cell tags
-                        prePops = {i: tags for (i,tags) in prePops.iteritems() if (condKey in tags) and (tags.get(condKey, None) in condValue)}
-                    else:
-                        cellsTags = {gid: tags for (gid,tags) in cellsTags.iteritems() if tags.get(condKey, None) == condValue}  # dict with pre cell tags
-                        prePops = {i: tags for (i,tags) in prePops.iteritems() if (condKey in tags) and (tags.get(condKey, None) == condValue)}
+            cellTable = self._getCellTable(allCellTags)
+            cellsTags = cellTable.getCellsTags(cellTable.query(conds))
         except: 
             return None
 
@@ -620,40 +685,32 @@ class Network (object):
     # Find pre and post cells matching conditions
     ###############################################################################
     def _findPrePostCellsCondition(self, allCellTags, preConds, postConds):
-        import sim
+        cellTable = self._getCellTable(allCellTags)
 
-        #try:
-        preCellsTags = dict(allCellTags)  # initialize with all presyn cells (make copy)
+        preCellsTags = cellTable.getCellsTags(cellTable.query(preConds))  # dict with pre cell tags
         postCellsTags = None
 
-        for condKey,condValue in preConds.iteritems():  # Find subset of cells that match presyn criteria
-            if condKey in ['x','y','z','xnorm','ynorm','znorm']:
-                preCellsTags = {gid: tags for (gid,tags) in preCellsTags.iteritems() if condValue[0] <= tags.get(condKey, None) < condValue[1]}  # dict with pre cell tags
-            else:
-                if isinstance(condValue, list): 
-                    preCellsTags = {gid: tags for (gid,tags) in preCellsTags.iteritems() if tags.get(condKey, None) in condValue}  # dict with pre cell tags
-                else:
-                    preCellsTags = {gid: tags for (gid,tags) in preCellsTags.iteritems() if tags.get(condKey, None) == condValue}  # dict with pre cell tags
-
         if preCellsTags:  # only check post if there are pre
-            postCellsTags = allCellTags
-            for condKey,condValue in postConds.iteritems():  # Find subset of cells that match postsyn criteria
-                if condKey in ['x','y','z','xnorm','ynorm','znorm']:
-                    postCellsTags = {gid: tags for (gid,tags) in postCellsTags.iteritems() if condValue[0] <= tags.get(condKey, None) < condValue[1]}  # dict with post Cell objects}  # dict with pre cell tags
-                elif isinstance(condValue, list): 
-                    postCellsTags = {gid: tags for (gid,tags) in postCellsTags.iteritems() if tags.get(condKey, None) in condValue}  # dict with post Cell objects
-                else:
-                    postCellsTags = {gid: tags for (gid,tags) in postCellsTags.iteritems() if tags.get(condKey, None) == condValue}  # dict with post Cell objects
-        #except:
-        #   return None, None
+            postCellsTags = cellTable.getCellsTags(cellTable.query(postConds))  # dict with post cell tags
 
         return preCellsTags, postCellsTags
 
 
+    ###############################################################################
+    # Get table of cell tags (columns + indexes) used to find cells matching conditions
+    ###############################################################################
+    def _getCellTable(self, allCellTags):
+        if self.cellTable is None or self.cellTable.cellTags is not allCellTags:  # rebuild if different set of cell tags
+            self.cellTable = CellTable(allCellTags)
+        return self.cellTable
+
+
     ###############################################################################
     # Convert connection param string to function
     ###############################################################################
     def _connStrToFunc (self, preCellsTags, postCellsTags, connParam):
+        import sim
+
         # list of params that have a function passed in as a string
         paramsStrFunc = [param for param in self.connStringFuncParams+['probability', 'convergence', 'divergence'] if param in connParam and isinstance(connParam[param], basestring)]  
 
@@ -701,13 +758,37 @@ class Network (object):
             strVars = [var for var in dictVars.keys() if var in strFunc and var+'norm' not in strFunc]  # get list of variables used (eg. post_ynorm or dist_xyz)
             lambdaStr = 'lambda ' + ','.join(strVars) +': ' + strFunc # convert to lambda function 
             lambdaFunc = eval(lambdaStr)
-       
-            if paramStrFunc in ['probability']:
+            funcVars = {strVar: dictVars[strVar] for strVar in strVars}
+
+            # check if function can be evaluated over arrays of cells (otherwise evaluated for each pair of cells)
+            vectorized = paramStrFunc in self.connStringFuncVecParams and self._strFuncVectorizable(strFunc, lambdaFunc, funcVars)
+            connParam[paramStrFunc+'FuncVec'] = vectorized
+            self.connStrFuncMode.setdefault(connParam['label'], {})[paramStrFunc] = 'vectorized' if vectorized else 'per-pair'
+            if sim.cfg.verbose: print '  Conn rule %s: %s function evaluated %s' % (connParam['label'], paramStrFunc, 'over arrays of cells' if vectorized else 'for each pair of cells')
+
+            if paramStrFunc in ['probability'] and connParam.get('vectorized'):
+                # store lambda function and func vars (evaluated over arrays of presyn cells for each postsyn cell)
+                connParam[paramStrFunc+'Func'] = lambdaFunc
+                connParam[paramStrFunc+'FuncVars'] = funcVars
+
+            elif paramStrFunc in ['probability'] and vectorized:
+                # replace function with dict of values derived from function evaluated over presyn cells (one per pre+post cell)
+                preGids, preArrays = self._cellTagsToArrays(preCellsTags)
+                connParam[paramStrFunc+'Func'] = {(preGid,postGid): value 
+                    for postGid,postCellTags in postCellsTags.iteritems() 
+                    for preGid,value in zip(preGids.tolist(), self._evalStrFuncVec(lambdaFunc, funcVars, preArrays, postCellTags, len(preGids)).tolist())}
+
+            elif paramStrFunc in ['probability']:
                 # replace function with dict of values derived from function (one per pre+post cell)
                 connParam[paramStrFunc+'Func'] = {(preGid,postGid): lambdaFunc(
                     **{strVar: dictVars[strVar] if isinstance(dictVars[strVar], Number) else dictVars[strVar](preCellTags, postCellTags) for strVar in strVars})  
                     for preGid,preCellTags in preCellsTags.iteritems() for postGid,postCellTags in postCellsTags.iteritems()}
 
+            elif paramStrFunc in ['convergence'] and vectorized:
+                # replace function with dict of values derived from function evaluated over postsyn cells (one per post cell)
+                postGids, postArrays = self._cellTagsToArrays(postCellsTags)
+                connParam[paramStrFunc+'Func'] = dict(zip(postGids.tolist(), self._evalStrFuncVec(lambdaFunc, funcVars, None, postArrays, len(postGids)).tolist()))
+
             elif paramStrFunc in ['convergence']:
                 # replace function with dict of values derived from function (one per post cell)
 
@@ -715,6 +796,11 @@ class Network (object):
                     **{strVar: dictVars[strVar] if isinstance(dictVars[strVar], Number) else dictVars[strVar](None, postCellTags) for strVar in strVars}) 
                     for postGid,postCellTags in postCellsTags.iteritems()}
 
+            elif paramStrFunc in ['divergence'] and vectorized:
+                # replace function with dict of values derived from function evaluated over presyn cells (one per pre cell)
+                preGids, preArrays = self._cellTagsToArrays(preCellsTags)
+                connParam[paramStrFunc+'Func'] = dict(zip(preGids.tolist(), self._evalStrFuncVec(lambdaFunc, funcVars, preArrays, None, len(preGids)).tolist()))
+
             elif paramStrFunc in ['divergence']:
                 # replace function with dict of values derived from function (one per post cell)
                 connParam[paramStrFunc+'Func'] = {preGid: lambdaFunc(
@@ -724,7 +810,7 @@ class Network (object):
             else:
                 # store lambda function and func vars in connParam (for weight, delay and synsPerConn since only calculated for certain conns)
                 connParam[paramStrFunc+'Func'] = lambdaFunc
-                connParam[paramStrFunc+'FuncVars'] = {strVar: dictVars[strVar] for strVar in strVars} 
+                connParam[paramStrFunc+'FuncVars'] = funcVars
  
 
     ###############################################################################
@@ -799,8 +885,7 @@ class Network (object):
 
         for paramStrFunc in paramsStrFunc:
             # replace lambda function (with args as dict of lambda funcs) with list of values
-            connParam[paramStrFunc[:-4]+'List'] = {(preGid,postGid): connParam[paramStrFunc](**{k:v if isinstance(v, Number) else v(preCellTags,postCellTags) for k,v in connParam[paramStrFunc+'Vars'].iteritems()})  
-                for preGid,preCellTags in preCellsTags.iteritems() for postGid,postCellTags in postCellsTags.iteritems()}
+            connParam[paramStrFunc[:-4]+'List'] = self._strFuncToList(connParam, paramStrFunc, preCellsTags, postCellsTags)
         
         for postCellGid in postCellsTags:  # for each postsyn cell
             if postCellGid in self.lid2gid:  # check if postsyn is in this node's list of gids
@@ -817,6 +902,10 @@ class Network (object):
         ''' Generates connections between all pre and post-syn cells based on probability values'''
         if sim.cfg.verbose: print 'Generating set of probabilistic connections (rule: %s) ...' % (connParam['label'])
 
+        if connParam.get('vectorized'):
+            self._probConnVectorized(preCellsTags, postCellsTags, connParam)
+            return
+
         allRands = {(preGid,postGid): self.rand.uniform(0,1) for preGid in preCellsTags for postGid in postCellsTags}  # Create an array of random numbers for checking each connection        
         # get list of params that have a lambda function
         paramsStrFunc = [param for param in [p+'Func' for p in self.connStringFuncParams] if param in connParam] 
@@ -852,7 +941,149 @@ class Network (object):
 
 
     ###############################################################################
-    ### Generate random unique integers 
+    ### Probabilistic connectivity (vectorized)
+    ###############################################################################
+    def _probConnVectorized (self, preCellsTags, postCellsTags, connParam):
+        ''' Generates probabilistic connections using one block of random numbers per postsyn cell;
+        the random stream depends only on the postsyn gid, so results do not change with the number of nodes'''
+        import sim
+
+        preGids, preArrays = self._cellTagsToArrays(preCellsTags)
+
+        # get list of params that have a lambda function
+        paramsStrFunc = [param for param in [p+'Func' for p in self.connStringFuncParams] if param in connParam]
+
+        probFunc = connParam.get('probabilityFunc', None)
+        probVars = connParam.get('probabilityFuncVars', {})
+        randVec = h.Vector(len(preGids))
+        streamId = sim.id32('%d%d'%(len(preCellsTags), sum(preCellsTags)))
+
+        # spatial index of presyn cells to only consider those within maxDist
+        maxDist = connParam.get('maxDist', None)
+        if maxDist is not None:
+            preTree = self._spatialIndex(preArrays)
+
+        for postCellGid in sorted(postCellsTags):  # for each postsyn cell
+            if postCellGid in self.gid2lid:  # check if postsyn is in this node
+                postCellTags = postCellsTags[postCellGid]
+
+                # candidate presyn cells
+                if maxDist is not None:
+                    rows = self._cellsWithinDist(preTree, postCellTags, maxDist)
+                    candGids = preGids[rows]
+                    candArrays = {coord: values[rows] for coord,values in preArrays.iteritems()}
+                else:
+                    candGids, candArrays = preGids, preArrays
+                if len(candGids) == 0:
+                    continue
+
+                # block of uniform random numbers (one per candidate presyn cell) from counter-based stream of postsyn gid
+                self.rand.Random123(streamId, postCellGid, sim.cfg.seeds['conn'])
+                self.rand.uniform(0, 1)
+                randVec.resize(len(candGids))
+                randVec.setrand(self.rand)
+                rands = randVec.as_numpy()
+
+                # probability for all candidate presyn cells
+                if probFunc is None:
+                    probability = connParam['probability']
+                elif connParam.get('probabilityFuncVec'):
+                    probability = self._evalStrFuncVec(probFunc, probVars, candArrays, postCellTags, len(candGids))
+                else:  # eg. h.Random methods can't be vectorized, so evaluate for each presyn cell
+                    probability = np.array([probFunc(**{k:v if isinstance(v, Number) else v(preCellsTags[preGid],postCellTags) for k,v in probVars.iteritems()})
+                                            for preGid in candGids])
+
+                # evaluate vectorized string-based functions (eg. weight, delay) over accepted presyn cells
+                accepted = probability >= rands
+                acceptedGids = candGids[accepted].tolist()
+                acceptedArrays = {coord: values[accepted] for coord,values in candArrays.iteritems()}
+                for paramStrFunc in paramsStrFunc:
+                    if connParam.get(paramStrFunc+'Vec'):
+                        values = self._evalStrFuncVec(connParam[paramStrFunc], connParam[paramStrFunc+'Vars'], acceptedArrays, postCellTags, len(acceptedGids))
+                        connParam[paramStrFunc[:-4]+'List'] = {(preCellGid,postCellGid): value for preCellGid,value in zip(acceptedGids, values.tolist())}
+
+                # create accepted conns
+                for preCellGid in acceptedGids:
+                    for paramStrFunc in paramsStrFunc: # call lambda functions to get weight func args
+                        if not connParam.get(paramStrFunc+'Vec'):
+                            connParam[paramStrFunc+'Args'] = {k:v if isinstance(v, Number) else v(preCellsTags[preCellGid],postCellTags) for k,v in connParam[paramStrFunc+'Vars'].iteritems()}
+                    self._addCellConn(connParam, preCellGid, postCellGid) # add connection
+
+
+    ###############################################################################
+    ### Spatial index (k-d tree) of cell positions 
+    ###############################################################################
+    def _spatialIndex (self, arrays):
+        from scipy.spatial import cKDTree
+        return cKDTree(np.column_stack([arrays['x'], arrays['y'], arrays['z']]))
+
+
+    ###############################################################################
+    ### Find cells (rows of spatial index) within maxDist (3D distance) of cell
+    ###############################################################################
+    def _cellsWithinDist (self, tree, cellTags, maxDist):
+        return np.array(sorted(tree.query_ball_point([cellTags['x'], cellTags['y'], cellTags['z']], maxDist)), dtype=int)
+
+
+    ###############################################################################
+    ### Check if string-based function can be evaluated over arrays of cells
+    ###############################################################################
+    def _strFuncVectorizable (self, strFunc, lambdaFunc, funcVars):
+        if 'rand' in funcVars:  # h.Random methods return a single value
+            return False
+        try:
+            names = compile(strFunc, '<string>', 'eval').co_names  # names of variables and functions used
+        except SyntaxError:
+            return False
+        if any(name not in funcVars and name not in self.connStringFuncVecNames for name in names):
+            return False
+
+        # test evaluation over small arrays (eg. conditional expressions will fail)
+        testArrays = {coord: np.array([0.0, 1.0]) for coord in ['x','y','z','xnorm','ynorm','znorm']}
+        try:
+            with np.errstate(all='ignore'):
+                self._evalStrFuncVec(lambdaFunc, funcVars, testArrays, testArrays, 2)
+        except Exception:
+            return False
+        return True
+
+
+    ###############################################################################
+    ### Evaluate string-based function over arrays of cells
+    ###############################################################################
+    def _evalStrFuncVec (self, func, funcVars, preArrays, postArrays, size):
+        values = func(**{k:v if isinstance(v, Number) else v(preArrays,postArrays) for k,v in funcVars.iteritems()})
+        return np.broadcast_to(np.asarray(values, dtype=float), (size,))  # also expand single values (eg. only depend on postsyn cell)
+
+
+    ###############################################################################
+    ### Evaluate string-based function for all pairs of pre and post cells
+    ###############################################################################
+    def _strFuncToList (self, connParam, paramStrFunc, preCellsTags, postCellsTags):
+        if connParam.get(paramStrFunc+'Vec'):
+            preGids, preArrays = self._cellTagsToArrays(preCellsTags)
+            return {(preGid,postGid): value for postGid,postCellTags in postCellsTags.iteritems() 
+                for preGid,value in zip(preGids.tolist(), self._evalStrFuncVec(connParam[paramStrFunc], connParam[paramStrFunc+'Vars'], preArrays, postCellTags, len(preGids)).tolist())}
+        else:
+            return {(preGid,postGid): connParam[paramStrFunc](**{k:v if isinstance(v, Number) else v(preCellTags,postCellTags) for k,v in connParam[paramStrFunc+'Vars'].iteritems()})  
+                for preGid,preCellTags in preCellsTags.iteritems() for postGid,postCellTags in postCellsTags.iteritems()}
+
+
+    ###############################################################################
+    ### Convert dict of cell tags to array of gids and arrays of coordinates
+    ###############################################################################
+    def _cellTagsToArrays (self, cellsTags):
+        gids = np.array(sorted(cellsTags), dtype=int)
+        arrays = self.cellTable.getCoords(gids) if self.cellTable is not None else None  # use columns of cell table
+        if arrays is not None:
+            return gids, arrays
+        arrays = {coord: np.array([cellsTags[gid].get(coord, np.nan) for gid in gids], dtype=float)
+                    for coord in ['x','y','z','xnorm','ynorm','znorm']}
+        return gids, arrays
+
+
+    ###############################################################################
+    ### Generate random unique integers
     ###############################################################################
     def randUniqueInt(self, r, N, vmin, vmax):
         import sim
@@ -865,6 +1096,40 @@ class Network (object):
         return out
 
 
+    ###############################################################################
+    ### Random sample of unique indices (Floyd's algorithm)
+    ###############################################################################
+    def _randSample (self, r, n, k, exclude=None):
+        ''' Returns sorted array of k unique random integers in [0, n), optionally skipping index exclude;
+        uses k uniform numbers drawn from r, so the cost is O(k) independently of n'''
+        if exclude is not None: n -= 1
+        k = min(k, n)
+        if k <= 0:
+            return np.array([], dtype=int)
+
+        r.uniform(0, 1)
+        randVec = h.Vector(k)
+        randVec.setrand(r)
+        rands = randVec.as_numpy()
+
+        sample = set()
+        for i, j in enumerate(xrange(n-k, n)):
+            x = min(int(rands[i] * (j+1)), j)  # uniform integer in [0, j]
+            sample.add(j if x in sample else x)
+        sample = np.array(sorted(sample), dtype=int)
+
+        if exclude is not None: sample[sample >= exclude] += 1  # skip excluded index
+        return sample
+
+
+    ###############################################################################
+    ### Index of gid in sorted array of gids (None if not found)
+    ###############################################################################
+    def _gidIndex (self, gids, gid):
+        i = np.searchsorted(gids, gid)
+        return int(i) if i < len(gids) and gids[i] == gid else None
+
+
     ###############################################################################
     ### Convergent connectivity 
     ###############################################################################
@@ -877,21 +1142,27 @@ class Network (object):
         # get list of params that have a lambda function
         paramsStrFunc = [param for param in [p+'Func' for p in self.connStringFuncParams] if param in connParam] 
 
+        # sorted array of presyn gids (and spatial index to only consider those within maxDist)
+        maxDist = connParam.get('maxDist', None)
+        if maxDist is not None:
+            preGids, preArrays = self._cellTagsToArrays(preCellsTags)
+            preTree = self._spatialIndex(preArrays)
+        else:
+            preGids = np.array(sorted(preCellsTags), dtype=int)
+        streamId = sim.id32('%d%d'%(len(preCellsTags), sum(preCellsTags)))
+
         for postCellGid,postCellTags in postCellsTags.iteritems():  # for each postsyn cell
-            if postCellGid in self.lid2gid:  # check if postsyn is in this node
+            if postCellGid in self.gid2lid:  # check if postsyn is in this node
+                candGids = preGids[self._cellsWithinDist(preTree, postCellTags, maxDist)] if maxDist is not None else preGids  # candidate presyn cells
                 convergence = connParam['convergenceFunc'][postCellGid] if 'convergenceFunc' in connParam else connParam['convergence']  # num of presyn conns / postsyn cell
-                convergence = max(min(int(round(convergence)), len(preCellsTags)-1), 0)
-                self.rand.Random123(sim.id32('%d%d'%(len(preCellsTags), sum(preCellsTags))), postCellGid, sim.cfg.seeds['conn'])  # init randomizer
-                randSample = self.randUniqueInt(self.rand, convergence+1, 0, len(preCellsTags)-1) 
-                preCellsSample = [preCellsTags.keys()[i] for i in randSample][0:convergence]  # selected gids of presyn cells
-                preCellsSample[:] = [randSample[convergence] if x==postCellGid else x for x in preCellsSample] # remove post gid  
-                preCellsConv = {k:v for k,v in preCellsTags.iteritems() if k in preCellsSample}  # dict of selected presyn cells tags
-                for preCellGid, preCellTags in preCellsConv.iteritems():  # for each presyn cell
-             
+                convergence = max(int(round(convergence)), 0)
+                self.rand.Random123(streamId, postCellGid, sim.cfg.seeds['conn'])  # init randomizer
+                randSample = self._randSample(self.rand, len(candGids), convergence, exclude=self._gidIndex(candGids, postCellGid))  # exclude self-connection
+                for preCellGid in candGids[randSample].tolist():  # for each selected presyn cell
+                    preCellTags = preCellsTags[preCellGid]
                     for paramStrFunc in paramsStrFunc: # call lambda functions to get weight func args
                         connParam[paramStrFunc+'Args'] = {k:v if isinstance(v, Number) else v(preCellTags,postCellTags) for k,v in connParam[paramStrFunc+'Vars'].iteritems()}  
-                    if preCellGid != postCellGid: # if not self-connection   
-                        self._addCellConn(connParam, preCellGid, postCellGid) # add connection
+                    self._addCellConn(connParam, preCellGid, postCellGid) # add connection
 
 
     ###############################################################################
@@ -906,20 +1177,26 @@ class Network (object):
         # get list of params that have a lambda function
         paramsStrFunc = [param for param in [p+'Func' for p in self.connStringFuncParams] if param in connParam] 
 
+        # sorted array of postsyn gids (and spatial index to only consider those within maxDist)
+        maxDist = connParam.get('maxDist', None)
+        if maxDist is not None:
+            postGids, postArrays = self._cellTagsToArrays(postCellsTags)
+            postTree = self._spatialIndex(postArrays)
+        else:
+            postGids = np.array(sorted(postCellsTags), dtype=int)
+        streamId = sim.id32('%d%d'%(len(postCellsTags), sum(postCellsTags)))
+
         for preCellGid, preCellTags in preCellsTags.iteritems():  # for each presyn cell
+            candGids = postGids[self._cellsWithinDist(postTree, preCellTags, maxDist)] if maxDist is not None else postGids  # candidate postsyn cells
             divergence = connParam['divergenceFunc'][preCellGid] if 'divergenceFunc' in connParam else connParam['divergence']  # num of presyn conns / postsyn cell
-            divergence = max(min(int(round(divergence)), len(postCellsTags)-1), 0)
-            self.rand.Random123(sim.id32('%d%d'%(len(postCellsTags), sum(postCellsTags))), preCellGid, sim.cfg.seeds['conn'])  # init randomizer
-            randSample = self.randUniqueInt(self.rand, divergence+1, 0, len(postCellsTags)-1)
-            postCellsSample = [postCellsTags.keys()[i] for i in randSample[0:divergence]]  # selected gids of postsyn cells
-            postCellsSample[:] = [randSample[divergence] if x==preCellGid else x for x in postCellsSample] # remove post gid  
-            postCellsDiv = {postGid:postConds  for postGid,postConds in postCellsTags.iteritems() if postGid in postCellsSample and postGid in self.lid2gid}  # dict of selected postsyn cells tags
-            for postCellGid, postCellTags in postCellsDiv.iteritems():  # for each postsyn cell
-                
-                for paramStrFunc in paramsStrFunc: # call lambda functions to get weight func args
-                    connParam[paramStrFunc+'Args'] = {k:v if isinstance(v, Number) else v(preCellTags,postCellTags) for k,v in connParam[paramStrFunc+'Vars'].iteritems()}  
-            
-                if preCellGid != postCellGid: # if not self-connection
+            divergence = max(int(round(divergence)), 0)
+            self.rand.Random123(streamId, preCellGid, sim.cfg.seeds['conn'])  # init randomizer
+            randSample = self._randSample(self.rand, len(candGids), divergence, exclude=self._gidIndex(candGids, preCellGid))  # exclude self-connection
+            for postCellGid in candGids[randSample].tolist():  # for each selected postsyn cell
+                if postCellGid in self.gid2lid:  # check if postsyn is in this node
+                    postCellTags = postCellsTags[postCellGid]
+                    for paramStrFunc in paramsStrFunc: # call lambda functions to get weight func args
+                        connParam[paramStrFunc+'Args'] = {k:v if isinstance(v, Number) else v(preCellTags,postCellTags) for k,v in connParam[paramStrFunc+'Vars'].iteritems()}  
                     self._addCellConn(connParam, preCellGid, postCellGid) # add connection
 
                     
@@ -936,8 +1213,7 @@ class Network (object):
         paramsStrFunc = [param for param in [p+'Func' for p in self.connStringFuncParams] if param in connParam] 
         for paramStrFunc in paramsStrFunc:
             # replace lambda function (with args as dict of lambda funcs) with list of values
-            connParam[paramStrFunc[:-4]+'List'] = {(preGid,postGid): connParam[paramStrFunc](**{k:v if isinstance(v, Number) else v(preCellTags,postCellTags) for k,v in connParam[paramStrFunc+'Vars'].iteritems()})  
-                    for preGid,preCellTags in preCellsTags.iteritems() for postGid,postCellTags in postCellsTags.iteritems()}
+            connParam[paramStrFunc[:-4]+'List'] = self._strFuncToList(connParam, paramStrFunc, preCellsTags, postCellsTags)
 
         if 'weight' in connParam and isinstance(connParam['weight'], list): 
             connParam['weightFromList'] = list(connParam['weight'])  # if weight is a list, copy to weightFromList
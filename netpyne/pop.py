@@ -30,6 +30,9 @@ class Pop (object):
 
     def _distributeCells(self, numCellsPop):
         import sim
+
+        if sim.cfg.balanceCells:  # distribute by computational cost instead of round-robin
+            return self._distributeCellsBalanced(numCellsPop)
             
         hostCells = {}
         for i in range(sim.nhosts):
@@ -47,6 +50,55 @@ class Pop (object):
         return hostCells
 
 
+    def _distributeCellsBalanced(self, numCellsPop):
+        ''' Distribute cells using greedy LPT: cells sorted by cost (measured in previous run or estimated) assigned to least loaded host;
+        same result in all hosts, and gids are the same as with round-robin'''
+        import sim
+        import heapq
+
+        popCost = self._estimateCellCost()
+        costs = [sim.cellCosts.get(sim.net.lastGid+i, popCost) for i in range(numCellsPop)]
+
+        hostCells = {host: [] for host in range(sim.nhosts)}
+        hostLoads = [(load, host) for host,load in enumerate(sim.hostLoads)]  # loads include cells of previous pops
+        heapq.heapify(hostLoads)
+        for i in sorted(range(numCellsPop), key=lambda i: -costs[i]):  # largest cost first (stable sort)
+            load, host = heapq.heappop(hostLoads)
+            hostCells[host].append(i)
+            heapq.heappush(hostLoads, (load+costs[i], host))
+        for load,host in hostLoads:
+            sim.hostLoads[host] = load
+        for host in hostCells:
+            hostCells[host].sort()
+
+        if sim.cfg.verbose: 
+            print("Distributed population of %i cells on %s hosts by cost (%.1f per cell estimated): %s, host loads: %s"%(numCellsPop,sim.nhosts,popCost,hostCells,sim.hostLoads))
+        return hostCells
+
+
+    def _estimateCellCost(self):
+        ''' Estimate computational cost of each cell of pop from the cell rules matching the pop tags (1 for point cells)'''
+        import sim
+
+        if self.cellModelClass != sim.CompartCell:
+            return 1.0
+        cost = 0.0
+        for prop in sim.net.params.cellParams.values():
+            conditionsMet = True
+            for condKey,condVal in prop['conds'].iteritems():  # only conditions on pop tags (eg. not on cell locations)
+                if condKey not in self.tags:
+                    continue
+                if isinstance(condVal, list) and isinstance(condVal[0], basestring):
+                    conditionsMet = self.tags[condKey] in condVal
+                elif not isinstance(condVal, list):
+                    conditionsMet = self.tags[condKey] == condVal
+                if not conditionsMet:
+                    break
+            if conditionsMet:
+                cost += sim._secsCost(prop.get('secs', {}))
+        return max(cost, 1.0)
+
+
     # Function to instantiate Cell objects based on the characteristics of this population
     def createCells(self):
         # add individual cells
@@ -84,28 +136,7 @@ class Pop (object):
         vec = h.Vector(self.tags['numCells']*3)
         vec.setrand(self.rand)
         randLocs = np.array(vec).reshape(self.tags['numCells'], 3)  # create random x,y,z locations
-
-        if sim.net.params.shape == 'cylinder':
-            # Use the x,z random vales 
-            rho = randLocs[:,0] # use x rand value as the radius rho in the interval [0, 1)
-            phi = 2 * pi * randLocs[:,2] # use z rand value as the angle phi in the interval [0, 2*pi) 
-            x = (1 + sqrt(rho) * cos(phi))/2.0
-            z = (1 + sqrt(rho) * sin(phi))/2.0
-            randLocs[:,0] = x
-            randLocs[:,2] = z
-    
-        elif sim.net.params.shape == 'ellipsoid':
-            # Use the x,y,z random vales 
-            rho = np.power(randLocs[:,0], 1.0/3.0) # use x rand value as the radius rho in the interval [0, 1); cuberoot
-            phi = 2 * pi * randLocs[:,1] # use y rand value as the angle phi in the interval [0, 2*pi) 
-            costheta = (2 * randLocs[:,2]) - 1 # use z rand value as cos(theta) in the interval [-1, 1); ensures uniform dist 
-            theta = arccos(costheta)  # obtain theta from cos(theta)
-            x = (1 + rho * cos(phi) * sin(theta))/2.0
-            y = (1 + rho * sin(phi) * sin(theta))/2.0
-            z = (1 + rho * cos(theta))/2.0 
-            randLocs[:,0] = x
-            randLocs[:,1] = y
-            randLocs[:,2] = z
+        self._setShapeLocs(randLocs)
         
         for icoord, coord in enumerate(['x', 'y', 'z']):
             if coord+'Range' in self.tags:  # if user provided absolute range, convert to normalized
@@ -115,18 +146,14 @@ class Pop (object):
                 minv = self.tags[coord+'normRange'][0] 
                 maxv = self.tags[coord+'normRange'][1] 
                 randLocs[:,icoord] = randLocs[:,icoord] * (maxv-minv) + minv
+        locs = randLocs * [sim.net.params.sizeX, sim.net.params.sizeY, sim.net.params.sizeZ]  # locations (um) of all cells
 
+        popTags = self._cellPopTags()
         for i in self._distributeCells(int(sim.net.params.scale * self.tags['numCells']))[sim.rank]:
             gid = sim.net.lastGid+i
             self.cellGids.append(gid)  # add gid list of cells belonging to this population - not needed?
-            cellTags = {k: v for (k, v) in self.tags.iteritems() if k in sim.net.params.popTagsCopiedToCells}  # copy all pop tags to cell tags, except those that are pop-specific
-            cellTags['pop'] = self.tags['pop']
-            cellTags['xnorm'] = randLocs[i,0] # set x location (um)
-            cellTags['ynorm'] = randLocs[i,1] # set y location (um)
-            cellTags['znorm'] = randLocs[i,2] # set z location (um)
-            cellTags['x'] = sim.net.params.sizeX * randLocs[i,0] # set x location (um)
-            cellTags['y'] = sim.net.params.sizeY * randLocs[i,1] # set y location (um)
-            cellTags['z'] = sim.net.params.sizeZ * randLocs[i,2] # set z location (um)            
+            cellTags = dict(popTags)  # copy all pop tags to cell tags, except those that are pop-specific
+            self._setCellLocTags(cellTags, randLocs[i], locs[i])
             if 'spkTimes' in self.tags:  # if VecStim, copy spike times to params
                 if isinstance(self.tags['spkTimes'][0], list):
                     try:
@@ -183,16 +210,16 @@ class Pop (object):
                 maxRange = self.tags[coordFunc+'Range'][1]
 
                 interval = 0.001  # interval of location values to evaluate func in order to find the max cell density
-                maxDensity = max(map(densityFunc, (np.arange(minRange, maxRange, interval))))  # max cell density 
+                maxDensity = max(self._evalDensityFunc(densityFunc, np.arange(minRange, maxRange, interval)))  # max cell density 
                 maxCells = volume * maxDensity  # max number of cells based on max value of density func 
                 
                 self.rand.Random123(int(maxDensity), sim.net.lastGid, sim.cfg.seeds['loc'])
-                locsAll = minRange + ((maxRange-minRange)) * np.array([self.rand.uniform(0, 1) for i in range(int(maxCells))])  # random location values 
-                locsProb = np.array(map(densityFunc, locsAll)) / maxDensity  # calculate normalized density for each location value (used to prune)
-                allrands = np.array([self.rand.uniform(0, 1) for i in range(len(locsProb))])  # create an array of random numbers for checking each location pos 
+                locsAll = minRange + ((maxRange-minRange)) * self._randUniform(int(maxCells))  # random location values 
+                locsProb = self._evalDensityFunc(densityFunc, locsAll) / maxDensity  # calculate normalized density for each location value (used to prune)
+                allrands = self._randUniform(len(locsProb))  # create an array of random numbers for checking each location pos 
                 
                 makethiscell = locsProb>allrands  # perform test to see whether or not this cell should be included (pruning based on density func)
-                funcLocs = [locsAll[i] for i in range(len(locsAll)) if i in np.array(makethiscell.nonzero()[0],dtype='int')] # keep only subset of yfuncLocs based on density func
+                funcLocs = list(locsAll[makethiscell]) # keep only subset of yfuncLocs based on density func
                 self.tags['numCells'] = len(funcLocs)  # final number of cells after pruning of location values based on density func
                 if sim.cfg.verbose: print 'Volume=%.2f, maxDensity=%.2f, maxCells=%.0f, numCells=%.0f'%(volume, maxDensity, maxCells, self.tags['numCells'])
             else:
@@ -207,28 +234,7 @@ class Pop (object):
         vec = h.Vector(self.tags['numCells']*3)
         vec.setrand(self.rand)
         randLocs = np.array(vec).reshape(self.tags['numCells'], 3)  # create random x,y,z locations
-
-        if sim.net.params.shape == 'cylinder':
-            # Use the x,z random vales 
-            rho = randLocs[:,0] # use x rand value as the radius rho in the interval [0, 1)
-            phi = 2 * pi * randLocs[:,2] # use z rand value as the angle phi in the interval [0, 2*pi) 
-            x = (1 + sqrt(rho) * cos(phi))/2.0
-            z = (1 + sqrt(rho) * sin(phi))/2.0
-            randLocs[:,0] = x
-            randLocs[:,2] = z
-    
-        elif sim.net.params.shape == 'ellipsoid':
-            # Use the x,y,z random vales 
-            rho = np.power(randLocs[:,0], 1.0/3.0) # use x rand value as the radius rho in the interval [0, 1); cuberoot
-            phi = 2 * pi * randLocs[:,1] # use y rand value as the angle phi in the interval [0, 2*pi) 
-            costheta = (2 * randLocs[:,2]) - 1 # use z rand value as cos(theta) in the interval [-1, 1); ensures uniform dist 
-            theta = arccos(costheta)  # obtain theta from cos(theta)
-            x = (1 + rho * cos(phi) * sin(theta))/2.0
-            y = (1 + rho * sin(phi) * sin(theta))/2.0
-            z = (1 + rho * cos(theta))/2.0 
-            randLocs[:,0] = x
-            randLocs[:,1] = y
-            randLocs[:,2] = z
+        self._setShapeLocs(randLocs)
 
         for icoord, coord in enumerate(['x', 'y', 'z']):
             if coord+'normRange' in self.tags:  # if normalized range, rescale random locations
@@ -240,17 +246,14 @@ class Pop (object):
 
         if sim.cfg.verbose and not funcLocs: print 'Volume=%.4f, density=%.2f, numCells=%.0f'%(volume, self.tags['density'], self.tags['numCells'])
 
+        locs = randLocs * [sizeX, sizeY, sizeZ]  # locations (um) of all cells
+
+        popTags = self._cellPopTags()
         for i in self._distributeCells(self.tags['numCells'])[sim.rank]:
             gid = sim.net.lastGid+i
             self.cellGids.append(gid)  # add gid list of cells belonging to this population - not needed?
-            cellTags = {k: v for (k, v) in self.tags.iteritems() if k in sim.net.params.popTagsCopiedToCells}  # copy all pop tags to cell tags, except those that are pop-specific
-            cellTags['pop'] = self.tags['pop']
-            cellTags['xnorm'] = randLocs[i,0]  # calculate x location (um)
-            cellTags['ynorm'] = randLocs[i,1]  # calculate y location (um)
-            cellTags['znorm'] = randLocs[i,2]  # calculate z location (um)
-            cellTags['x'] = sizeX * randLocs[i,0]  # calculate x location (um)
-            cellTags['y'] = sizeY * randLocs[i,1]  # calculate y location (um)
-            cellTags['z'] = sizeZ * randLocs[i,2]  # calculate z location (um)
+            cellTags = dict(popTags)  # copy all pop tags to cell tags, except those that are pop-specific
+            self._setCellLocTags(cellTags, randLocs[i], locs[i])
             cells.append(self.cellModelClass(gid, cellTags)) # instantiate Cell object
             if sim.cfg.verbose: 
                 print('Cell %d/%d (gid=%d) of pop %s, pos=(%2.f, %2.f, %2.f), on node %d, '%(i, self.tags['numCells']-1, gid, self.tags['pop'],cellTags['x'], cellTags['y'], cellTags['z'], sim.rank))
@@ -303,31 +306,87 @@ class Pop (object):
                 rangeLocs[icoord] = [self.tags[coord+'Range'][0], self.tags[coord+'Range'][1]] 
               
         gridSpacing = self.tags['gridSpacing']
-        gridLocs = []
-        for x in np.arange(rangeLocs[0][0], rangeLocs[0][1]+1, gridSpacing):
-            for y in np.arange(rangeLocs[1][0], rangeLocs[1][1]+1, gridSpacing):
-                for z in np.arange(rangeLocs[2][0], rangeLocs[2][1]+1, gridSpacing):
-                    gridLocs.append((x, y, z))
+        gridAxes = [np.arange(rangeLocs[icoord][0], rangeLocs[icoord][1]+1, gridSpacing) for icoord in range(3)]
+        gridLocs = np.array(np.meshgrid(*gridAxes, indexing='ij')).reshape(3, -1).T  # grid locations (x varies slowest, z fastest)
+        gridNormLocs = gridLocs / [sim.net.params.sizeX, sim.net.params.sizeY, sim.net.params.sizeZ]
 
         numCells = len(gridLocs)
 
+        popTags = self._cellPopTags()
         for i in self._distributeCells(numCells)[sim.rank]:
             gid = sim.net.lastGid+i
             self.cellGids.append(gid)  # add gid list of cells belonging to this population - not needed?
-            cellTags = {k: v for (k, v) in self.tags.iteritems() if k in sim.net.params.popTagsCopiedToCells}  # copy all pop tags to cell tags, except those that are pop-specific
-            cellTags['pop'] = self.tags['pop']
-            cellTags['xnorm'] = gridLocs[i][0] / sim.net.params.sizeX # set x location (um)
-            cellTags['ynorm'] = gridLocs[i][1] / sim.net.params.sizeY # set y location (um)
-            cellTags['znorm'] = gridLocs[i][2] / sim.net.params.sizeZ # set z location (um)
-            cellTags['x'] = gridLocs[i][0]   # set x location (um)
-            cellTags['y'] = gridLocs[i][1] # set y location (um)
-            cellTags['z'] = gridLocs[i][2] # set z location (um)
+            cellTags = dict(popTags)  # copy all pop tags to cell tags, except those that are pop-specific
+            self._setCellLocTags(cellTags, gridNormLocs[i], gridLocs[i])
             cells.append(self.cellModelClass(gid, cellTags)) # instantiate Cell object
             if sim.cfg.verbose: print('Cell %d/%d (gid=%d) of pop %s, on node %d, '%(i, numCells, gid, self.tags['pop'], sim.rank))
         sim.net.lastGid = sim.net.lastGid + numCells
         return cells
 
 
+    def _cellPopTags (self):
+        ''' Pop tags copied to the tags of each cell '''
+        import sim
+
+        popTags = {k: v for (k, v) in self.tags.iteritems() if k in sim.net.params.popTagsCopiedToCells}
+        popTags['pop'] = self.tags['pop']
+        return popTags
+
+
+    def _setCellLocTags (self, cellTags, normLoc, loc):
+        ''' Set normalized and absolute (um) location tags of cell '''
+        cellTags['xnorm'], cellTags['ynorm'], cellTags['znorm'] = normLoc
+        cellTags['x'], cellTags['y'], cellTags['z'] = loc
+
+
+    def _setShapeLocs (self, randLocs):
+        ''' Convert random locations (rows of x,y,z in [0,1)) to uniformly distributed locations within network shape '''
+        import sim
+
+        if sim.net.params.shape == 'cylinder':
+            # Use the x,z random vales 
+            rho = randLocs[:,0] # use x rand value as the radius rho in the interval [0, 1)
+            phi = 2 * pi * randLocs[:,2] # use z rand value as the angle phi in the interval [0, 2*pi) 
+            x = (1 + sqrt(rho) * cos(phi))/2.0
+            z = (1 + sqrt(rho) * sin(phi))/2.0
+            randLocs[:,0] = x
+            randLocs[:,2] = z
+
+        elif sim.net.params.shape == 'ellipsoid':
+            # Use the x,y,z random vales 
+            rho = np.power(randLocs[:,0], 1.0/3.0) # use x rand value as the radius rho in the interval [0, 1); cuberoot
+            phi = 2 * pi * randLocs[:,1] # use y rand value as the angle phi in the interval [0, 2*pi) 
+            costheta = (2 * randLocs[:,2]) - 1 # use z rand value as cos(theta) in the interval [-1, 1); ensures uniform dist 
+            theta = arccos(costheta)  # obtain theta from cos(theta)
+            x = (1 + rho * cos(phi) * sin(theta))/2.0
+            y = (1 + rho * sin(phi) * sin(theta))/2.0
+            z = (1 + rho * cos(theta))/2.0 
+            randLocs[:,0] = x
+            randLocs[:,1] = y
+            randLocs[:,2] = z
+
+
+    def _randUniform (self, n):
+        ''' Array of n values from self.rand (same values as n calls to self.rand.uniform(0, 1)) '''
+        if n <= 0:
+            return np.array([])
+        first = self.rand.uniform(0, 1)
+        vec = h.Vector(n-1)
+        vec.setrand(self.rand)
+        return np.concatenate(([first], np.array(vec)))
+
+
+    def _evalDensityFunc (self, densityFunc, locs):
+        ''' Evaluate density function for array of locations (for all at once if function supports arrays) '''
+        try:
+            densities = np.asarray(densityFunc(locs), dtype=float)
+            if densities.shape == locs.shape:
+                return densities
+        except Exception:
+            pass
+        return np.array(map(densityFunc, locs))
+
+
     def _setCellClass (self):
         ''' Set cell class (CompartCell, PointCell, etc)'''
         import sim
@@ -21,6 +21,9 @@ from . import analysis
 from .network import Network
 from .cell import CompartCell, PointCell, NML2Cell, NML2SpikeSource
 from .pop import Pop
+from .celltable import CellTable
+from .conntable import ConnTable
+from .spikeindex import SpikeIndex
 from . import utils
 from neuron import h
 from . import tests
@@ -8,10 +8,10 @@ Contributors: salvadordura@gmail.com
 
 __all__ = []
 __all__.extend(['initialize', 'setNet', 'setNetParams', 'setSimCfg', 'createParallelContext', 'setupRecording', 'setupRecordLFP', 'calculateLFP', 'clearAll', 'setGlobals']) # init and setup
-__all__.extend(['preRun', 'runSim', 'runSimWithIntervalFunc', '_gatherAllCellTags', '_gatherAllCellConnPreGids', '_gatherCells', 'gatherData'])  # run and gather
-__all__.extend(['saveData', 'loadSimCfg', 'loadNetParams', 'loadNet', 'loadSimData', 'loadAll', 'ijsonLoad', 'compactConnFormat']) # saving and loading
+__all__.extend(['preRun', 'runSim', 'runSimWithIntervalFunc', 'runSimWithStreaming', 'streamData', 'runSimWithCheckpoints', 'saveCheckpoint', 'restoreCheckpoint', '_gatherAllCellTags', '_gatherAllCellTagsCompact', '_gatherAllCellConnPreGids', '_gatherCells', 'gatherData'])  # run and gather
+__all__.extend(['saveData', 'saveDataDistributed', 'loadSimCfg', 'loadNetParams', 'loadNet', 'loadSimData', 'loadAll', 'loadDataDistributed', 'ijsonLoad', 'compactConnFormat']) # saving and loading
 __all__.extend(['popAvgRates', 'id32', 'copyReplaceItemObj', 'clearObj', 'replaceItemObj', 'replaceNoneObj', 'replaceFuncObj', 'replaceDictODict', 
-    'readCmdLineArgs', 'getCellsList', 'cellByGid','timing',  'version', 'gitChangeset', 'loadBalance','_init_stim_randomizer', 'decimalToFloat', 'unique',
+    'readCmdLineArgs', 'getCellsList', 'cellByGid','timing',  'version', 'gitChangeset', 'loadBalance', 'saveCellCosts', '_secsCost', '_init_stim_randomizer', 'decimalToFloat', 'unique',
     'rename'])  # misc/utilities
 
 import sys
@@ -23,7 +23,7 @@ import cPickle as pk
 import hashlib
 from numbers import Number
 from copy import copy
-from specs import Dict, ODict
+from specs import Dict, ODict, SharedDict
 from collections import OrderedDict
 from neuron import h, init # Import NEURON
 import specs
@@ -48,6 +48,8 @@ def initialize (netParams = None, simConfig = None, net = None):
     sim.fih = []  # list of func init handlers
     sim.rank = 0  # initialize rank
     sim.nextHost = 0  # initialize next host
+    sim.hostLoads = None  # cost of cells assigned to each host (cfg.balanceCells)
+    sim.cellCosts = {}  # cost of each cell measured in previous run (cfg.balanceCells)
     sim.timingData = Dict()  # dict to store timing
 
     sim.createParallelContext()  # inititalize PC, nhosts and rank
@@ -171,10 +173,10 @@ def compactToLongConnFormat(cells, connFormat):
 ###############################################################################
 # Load cells and pops from file and create NEURON objs
 ###############################################################################
-def loadNet (filename, data=None, instantiate=True, compactConnFormat=False):
+def loadNet (filename, data=None, instantiate=True, compactConnFormat=False, gidRange=None):
     import sim
 
-    if not data: data = _loadFile(filename)
+    if not data: data = _loadFile(filename, gidRange=gidRange)
     if 'net' in data and 'cells' in data['net'] and 'pops' in data['net']:
         if sim.rank == 0:
             sim.timing('start', 'loadNetTime')
@@ -269,10 +271,10 @@ def loadSimCfg (filename, data=None, setLoaded=True):
 ###############################################################################
 # Load netParams from cell
 ###############################################################################
-def loadSimData (filename, data=None):
+def loadSimData (filename, data=None, gidRange=None, timeRange=None):
     import sim
 
-    if not data: data = _loadFile(filename)
+    if not data: data = _loadFile(filename, gidRange=gidRange, timeRange=timeRange)
     print('Loading simData...')
     if 'simData' in data:
         sim.allSimData = data['simData']
@@ -285,10 +287,10 @@ def loadSimData (filename, data=None):
 ###############################################################################
 # Load all data in file
 ###############################################################################
-def loadAll (filename, data=None, instantiate=True, createNEURONObj=True):
+def loadAll (filename, data=None, instantiate=True, createNEURONObj=True, gidRange=None, timeRange=None):
     import sim 
 
-    if not data: data = _loadFile(filename)
+    if not data: data = _loadFile(filename, gidRange=gidRange, timeRange=timeRange)
     loadSimCfg(filename, data=data)
     sim.cfg.createNEURONObj = createNEURONObj  # set based on argument
     loadNetParams(filename, data=data)
@@ -301,6 +303,17 @@ def loadAll (filename, data=None, instantiate=True, createNEURONObj=True):
     loadSimData(filename, data=data)
 
 
+###############################################################################
+# Load data saved by each node (saveDataDistributed); optionally only cells in gids
+###############################################################################
+def loadDataDistributed (filename, gids=None):
+    ''' Load data from manifest file saved by saveDataDistributed; can then be used as loadAll(filename, data=data) or loadNet(filename, data=data) '''
+    data = _loadFile(filename, gids=gids)
+    if data and gids is not None and 'net' in data and 'cells' in data['net']:
+        print('  Loaded %d cells of %d gids selected' % (len(data['net']['cells']), len(gids)))
+    return data
+
+
 ###############################################################################
 # Fast function to find unique elements in sequence and preserve order
 ###############################################################################
@@ -362,30 +375,34 @@ def _mat2dict(obj):
     return out
 
 
+###############################################################################
+# Convert unicode strings loaded from json to str
+###############################################################################
+def _byteify(data, ignore_dicts = False):
+    # if this is a unicode string, return its string representation
+    if isinstance(data, unicode):
+        return data.encode('utf-8')
+    # if this is a list of values, return list of byteified values
+    if isinstance(data, list):
+        return [ _byteify(item, ignore_dicts=True) for item in data ]
+    # if this is a dictionary, return dictionary of byteified keys and values
+    # but only if we haven't already byteified it
+    if isinstance(data, dict) and not ignore_dicts:
+        return OrderedDict({
+            _byteify(key, ignore_dicts=True): _byteify(value, ignore_dicts=True)
+            for key, value in data.iteritems()
+        })
+    # if it's anything else, return it in its original form
+    return data
+
+
 ###############################################################################
 # Load data from file
 ###############################################################################
-def _loadFile (filename):
+def _loadFile (filename, gids=None, gidRange=None, timeRange=None):
     import sim
     import os
 
-    def _byteify(data, ignore_dicts = False):
-        # if this is a unicode string, return its string representation
-        if isinstance(data, unicode):
-            return data.encode('utf-8')
-        # if this is a list of values, return list of byteified values
-        if isinstance(data, list):
-            return [ _byteify(item, ignore_dicts=True) for item in data ]
-        # if this is a dictionary, return dictionary of byteified keys and values
-        # but only if we haven't already byteified it
-        if isinstance(data, dict) and not ignore_dicts:
-            return OrderedDict({
-                _byteify(key, ignore_dicts=True): _byteify(value, ignore_dicts=True)
-                for key, value in data.iteritems()
-            })
-        # if it's anything else, return it in its original form
-        return data
-
     if hasattr(sim, 'cfg') and sim.cfg.timing: sim.timing('start', 'loadFileTime')
     ext = os.path.basename(filename).split('.')[1]
 
@@ -410,6 +427,10 @@ def _loadFile (filename):
         print('Loading file %s ... ' % (filename))
         with open(filename, 'r') as fileObj:
             data = json.load(fileObj, object_hook=_byteify)
+        if 'nodeFiles' in data:  # manifest of files saved by each node (saveDataDistributed)
+            data = _loadNodeFiles(filename, data, gids)
+        elif 'streamNodeFiles' in data:  # manifest of data streamed by each node (runSimWithStreaming)
+            data = _loadStreamFiles(filename, data, gidRange=gidRange, timeRange=timeRange)
 
     # load mat file
     elif ext == 'mat':
@@ -420,13 +441,10 @@ def _loadFile (filename):
         #savemat(sim.cfg.filename+'.mat', replaceNoneObj(dataSave))  # replace None and {} with [] so can save in .mat format
         print('Finished saving!')
 
-    # load HDF5 file (uses very inefficient hdf5storage module which supports dicts)
-    elif ext == 'saveHDF5':
-        #dataSaveUTF8 = _dict2utf8(replaceNoneObj(dataSave)) # replace None and {} with [], and convert to utf
-        import hdf5storage
+    # load HDF5 file (optionally only cells in gidRange and data in timeRange)
+    elif ext in ['hdf5', 'h5']:
         print('Loading file %s ... ' % (filename))
-        #hdf5storage.writes(dataSaveUTF8, filename=sim.cfg.filename+'.hdf5')
-        print('NOT IMPLEMENTED!')
+        data = _loadHDF5(filename, gidRange=gidRange, timeRange=timeRange)
 
     # load CSV file (currently only saves spikes)
     elif ext == 'csv':
@@ -463,6 +481,298 @@ def _loadFile (filename):
 
     return data
 
+
+###############################################################################
+# Load data from files saved by each node (optionally only cells in gids)
+###############################################################################
+def _loadNodeFiles (filename, manifest, gids=None):
+    import os
+
+    folder = os.path.dirname(filename)
+    gidSet = set(gids) if gids is not None else None
+    nodeFiles = manifest['nodeFiles']
+    if gidSet is not None:  # only files with some of the gids
+        nodeFiles = [nodeFile for nodeFile in nodeFiles
+            if any(gid in gidSet for gidRange in nodeFile['gidRanges'] for gid in xrange(*gidRange))]
+
+    cells, nodesSimData = [], []
+    for nodeFile in nodeFiles:
+        print('  Loading node file %s ... ' % (nodeFile['file']))
+        with open(os.path.join(folder, nodeFile['file']), 'rb') as fileObj:
+            nodeData = pk.load(fileObj)
+        if 'cells' in nodeData:
+            cells.extend([cell for cell in nodeData['cells'] if gidSet is None or cell['gid'] in gidSet])
+        if 'simData' in nodeData:
+            nodesSimData.append(_selectSimDataGids(nodeData['simData'], gidSet))
+
+    data = {'netpyne_version': manifest['netpyne_version']}
+    if 'simConfig' in manifest: data['simConfig'] = manifest['simConfig']
+    net = {}
+    if 'netParams' in manifest: net['params'] = manifest['netParams']
+    if 'netCells' in manifest['include']:
+        net['cells'] = sorted(cells, key=lambda k: k['gid'])
+        net['pops'] = ODict()
+        for popLabel,popTags in manifest['pops']:
+            net['pops'][popLabel] = {'tags': popTags, 'cellGids': [cell['gid'] for cell in net['cells'] if cell['tags']['pop'] == popLabel]}
+    if net: data['net'] = net
+
+    if nodesSimData:
+        simData = Dict()
+        simData['spkt'], simData['spkid'] = _mergeSpikes([node['spkt'] for node in nodesSimData], [node['spkid'] for node in nodesSimData])
+        for key,val in nodesSimData[0].iteritems():
+            if key in ['spkt', 'spkid']:
+                continue
+            elif key in ['LFP', 'LFPPops']:
+                if len(nodesSimData) != len(manifest['nodeFiles']):  # LFP of each node is the contribution of its cells
+                    print('  %s not loaded since only includes cells of some nodes' % (key))
+                elif key == 'LFP':
+                    simData[key] = np.sum([node[key] for node in nodesSimData], axis=0)
+                else:
+                    simData[key] = Dict()
+                    for node in nodesSimData:
+                        for group,lfp in node[key].iteritems():
+                            simData[key][group] = simData[key].get(group, 0) + np.array(lfp)
+            elif isinstance(val, dict):
+                simData[key] = Dict()
+                for node in nodesSimData:
+                    simData[key].update(node[key])
+            else:
+                simData[key] = val
+        data['simData'] = simData
+
+    return data
+
+
+###############################################################################
+# Load spikes and traces streamed by each node (optionally only cells in gidRange and data in timeRange)
+###############################################################################
+def _loadStreamFiles (filename, manifest, gidRange=None, timeRange=None):
+    import os
+    import json
+
+    folder = os.path.dirname(filename)
+    spkts, spkids = [], []
+    simData = Dict()
+    for indexFile in manifest['streamNodeFiles']:
+        if not os.path.exists(os.path.join(folder, indexFile)):
+            print('  Node file %s not found' % (indexFile))
+            continue
+        with open(os.path.join(folder, indexFile), 'r') as fileObj:
+            index = json.load(fileObj, object_hook=_byteify)
+
+        # spikes (only chunks overlapping timeRange are read from memory-mapped file)
+        spikes = index['spikes']
+        chunks = [chunk for chunk in spikes['chunks'] if not timeRange or (chunk[1] >= timeRange[0] and chunk[0] < timeRange[1])]
+        start, end = (chunks[0][2], chunks[-1][2]+chunks[-1][3]) if chunks else (0, 0)
+        if end > start:
+            records = np.memmap(os.path.join(folder, spikes['file']), dtype=[('spkt', np.float64), ('spkid', np.float64)], mode='r')[start:end]
+            mask = np.ones(len(records), dtype=bool)
+            if timeRange: mask &= (records['spkt'] >= timeRange[0]) & (records['spkt'] < timeRange[1])
+            if gidRange: mask &= (records['spkid'] >= gidRange[0]) & (records['spkid'] < gidRange[1])
+            spkts.append(records['spkt'][mask])  # chunks of node are consecutive in time, so still sorted
+            spkids.append(records['spkid'][mask])
+
+        # traces (rows = time samples every recordStep from t=0, so rows in timeRange obtained directly)
+        for key,trace in index['traces'].iteritems():
+            labels = trace['labels']
+            numRows = trace['chunks'][-1][2]+trace['chunks'][-1][3] if trace['chunks'] else 0
+            if timeRange:
+                start, end = [min(numRows, int(np.ceil(tLimit/manifest['recordStep']))) for tLimit in timeRange]
+            else:
+                start, end = 0, numRows
+            if end <= start or not labels:
+                continue
+            data = np.memmap(os.path.join(folder, trace['file']), dtype=np.float64, mode='r', shape=(numRows, len(labels)))[start:end]
+            if key == 't':
+                if 't' not in simData: simData['t'] = np.array(data[:, 0])
+                continue
+            simData.setdefault(key, Dict())
+            for i,label in enumerate(labels):
+                gid = _cellLabelGid(label[0] if isinstance(label, list) else label)
+                if gidRange and gid is not None and not gidRange[0] <= gid < gidRange[1]:
+                    continue
+                if isinstance(label, list):
+                    simData[key].setdefault(label[0], Dict())[label[1]] = np.array(data[:, i])
+                else:
+                    simData[key][label] = np.array(data[:, i])
+
+    simData['spkt'], simData['spkid'] = _mergeSpikes(spkts, spkids) if spkts else (np.array([]), np.array([]))
+    data = {'netpyne_version': manifest['netpyne_version'], 'simData': simData}
+    if 'simConfig' in manifest: data['simConfig'] = manifest['simConfig']
+
+    return data
+
+
+###############################################################################
+# Gid of sim data label ('cell_<gid>' or gid); None if not a cell label
+###############################################################################
+def _cellLabelGid (label):
+    if isinstance(label, Number):
+        return int(label)
+    elif isinstance(label, basestring) and label.startswith('cell_') and label[5:].isdigit():
+        return int(label[5:])
+
+
+###############################################################################
+# Select sim data of gids (keys 'cell_<gid>' or gid)
+###############################################################################
+def _selectSimDataGids (simData, gidSet=None):
+    if gidSet is None:
+        return simData
+
+    spkMask = np.in1d(simData['spkid'], list(gidSet)) if 'spkid' in simData else None
+    selected = {}
+    for key,val in simData.iteritems():
+        if key in ['spkt', 'spkid']:
+            selected[key] = val[spkMask]
+        elif isinstance(val, dict):
+            selected[key] = Dict({label: val2 for label,val2 in val.iteritems() if _cellLabelGid(label) is None or _cellLabelGid(label) in gidSet})
+        else:
+            selected[key] = val
+    return selected
+
+
+###############################################################################
+# Load data from HDF5 file saved by _saveHDF5 (optionally only cells in gidRange [min, max) and data in timeRange)
+###############################################################################
+def _loadHDF5 (filename, gidRange=None, timeRange=None):
+    import h5py
+    import json
+
+    def _json (dset):
+        return _byteify(json.loads(dset[()], object_hook=_byteify), ignore_dicts=True)
+
+    def _searchSorted (dset, value):  # binary search on dataset without reading it (only log(n) elements)
+        lo, hi = 0, len(dset)
+        while lo < hi:
+            mid = (lo+hi)//2
+            if dset[mid] < value: lo = mid+1
+            else: hi = mid
+        return lo
+
+    def _gidRows (gids):  # range of rows of sorted gids within gidRange
+        if gidRange is None: return 0, len(gids)
+        return _searchSorted(gids, gidRange[0]), _searchSorted(gids, gidRange[1])
+
+    data = {}
+    with h5py.File(filename, 'r') as fileObj:
+        for key,val in fileObj.attrs.iteritems():
+            data[str(key)] = str(val)
+        if 'simConfig' in fileObj: data['simConfig'] = _json(fileObj['simConfig'])
+        connFormat = data.get('simConfig', {}).get('compactConnFormat', False)
+        recordStep = data.get('simConfig', {}).get('recordStep', 0.1)
+
+        # net
+        if 'net' in fileObj:
+            netGroup = fileObj['net']
+            net = {}
+            if 'params' in netGroup: net['params'] = _json(netGroup['params'])
+            if 'cells' in netGroup:
+                cellsDset = netGroup['cells']
+                cellStart, cellEnd = _gidRows(cellsDset['gid'])
+                table = cellsDset[cellStart:cellEnd]
+                jsonFields = json.loads(cellsDset.attrs['jsonFields'])
+                tagKeys = [key for key in table.dtype.names if key != 'gid']
+                cells = []
+                for row in table:
+                    tags = {}
+                    for key in tagKeys:
+                        value = row[key]
+                        if key in jsonFields:
+                            tags[key] = _byteify(json.loads(value, object_hook=_byteify), ignore_dicts=True)
+                        elif isinstance(value, np.bytes_):
+                            tags[key] = str(value)
+                        elif not np.isnan(value):
+                            tags[key] = float(value)
+                    cells.append({'gid': int(row['gid']), 'tags': tags, 'conns': [], 'stims': [], 'secs': {}})
+
+                # conns of cells (rows of each cell given by offsets)
+                if 'conns' in netGroup:
+                    connsDset = netGroup['conns']
+                    offsets = netGroup['connOffsets'][cellStart:cellEnd+1]
+                    connsTable = connsDset[offsets[0]:offsets[-1]] if len(offsets) > 1 else []
+                    categories = {field: json.loads(connsDset.attrs[field+'s']) for field in ['synMech', 'sec', 'preLabel', 'label']}
+                    connLists = {str(field): dset[offsets[0]:offsets[-1]] for field,dset in netGroup['connLists'].iteritems()} if 'connLists' in netGroup else {}
+                    connExtras = netGroup['connExtras'][offsets[0]:offsets[-1]] if 'connExtras' in netGroup else None
+                    for i,cell in enumerate(cells):
+                        for j in range(offsets[i]-offsets[0], offsets[i+1]-offsets[0]):
+                            row = connsTable[j]
+                            conn = {'preGid': int(row['preGid']) if row['preGid'] >= 0 else 'NetStim'}
+                            for field,values in categories.iteritems():
+                                if row[field] >= 0: conn[field] = str(values[row[field]])
+                            for field in ['weight', 'delay', 'loc']:
+                                if not np.isnan(row[field]): conn[field] = float(row[field])
+                                elif field in connLists and len(connLists[field][j]) > 0: conn[field] = connLists[field][j].tolist()
+                            if connExtras is not None and connExtras[j]:
+                                conn.update(_byteify(json.loads(connExtras[j], object_hook=_byteify), ignore_dicts=True))
+                            if isinstance(connFormat, list):  # same format as saved
+                                conn = [conn.get(param, None) for param in connFormat]
+                            cell['conns'].append(conn)
+
+                if 'cellSecs' in netGroup:
+                    for cell,secs in zip(cells, netGroup['cellSecs'][cellStart:cellEnd]):
+                        cell['secs'] = _byteify(json.loads(secs, object_hook=_byteify), ignore_dicts=True)
+                if 'cellStims' in netGroup:
+                    for cell,stims in zip(cells, netGroup['cellStims'][cellStart:cellEnd]):
+                        cell['stims'] = _byteify(json.loads(stims, object_hook=_byteify), ignore_dicts=True) or []
+                net['cells'] = cells
+
+            if 'pops' in netGroup:
+                net['pops'] = ODict()
+                for popLabel,pop in _json(netGroup['pops']):
+                    pop['cellGids'] = [cell['gid'] for cell in net.get('cells', []) if cell['tags'].get('pop') == popLabel]
+                    net['pops'][popLabel] = pop
+            data['net'] = net
+
+        # simData
+        if 'simData' in fileObj:
+            simGroup = fileObj['simData']
+            simData = Dict()
+            spktDset, spkidDset = simGroup['spkt'], simGroup['spkid']
+            spkStart, spkEnd = (_searchSorted(spktDset, timeRange[0]), _searchSorted(spktDset, timeRange[1])) if timeRange else (0, len(spktDset))
+            spkt, spkid = spktDset[spkStart:spkEnd], spkidDset[spkStart:spkEnd]
+            if gidRange is not None:
+                mask = (spkid >= gidRange[0]) & (spkid < gidRange[1])
+                spkt, spkid = spkt[mask], spkid[mask]
+            simData['spkt'], simData['spkid'] = spkt, spkid
+
+            t = simGroup['t'][:] if 't' in simGroup else None
+            tStart, tEnd = (np.searchsorted(t, timeRange[0]), np.searchsorted(t, timeRange[1])) if timeRange and t is not None else (0, None)
+            if t is not None: simData['t'] = t[tStart:tEnd]
+
+            for key in simGroup:
+                if key in ['spkt', 'spkid', 't']:
+                    continue
+                elif key in ['LFP', 'LFPPops']:  # rows saved every recordStep
+                    lfpStart, lfpEnd = (int(timeRange[0]/recordStep), int(timeRange[1]/recordStep)) if timeRange else (0, None)
+                    if key == 'LFP':
+                        simData['LFP'] = simGroup['LFP'][lfpStart:lfpEnd]
+                    else:
+                        simData['LFPPops'] = Dict({str(group): lfp[lfpStart:lfpEnd] for group,lfp in simGroup['LFPPops'].iteritems()})
+                elif key == 'LFPCells':
+                    simData['LFPCells'] = Dict({int(gid): lfp[:] for gid,lfp in simGroup['LFPCells'].iteritems()
+                        if gidRange is None or gidRange[0] <= int(gid) < gidRange[1]})
+                elif key == 'stims':
+                    simData['stims'] = Dict()
+                    for cellLabel,cellGroup in simGroup['stims'].iteritems():
+                        gid = _cellLabelGid(cellLabel)
+                        if gidRange is None or gid is None or gidRange[0] <= gid < gidRange[1]:
+                            simData['stims'][str(cellLabel)] = Dict()
+                            for stimLabel,stimTimes in cellGroup.iteritems():
+                                stimTimes = stimTimes[:]
+                                if timeRange: stimTimes = stimTimes[(stimTimes >= timeRange[0]) & (stimTimes < timeRange[1])]
+                                simData['stims'][str(cellLabel)][str(stimLabel)] = stimTimes
+                elif key == 'other':
+                    simData.update(_json(simGroup['other']))
+                else:  # traces (cell x time)
+                    gidsDset = simGroup[key]['gids']
+                    rowStart, rowEnd = _gidRows(gidsDset)
+                    traces = simGroup[key]['data'][rowStart:rowEnd, tStart:tEnd]
+                    simData[str(key)] = Dict({'cell_%d' % gid: trace for gid,trace in zip(gidsDset[rowStart:rowEnd], traces)})
+            data['simData'] = simData
+
+    return data
+
 ###############################################################################
 # Clear all sim objects in memory
 ###############################################################################
@@ -530,6 +840,8 @@ def copyReplaceItemObj (obj, keystart, newval, objCopy='ROOT'):
             if isinstance(item, list):
                 objCopy.append([])
                 copyReplaceItemObj(item, keystart, newval, objCopy[-1])
+            elif isinstance(item, SharedDict):  # read-only shared dicts (eg. section specs) have no h objects, so not copied
+                objCopy.append(item)
             elif isinstance(item, (dict, Dict)):
                 objCopy.append({})
                 copyReplaceItemObj(item, keystart, newval, objCopy[-1])
@@ -543,6 +855,8 @@ def copyReplaceItemObj (obj, keystart, newval, objCopy='ROOT'):
             if type(val) in [list]:
                 objCopy[key] = []
                 copyReplaceItemObj(val, keystart, newval, objCopy[key])
+            elif isinstance(val, SharedDict):
+                objCopy[key] = val
             elif isinstance(val, (dict, Dict)):
                 objCopy[key] = {}
                 copyReplaceItemObj(val, keystart, newval, objCopy[key])
@@ -652,11 +966,13 @@ def replaceNoneObj (obj):
 
     elif isinstance(obj, (dict, Dict, ODict)):
         for key,val in obj.iteritems():
+            if isinstance(val, SharedDict):  # replace read-only shared dict with copy
+                val = obj[key] = val.copy()
             if isinstance(val, (list, dict, Dict, ODict)):
                 replaceNoneObj(val)
-            if val == None:
+            if val is None:
                 obj[key] = []
-            elif val == {}:
+            elif isinstance(val, dict) and val == {}:
                 obj[key] = [] # also replace empty dicts with empty list
     return obj
 
@@ -741,12 +1057,25 @@ def _dict2utf8 (obj):
                 obj[str(key).decode('utf8')] = obj[key]
                 obj.pop(key)
         return dict(map(_dict2utf8, obj.iteritems()))
+    elif isinstance(obj, np.ndarray):
+        return obj
     elif isinstance(obj, collections.Iterable):
         return type(obj)(map(_dict2utf8, obj))
     else:
         return obj
 
 
+###############################################################################
+### Convert numpy arrays and scalars to lists and numbers (used to save json)
+###############################################################################
+def _numpyToList (obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(repr(obj) + ' is not JSON serializable')
+
+
 ###############################################################################
 ### Convert dict strings to utf8 so can be saved in HDF5 format
 ###############################################################################
@@ -810,20 +1139,44 @@ def readCmdLineArgs (simConfigDefault='cfg.py', netParamsDefault='netParams.py')
 def calculateLFP():
     import sim    
 
-    # Set pointers to i_membrane in each cell (required form LFP calc )        
-    for cell in sim.net.cells:
-        cell.setImembPtr()
+    if len(sim.net.lfpImembVec) == 0:  # no segments in this node
+        return
 
-    # compute 
+    # set pointers to i_membrane_ of all segments (first step; then only if NEURON updates pointers)
+    if not sim.net.lfpImembPtrSet:
+        _setLFPImembPtr()
+
+    # compute all electrodes from all segments of node (single gather and matrix-vector product)
     saveStep = int(np.floor(h.t / sim.cfg.recordStep))
-    for cell in sim.net.cells: # compute ecp only from the biophysical cells
-        gid = cell.gid
-        im = cell.getImemb() # in nA
-        tr = sim.net.recXElectrode.getTransferResistance(gid)  # in MOhm
-        ecp = np.dot(tr,im) # in mV (= R * I = MOhm * nA)
-        if sim.cfg.saveLFPCells: 
-            sim.simData['LFPCells'][gid][saveStep-1, :] = ecp  # contribution of individual cells (stored optionally)
-        sim.simData['LFP'][saveStep-1, :] += ecp  # sum of all cells
+    sim.net.lfpImembPtr.gather(sim.net.lfpImembVec)
+    im = sim.net.lfpImembVec.as_numpy()  # in nA
+    tr = sim.net.lfpTransferResistance  # in MOhm
+    sim.simData['LFP'][saveStep-1, :] += np.dot(tr, im)  # sum of all cells; in mV (= R * I = MOhm * nA)
+    if sim.cfg.saveLFPCells or sim.cfg.saveLFPPops:
+        ecpSegs = tr * im  # contribution of each segment
+    if sim.cfg.saveLFPCells:  # contribution of individual cells (stored optionally)
+        ecpCells = np.add.reduceat(ecpSegs, sim.net.lfpSegOffsets[:-1], axis=1)
+        for i,cell in enumerate(sim.net.lfpCells):
+            sim.simData['LFPCells'][cell.gid][saveStep-1, :] = ecpCells[:, i]
+    if sim.cfg.saveLFPPops:  # contribution of each pop (or group of cells with same tag value); cells of each group are contiguous
+        ecpGroups = np.add.reduceat(ecpSegs, sim.net.lfpGroupSegOffsets, axis=1)
+        for i,group in enumerate(sim.net.lfpGroups):
+            sim.simData['LFPPops'][group][saveStep-1, :] += ecpGroups[:, i]
+
+
+###############################################################################
+### Set pointers to i_membrane_ of all segments of node (used to calculate LFP)
+###############################################################################
+def _setLFPImembPtr():
+    import sim
+
+    jseg = 0
+    for cell in sim.net.lfpCells:
+        for sec in cell.secs.values():
+            for seg in sec['hSec']:
+                sim.net.lfpImembPtr.pset(jseg, seg._ref_i_membrane_)  # notice the underscore at the end (in nA)
+                jseg += 1
+    sim.net.lfpImembPtrSet = True
 
 
 ###############################################################################
@@ -840,17 +1193,47 @@ def setupRecordLFP():
         for c in sim.net.cells:
             sim.simData['LFPCells'][c.gid] = np.zeros((saveSteps, nsites))
 
+    # order of cells (and segments) in LFP calculation; if saveLFPPops, cells of each group are contiguous
+    sim.net.lfpCells = list(sim.net.cells)
+    sim.net.lfpGroups = []
+    if sim.cfg.saveLFPPops:
+        sim.simData['LFPPops'] = Dict()  # key = group (also in nodes without cells, so can be gathered)
+        groupTag = sim.cfg.saveLFPPops if isinstance(sim.cfg.saveLFPPops, basestring) else 'pop'  # True = group by pop
+        cellGroups = [cell.tags.get(groupTag, None) for cell in sim.net.cells]
+        for group in cellGroups:
+            if group not in sim.net.lfpGroups:
+                sim.net.lfpGroups.append(group)
+        groupIndex = {group: i for i,group in enumerate(sim.net.lfpGroups)}
+        order = sorted(range(len(sim.net.cells)), key=lambda i: groupIndex[cellGroups[i]])
+        sim.net.lfpCells = [sim.net.cells[i] for i in order]
+        for group in sim.net.lfpGroups:
+            sim.simData['LFPPops'][group] = np.zeros((saveSteps, nsites))
+
     sim.net.defineCellShapes()
 
     sim.net.calcSegCoords()  # calculate segment coords for each cell
     sim.net.recXElectrode = RecXElectrode(sim)  # create exctracellular recording electrode
     
-    for cell in sim.net.cells:
-        nseg = cell._segCoords['p0'].shape[1]
-        sim.net.recXElectrode.calcTransferResistance(cell.gid, cell._segCoords)  # transfer resistance for each cell
-        cell.imembPtr = h.PtrVector(nseg)  # pointer vector
-        cell.imembPtr.ptr_update_callback(cell.setImembPtr)   # used for gathering an array of  i_membrane values from the pointer vector
-        cell.imembVec = h.Vector(nseg)
+    segOffsets = [0]  # index of first segment of each cell
+    groupSegOffsets = []  # index of first segment of each group
+    for cell in sim.net.lfpCells:
+        if sim.cfg.saveLFPPops and len(groupSegOffsets) < len(sim.net.lfpGroups) and \
+                cell.tags.get(groupTag, None) == sim.net.lfpGroups[len(groupSegOffsets)]:
+            groupSegOffsets.append(segOffsets[-1])
+        cacheKey = (cell.tags['pop'], tuple(cell._segCoords['p0'][:, 0]))  # same morphology (pop) and position
+        sim.net.recXElectrode.calcTransferResistance(cell.gid, cell._segCoords, cacheKey=cacheKey)  # transfer resistance for each cell
+        segOffsets.append(segOffsets[-1] + cell._segCoords['p0'].shape[1])
+
+    # stacked transfer resistance (sites x segments of all cells) and single pointer vector to i_membrane_ of all segments
+    sim.net.lfpSegOffsets = np.array(segOffsets)
+    sim.net.lfpCellInds = {cell.gid: i for i,cell in enumerate(sim.net.lfpCells)}  # index of each cell in lfpCells
+    sim.net.lfpGroupSegOffsets = np.array(groupSegOffsets, dtype=int)
+    sim.net.lfpTransferResistance = np.hstack([sim.net.recXElectrode.getTransferResistance(cell.gid) for cell in sim.net.lfpCells]) \
+        if sim.net.cells else np.zeros((nsites, 0))
+    sim.net.lfpImembPtr = h.PtrVector(segOffsets[-1])  # pointer vector
+    sim.net.lfpImembPtr.ptr_update_callback(_setLFPImembPtr)  # reset pointers when NEURON reallocates memory
+    sim.net.lfpImembVec = h.Vector(segOffsets[-1])
+    sim.net.lfpImembPtrSet = False
 
     sim.cvode.use_fast_imem(1)   # make i_membrane_ a range variable
         
@@ -942,7 +1325,7 @@ def getCellsList (include):
     import sim
 
     if sim.nhosts > 1 and any(isinstance(cond, tuple) or isinstance(cond,list) for cond in include): # Gather tags from all cells
-        allCellTags = sim._gatherAllCellTags()
+        allCellTags = sim._gatherAllCellTagsCompact() if sim.cfg.compactCellTags else sim._gatherAllCellTags()
     else:
         allCellTags = {cell.gid: cell.tags for cell in sim.net.cells}
 
@@ -960,14 +1343,14 @@ def getCellsList (include):
             cellGids.extend(list(sim.net.pops[condition].cellGids))
 
         elif isinstance(condition, tuple) or isinstance(condition, list):  # subset of a pop with relative indices
-            cellsPop = [gid for gid,tags in allCellTags.iteritems() if tags['pop']==condition[0]]
+            cellsPop = sim.net._getCellTable(allCellTags).query({'pop': condition[0]}).tolist()
 
             if isinstance(condition[1], list):
                 cellGids.extend([gid for i,gid in enumerate(cellsPop) if i in condition[1]])
             elif isinstance(condition[1], int):
                 cellGids.extend([gid for i,gid in enumerate(cellsPop) if i==condition[1]])
 
-    cellGids = list(set(cellGids))  # unique values
+    cellGids = set(cellGids)  # unique values
     cells = [cell for cell in sim.net.cells if cell.gid in cellGids]
     return cells
 
@@ -1077,13 +1460,27 @@ def preRun ():
     # handler for recording LFP
     if sim.cfg.recordLFP:
         def recordLFPHandler():
-            for i in np.arange(sim.cfg.recordStep, sim.cfg.duration+sim.cfg.recordStep, sim.cfg.recordStep):
-                sim.cvode.event(i, sim.calculateLFP)
+            sim.net.lfpImembPtrSet = False  # set pointers to i_membrane_ in first step
+            if getattr(sim, 'checkpointRun', False):  # only events of first interval, so no python events in queue when saving checkpoint
+                _scheduleLFPEvents(0, sim.cfg.checkpointInterval)
+            else:
+                _scheduleLFPEvents(0, sim.cfg.duration+sim.cfg.recordStep)
 
         sim.recordLFPHandler = recordLFPHandler
         sim.fih.append(h.FInitializeHandler(0, sim.recordLFPHandler))  # initialize imemb
 
 
+###############################################################################
+### Schedule LFP calculation events in time interval [tStart, tEnd)
+###############################################################################
+def _scheduleLFPEvents (tStart, tEnd):
+    import sim
+
+    for i in np.arange(sim.cfg.recordStep, sim.cfg.duration+sim.cfg.recordStep, sim.cfg.recordStep):
+        if tStart <= i < tEnd:
+            sim.cvode.event(i, sim.calculateLFP)
+
+
 ###############################################################################
 ### Run Simulation
 ###############################################################################
@@ -1129,6 +1526,288 @@ def runSimWithIntervalFunc (interval, func):
             (sim.timingData['runTime'], sim.cfg.duration/1000/sim.timingData['runTime']))
 
 
+###############################################################################
+### Run Simulation streaming spikes and traces to files (bounded memory)
+###############################################################################
+def runSimWithStreaming (interval = None):
+    import sim
+
+    interval = interval or sim.cfg.streamInterval
+    if not interval:
+        print 'Error: streaming requires an interval (argument or cfg.streamInterval)'
+        return
+    _setupStreaming()
+    runSimWithIntervalFunc(interval, streamData)  # last call at end of simulation writes remaining data
+
+
+###############################################################################
+### Setup files to stream spikes and traces of this node (and manifest in node 0)
+###############################################################################
+def _setupStreaming ():
+    import sim
+    import json
+
+    # create folder if missing
+    targetFolder = os.path.dirname(sim.cfg.filename)
+    if sim.rank == 0 and targetFolder and not os.path.exists(targetFolder):
+        try:
+            os.mkdir(targetFolder)
+        except OSError:
+            print ' Could not create target folder: %s' % (targetFolder)
+    sim.pc.barrier()
+
+    # index of node files: spikes as (spkt, spkid) records; each trace as rows of samples (time) x columns (labels)
+    nodeFilename = '%s_stream_node%d' % (sim.cfg.filename, sim.rank)
+    index = {'rank': sim.rank, 'spikes': {'file': os.path.basename(nodeFilename)+'_spikes.dat', 'chunks': []}, 'traces': ODict()}
+    for key in sim.cfg.recordTraces.keys()+['t']:
+        if key not in sim.simData:
+            continue
+        val = sim.simData[key]
+        if isinstance(val, dict):
+            labels = []
+            for cell,val2 in val.iteritems():
+                if isinstance(val2, dict):
+                    labels.extend([[cell, secLoc] for secLoc in val2])  # eg. ['g_AMPA']['cell_1']['soma_0.5']
+                else:
+                    labels.append(cell)  # eg. ['V_soma']['cell_1']
+        else:
+            labels = [key]  # Vectors (eg. 't')
+        index['traces'][key] = {'file': os.path.basename(nodeFilename)+'_%s.dat' % (key), 'labels': labels, 'chunks': []}
+
+    for fileInfo in [index['spikes']]+index['traces'].values():  # remove data of previous runs
+        open(os.path.join(targetFolder, fileInfo['file']), 'wb').close()
+
+    sim.streamIndex = index
+    sim.streamIndexFilename = nodeFilename+'.json'
+    sim.streamTime = 0.0  # time of last data written
+    _saveStreamIndex()
+
+    if sim.rank == 0:
+        manifest = {'netpyne_version': sim.version(show=False), 'nhosts': sim.nhosts, 'recordStep': sim.cfg.recordStep,
+            'streamNodeFiles': ['%s_stream_node%d.json' % (os.path.basename(sim.cfg.filename), rank) for rank in range(sim.nhosts)],
+            'simConfig': sim.cfg.__dict__}
+        manifestFilename = sim.cfg.filename+'_stream.json'
+        print('Streaming spikes and traces to %s (and %d node files) ... ' % (manifestFilename, sim.nhosts))
+        with open(manifestFilename, 'w') as fileObj:
+            json.dump(manifest, fileObj, default=_numpyToList)
+
+
+###############################################################################
+### Append spikes and traces recorded since last call to files of node and clear them from memory
+###############################################################################
+def streamData (t = None):
+    import sim
+
+    if getattr(sim, 'streamIndex', None) is None:
+        _setupStreaming()
+    folder = os.path.dirname(sim.cfg.filename)
+    tStart, tEnd = sim.streamTime, h.t if t is None else t
+
+    # spikes (sorted by time within chunk)
+    spikes = sim.streamIndex['spikes']
+    spkt, spkid = np.array(sim.simData['spkt'], dtype=np.float64), np.array(sim.simData['spkid'], dtype=np.float64)
+    order = np.argsort(spkt, kind='mergesort')
+    records = np.empty(len(spkt), dtype=[('spkt', np.float64), ('spkid', np.float64)])
+    records['spkt'], records['spkid'] = spkt[order], spkid[order]
+    with open(os.path.join(folder, spikes['file']), 'ab') as fileObj:
+        records.tofile(fileObj)
+    start = spikes['chunks'][-1][2]+spikes['chunks'][-1][3] if spikes['chunks'] else 0
+    spikes['chunks'].append([tStart, tEnd, start, len(records)])  # [tStart, tEnd, first record, number of records]
+    sim.simData['spkt'].resize(0)
+    sim.simData['spkid'].resize(0)
+
+    # traces (time x labels; columns padded with nan if vectors have different lengths)
+    for key,trace in sim.streamIndex['traces'].iteritems():
+        if isinstance(sim.simData[key], dict):
+            vecs = [sim.simData[key][label[0]][label[1]] if isinstance(label, list) else sim.simData[key][label] for label in trace['labels']]
+        else:
+            vecs = [sim.simData[key]]
+        numRows = max([len(vec) for vec in vecs]) if vecs else 0
+        data = np.full((numRows, len(vecs)), np.nan)
+        for i,vec in enumerate(vecs):
+            data[:len(vec), i] = vec
+            vec.resize(0)
+        with open(os.path.join(folder, trace['file']), 'ab') as fileObj:
+            data.tofile(fileObj)
+        start = trace['chunks'][-1][2]+trace['chunks'][-1][3] if trace['chunks'] else 0
+        trace['chunks'].append([tStart, tEnd, start, numRows])  # [tStart, tEnd, first row, number of rows]
+
+    sim.streamTime = tEnd
+    _saveStreamIndex()
+
+
+###############################################################################
+### Save index of streamed data of node (replaced atomically, so files can be read during the run)
+###############################################################################
+def _saveStreamIndex ():
+    import sim
+    import json
+
+    tmpFilename = sim.streamIndexFilename+'.tmp'
+    with open(tmpFilename, 'w') as fileObj:
+        json.dump(sim.streamIndex, fileObj)
+    os.rename(tmpFilename, sim.streamIndexFilename)
+
+
+###############################################################################
+### Run Simulation saving checkpoints at intervals (cfg.checkpointInterval)
+###############################################################################
+def runSimWithCheckpoints ():
+    import sim
+
+    if not sim.cfg.checkpointInterval:
+        print 'Error: checkpoints require cfg.checkpointInterval'
+        return
+    sim.checkpointRun = True
+    sim.checkpointIndex = 0
+    runSimWithIntervalFunc(sim.cfg.checkpointInterval, _checkpointIntervalFunc)
+    sim.checkpointRun = False
+
+
+###############################################################################
+### Save checkpoint and schedule events of next interval (function called at intervals)
+###############################################################################
+def _checkpointIntervalFunc (t):
+    import sim
+
+    if t < sim.cfg.duration:
+        saveCheckpoint()
+        if sim.cfg.recordLFP:
+            _scheduleLFPEvents(t, t+sim.cfg.checkpointInterval)
+
+
+###############################################################################
+### Save checkpoint: NEURON state (SaveState, incl. event queue), random streams and data recorded by each node
+###############################################################################
+def saveCheckpoint ():
+    import sim
+    import json
+
+    # 2 alternating sets of node files, so the last complete checkpoint is kept while saving the next one
+    index = getattr(sim, 'checkpointIndex', 0) + 1
+    nodeFilename = '%s_checkpoint%d_node%d' % (sim.cfg.filename, index % 2, sim.rank)
+
+    # NEURON state (voltages, states of mechanisms, event queue, play/record vectors)
+    ss = h.SaveState()
+    ss.save()
+    fileObj = h.File()
+    fileObj.wopen(nodeFilename+'.dat')
+    ss.fwrite(fileObj)
+    fileObj.close()
+
+    # position of random streams (NetStims) and recorded data
+    state = {'t': h.t, 'rand': {}, 'simData': _simDataArrays(sim.simData)}
+    for cell in sim.net.cells:
+        if getattr(cell, 'hRandom', None) is not None:
+            state['rand'][(cell.gid, None)] = cell.hRandom.seq()
+        for i,stim in enumerate(cell.stims):
+            if 'hRandom' in stim:
+                state['rand'][(cell.gid, i)] = stim['hRandom'].seq()
+    with open(nodeFilename+'.pkl', 'wb') as fileObj:
+        pk.dump(state, fileObj, protocol=pk.HIGHEST_PROTOCOL)
+
+    # manifest pointing to checkpoint saved after all nodes finished saving
+    sim.pc.barrier()
+    if sim.rank == 0:
+        manifest = {'t': h.t, 'index': index, 'nhosts': sim.nhosts, 'nodeFiles': '%s_checkpoint%d_node' % (os.path.basename(sim.cfg.filename), index % 2)}
+        manifestFilename = sim.cfg.filename+'_checkpoint.json'
+        with open(manifestFilename+'.tmp', 'w') as fileObj:
+            json.dump(manifest, fileObj)
+        os.rename(manifestFilename+'.tmp', manifestFilename)
+        if sim.cfg.verbose: print('  Saved checkpoint at t = %0.1f ms' % (h.t))
+    sim.checkpointIndex = index
+
+
+###############################################################################
+### Restore last complete checkpoint and run simulation until cfg.duration (network and recording need to be setup before)
+###############################################################################
+def restoreCheckpoint (filename = None):
+    import sim
+    import json
+
+    if not filename: filename = sim.cfg.filename+'_checkpoint.json'
+    if not os.path.exists(filename):
+        print 'Error: checkpoint file %s not found' % (filename)
+        return
+    with open(filename, 'r') as fileObj:
+        manifest = json.load(fileObj)
+    if manifest['nhosts'] != sim.nhosts:
+        print 'Error: checkpoint saved with %d nodes, but running with %d nodes' % (manifest['nhosts'], sim.nhosts)
+        return
+    nodeFilename = os.path.join(os.path.dirname(filename), '%s%d' % (manifest['nodeFiles'], sim.rank))
+
+    sim.pc.barrier()
+    timing('start', 'runTime')
+    sim.checkpointRun = True
+    preRun()
+    h.finitialize(float(sim.cfg.hParams['v_init']))
+
+    # NEURON state (replaces event queue and sets h.t)
+    ss = h.SaveState()
+    fileObj = h.File()
+    fileObj.ropen(nodeFilename+'.dat')
+    ss.fread(fileObj)
+    fileObj.close()
+    ss.restore()
+
+    # position of random streams and recorded data
+    with open(nodeFilename+'.pkl', 'rb') as fileObj:
+        state = pk.load(fileObj)
+    for cell in sim.net.cells:
+        if (cell.gid, None) in state['rand']:
+            cell.hRandom.seq(state['rand'][(cell.gid, None)])
+        for i,stim in enumerate(cell.stims):
+            if (cell.gid, i) in state['rand']:
+                stim['hRandom'].seq(state['rand'][(cell.gid, i)])
+    _restoreSimDataArrays(sim.simData, state['simData'])
+    if sim.cfg.cvode_active:
+        sim.cvode.re_init()
+    if sim.cfg.recordLFP:
+        _scheduleLFPEvents(h.t, h.t+sim.cfg.checkpointInterval if sim.cfg.checkpointInterval else sim.cfg.duration+sim.cfg.recordStep)
+
+    if sim.rank == 0: print('\nRunning from checkpoint at t = %0.1f ms...' % (h.t))
+    sim.checkpointIndex = manifest['index']
+    while round(h.t) < sim.cfg.duration:
+        sim.pc.psolve(min(sim.cfg.duration, h.t+sim.cfg.checkpointInterval) if sim.cfg.checkpointInterval else sim.cfg.duration)
+        if sim.cfg.checkpointInterval: _checkpointIntervalFunc(h.t)
+    sim.checkpointRun = False
+
+    sim.pc.barrier() # Wait for all hosts to get to this point
+    timing('stop', 'runTime')
+    if sim.rank==0:
+        print('  Done; run time = %0.2f s; real-time ratio: %0.2f.' %
+            (sim.timingData['runTime'], (sim.cfg.duration-manifest['t'])/1000/sim.timingData['runTime']))
+
+
+###############################################################################
+### Copy of sim data with Vectors converted to numpy arrays
+###############################################################################
+def _simDataArrays (obj):
+    if hasattr(obj, 'hname'):  # Vector
+        return np.array(obj)
+    elif isinstance(obj, dict):
+        return {key: _simDataArrays(val) for key,val in obj.iteritems()}
+    elif isinstance(obj, np.ndarray):
+        return obj.copy()
+    return obj
+
+
+###############################################################################
+### Restore sim data from arrays (copied into the recording Vectors, so recording continues)
+###############################################################################
+def _restoreSimDataArrays (simData, arrays):
+    for key,val in arrays.iteritems():
+        current = simData.get(key)
+        if hasattr(current, 'hname'):  # Vector
+            current.from_python(val)
+        elif isinstance(current, dict) and isinstance(val, dict):
+            _restoreSimDataArrays(current, val)
+        elif isinstance(current, np.ndarray) and current.shape == val.shape:  # eg. LFP
+            current[:] = val
+        else:
+            simData[key] = val
+
+
 ###############################################################################
 ### Gather tags from cells
 ###############################################################################
@@ -1155,6 +1834,41 @@ def _gatherAllCellTags ():
     return allCellTags
 
 
+###############################################################################
+### Gather gid, pop and coordinates of cells as packed numpy arrays
+###############################################################################
+def _gatherAllCellTagsCompact ():
+    import sim
+    from celltable import CellTable, CellTagsView
+
+    # tags copied from each pop to its cells (same in all nodes, so not exchanged)
+    popLabels = sim.net.pops.keys()
+    popCodes = {popLabel: i for i,popLabel in enumerate(popLabels)}
+    popTags = []
+    for popLabel in popLabels:
+        tags = {k: v for k,v in sim.net.pops[popLabel].tags.iteritems() if k in sim.net.params.popTagsCopiedToCells}
+        tags['pop'] = popLabel
+        popTags.append(tags)
+
+    # pack local cells into arrays: (gid, pop code) and coordinates
+    ids = np.array([[cell.gid, popCodes[cell.tags['pop']]] for cell in sim.net.cells], dtype=np.int64).reshape(-1, 2)
+    coords = np.array([[cell.tags.get(coord, np.nan) for coord in CellTable.coordTags] for cell in sim.net.cells], 
+                        dtype=np.float64).reshape(-1, len(CellTable.coordTags))
+
+    data = [(ids, coords)]*sim.nhosts  # send packed arrays to other nodes
+    gather = sim.pc.py_alltoall(data)  # collect packed arrays from other nodes
+    sim.pc.barrier()
+    ids = np.concatenate([node[0] for node in gather])
+    coords = np.concatenate([node[1] for node in gather])
+    order = np.argsort(ids[:,0], kind='mergesort')  # sort by gid
+
+    columns = {'gid': ids[order,0], 'pop': ids[order,1]}
+    for icoord, coord in enumerate(CellTable.coordTags):
+        columns[coord] = coords[order,icoord]
+
+    return CellTagsView(columns, popTags)
+
+
 ###############################################################################
 ### Gather tags from cells
 ###############################################################################
@@ -1181,6 +1895,120 @@ def _gatherAllCellConnPreGids ():
     return allCellConnPreGids
 
 
+###############################################################################
+### Pack sim data of node into contiguous arrays (to gather faster than lists)
+###############################################################################
+def _packSimData (simData, simDataVecs):
+    import sim
+
+    packedData = {}
+    dtype = np.float32 if sim.cfg.gatherPacked == 'float32' else np.float64  # precision of traces
+
+    # spikes as time-sorted arrays
+    spkt = np.array(simData['spkt'], dtype=np.float64)
+    spkid = np.array(simData['spkid'], dtype=np.float64)
+    if len(spkt) > 1 and np.any(np.diff(spkt) < 0):
+        order = np.argsort(spkt, kind='mergesort')
+        spkt, spkid = spkt[order], spkid[order]
+    packedData['spkt'], packedData['spkid'] = spkt, spkid
+
+    for key,val in simData.iteritems():
+        if key in ['spkt', 'spkid']:
+            continue
+        elif key in simDataVecs and isinstance(val, dict):  # dicts of Vectors packed as single buffer + offset table
+            labels, vecs = [], []
+            for cell,val2 in val.iteritems():
+                if isinstance(val2, dict):
+                    for stim,val3 in val2.iteritems():
+                        labels.append((cell, stim))  # eg. ['stims']['cell_1']['background']
+                        vecs.append(val3)
+                else:
+                    labels.append(cell)  # eg. ['V_soma']['cell_1']
+                    vecs.append(val2)
+            lengths = [len(vec) for vec in vecs]
+            offsets = np.zeros(len(vecs)+1, dtype=np.int64)
+            offsets[1:] = np.cumsum(lengths)
+            data = np.empty(offsets[-1], dtype=dtype)
+            for i,vec in enumerate(vecs):
+                data[offsets[i]:offsets[i+1]] = vec
+            packedData[key] = {'labels': labels, 'offsets': offsets, 'data': data}
+        elif hasattr(val, 'hname'):  # Vectors (eg. 't')
+            packedData[key] = np.array(val, dtype=np.float64)
+        else:
+            packedData[key] = val
+
+    return packedData
+
+
+###############################################################################
+### Unpack sim data gathered from nodes into dicts of numpy arrays
+###############################################################################
+def _unpackSimData (nodesData, simDataVecs, singleNodeVecs):
+    allSimData = Dict()
+
+    # spikes merged from time-sorted arrays of each node
+    allSimData['spkt'], allSimData['spkid'] = _mergeSpikes([node['spkt'] for node in nodesData], [node['spkid'] for node in nodesData])
+
+    for key,val in nodesData[0].iteritems():
+        if key in ['spkt', 'spkid']:
+            continue
+        elif key in singleNodeVecs:  # single node vectors (eg. 't')
+            allSimData[key] = val
+        elif key in simDataVecs and isinstance(val, dict):  # views of buffer of each node
+            allSimData[key] = Dict()
+            for node in nodesData:
+                packed = node[key]
+                for label,values in zip(packed['labels'], np.split(packed['data'], packed['offsets'][1:-1])):
+                    if isinstance(label, tuple):
+                        allSimData[key].setdefault(label[0], Dict())[label[1]] = values
+                    else:
+                        allSimData[key][label] = values
+        elif key == 'LFP':
+            allSimData[key] = np.sum([np.array(node[key]) for node in nodesData], axis=0)
+        elif key == 'LFPPops':  # sum contribution of each group from all nodes
+            allSimData[key] = Dict()
+            for node in nodesData:
+                for group,lfp in node[key].iteritems():
+                    allSimData[key][group] = allSimData[key].get(group, 0) + np.array(lfp)
+        elif isinstance(val, dict):
+            allSimData[key] = Dict()
+            for node in nodesData:
+                allSimData[key].update(node[key])
+        else:
+            allSimData[key] = val
+
+    return allSimData
+
+
+###############################################################################
+### Merge time-sorted spike arrays (k-way merge by pairs, O(N log k))
+###############################################################################
+def _mergeSpikes (spkts, spkids):
+    spkts, spkids = list(spkts), list(spkids)
+    if not spkts:
+        return np.array([]), np.array([])
+
+    while len(spkts) > 1:
+        mergedSpkts, mergedSpkids = [], []
+        for i in range(0, len(spkts)-1, 2):
+            spkt1, spkid1, spkt2, spkid2 = spkts[i], spkids[i], spkts[i+1], spkids[i+1]
+            pos2 = np.searchsorted(spkt1, spkt2, side='right') + np.arange(len(spkt2))  # position of 2nd array spikes in merged array
+            mask1 = np.ones(len(spkt1)+len(spkt2), dtype=bool)
+            mask1[pos2] = False
+            spkt = np.empty(len(mask1))
+            spkid = np.empty(len(mask1))
+            spkt[mask1], spkid[mask1] = spkt1, spkid1
+            spkt[pos2], spkid[pos2] = spkt2, spkid2
+            mergedSpkts.append(spkt)
+            mergedSpkids.append(spkid)
+        if len(spkts) % 2:
+            mergedSpkts.append(spkts[-1])
+            mergedSpkids.append(spkids[-1])
+        spkts, spkids = mergedSpkts, mergedSpkids
+
+    return np.asarray(spkts[0], dtype=np.float64), np.asarray(spkids[0], dtype=np.float64)
+
+
 ###############################################################################
 ### Gather data from nodes
 ###############################################################################
@@ -1207,12 +2035,6 @@ def gatherData ():
     elif sim.cfg.compactConnFormat:
         sim.compactConnFormat()
             
-    # convert LFP to list
-    if sim.cfg.recordLFP:
-        for cell in sim.net.cells:
-            del cell.imembVec
-            del cell.imembPtr
-
     simDataVecs = ['spkt','spkid','stims']+sim.cfg.recordTraces.keys()
     singleNodeVecs = ['t']
     if sim.nhosts > 1:  # only gather if >1 nodes
@@ -1220,7 +2042,7 @@ def gatherData ():
 
         # gather only sim data
         if getattr(sim.cfg, 'gatherOnlySimData', False):
-            nodeData = {'simData': sim.simData}
+            nodeData = {'simData': _packSimData(sim.simData, simDataVecs) if sim.cfg.gatherPacked else sim.simData}
             data = [None]*sim.nhosts
             data[0] = {}
             for k,v in nodeData.iteritems():
@@ -1230,37 +2052,43 @@ def gatherData ():
 
             if sim.rank == 0: # simData
                 print '  Gathering only sim data...'
-                sim.allSimData = Dict()
-                for k in gather[0]['simData'].keys():  # initialize all keys of allSimData dict
-                    if k == 'LFP':
-                        sim.allSimData[k] = np.zeros((gather[0]['simData']['LFP'].shape))
-                    else:
-                        sim.allSimData[k] = {}
-
-                for key in singleNodeVecs: # store single node vectors (eg. 't')
-                    sim.allSimData[key] = list(nodeData['simData'][key])
-
-                # fill in allSimData taking into account if data is dict of h.Vector (code needs improvement to be more generic)
-                for node in gather:  # concatenate data from each node
-                    for key,val in node['simData'].iteritems():  # update simData dics of dics of h.Vector
-                        if key in simDataVecs:          # simData dicts that contain Vectors
-                            if isinstance(val, dict):
-                                for cell,val2 in val.iteritems():
-                                    if isinstance(val2,dict):
-                                        sim.allSimData[key].update(Dict({cell:Dict()}))
-                                        for stim,val3 in val2.iteritems():
-                                            sim.allSimData[key][cell].update({stim:list(val3)}) # udpate simData dicts which are dicts of dicts of Vectors (eg. ['stim']['cell_1']['backgrounsd']=h.Vector)
-                                    else:
-                                        sim.allSimData[key].update({cell:list(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
-                            else:
-                                sim.allSimData[key] = list(sim.allSimData[key])+list(val) # udpate simData dicts which are Vectors
-                        elif key == 'LFP':
-                            sim.allSimData[k] += np.array(nodeData['simData'][key])
-                        elif key not in singleNodeVecs:
-                            sim.allSimData[key].update(val)           # update simData dicts which are not Vectors
-
-                if len(sim.allSimData['spkt']) > 0:
-                    sim.allSimData['spkt'], sim.allSimData['spkid'] = zip(*sorted(zip(sim.allSimData['spkt'], sim.allSimData['spkid']))) # sort spks
+                if sim.cfg.gatherPacked:
+                    sim.allSimData = _unpackSimData([node['simData'] for node in gather], simDataVecs, singleNodeVecs)
+                else:
+                    sim.allSimData = Dict()
+                    for k in gather[0]['simData'].keys():  # initialize all keys of allSimData dict
+                        if k == 'LFP':
+                            sim.allSimData[k] = np.zeros((gather[0]['simData']['LFP'].shape))
+                        else:
+                            sim.allSimData[k] = {}
+
+                    for key in singleNodeVecs: # store single node vectors (eg. 't')
+                        sim.allSimData[key] = list(nodeData['simData'][key])
+
+                    # fill in allSimData taking into account if data is dict of h.Vector (code needs improvement to be more generic)
+                    for node in gather:  # concatenate data from each node
+                        for key,val in node['simData'].iteritems():  # update simData dics of dics of h.Vector
+                            if key in simDataVecs:          # simData dicts that contain Vectors
+                                if isinstance(val, dict):
+                                    for cell,val2 in val.iteritems():
+                                        if isinstance(val2,dict):
+                                            sim.allSimData[key].update(Dict({cell:Dict()}))
+                                            for stim,val3 in val2.iteritems():
+                                                sim.allSimData[key][cell].update({stim:list(val3)}) # udpate simData dicts which are dicts of dicts of Vectors (eg. ['stim']['cell_1']['backgrounsd']=h.Vector)
+                                        else:
+                                            sim.allSimData[key].update({cell:list(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
+                                else:
+                                    sim.allSimData[key] = list(sim.allSimData[key])+list(val) # udpate simData dicts which are Vectors
+                            elif key == 'LFP':
+                                sim.allSimData[k] += np.array(nodeData['simData'][key])
+                            elif key == 'LFPPops':  # sum contribution of each group from all nodes
+                                for group,lfp in val.iteritems():
+                                    sim.allSimData[key][group] = sim.allSimData[key].get(group, 0) + np.array(lfp)
+                            elif key not in singleNodeVecs:
+                                sim.allSimData[key].update(val)           # update simData dicts which are not Vectors
+
+                    if len(sim.allSimData['spkt']) > 0:
+                        sim.allSimData['spkt'], sim.allSimData['spkid'] = zip(*sorted(zip(sim.allSimData['spkt'], sim.allSimData['spkid']))) # sort spks
 
                 sim.net.allPops = ODict() # pops
                 for popLabel,pop in sim.net.pops.iteritems(): sim.net.allPops[popLabel] = pop.__getstate__() # can't use dict comprehension for OrderedDict
@@ -1269,7 +2097,8 @@ def gatherData ():
 
         # gather cells, pops and sim data
         else:
-            nodeData = {'netCells': [c.__getstate__() for c in sim.net.cells], 'netPopsCellGids': netPopsCellGids, 'simData': sim.simData}
+            nodeData = {'netCells': [c.__getstate__() for c in sim.net.cells], 'netPopsCellGids': netPopsCellGids,
+                'simData': _packSimData(sim.simData, simDataVecs) if sim.cfg.gatherPacked else sim.simData}
             data = [None]*sim.nhosts
             data[0] = {}
             for k,v in nodeData.iteritems():
@@ -1300,24 +2129,30 @@ def gatherData ():
                     for popLabel,popCellGids in node['netPopsCellGids'].iteritems():
                         allPopsCellGids[popLabel].extend(popCellGids)
 
-                    for key,val in node['simData'].iteritems():  # update simData dics of dics of h.Vector
-                        if key in simDataVecs:          # simData dicts that contain Vectors
-                            if isinstance(val,dict):
-                                for cell,val2 in val.iteritems():
-                                    if isinstance(val2,dict):
-                                        sim.allSimData[key].update(Dict({cell:Dict()}))
-                                        for stim,val3 in val2.iteritems():
-                                            sim.allSimData[key][cell].update({stim:list(val3)}) # udpate simData dicts which are dicts of dicts of Vectors (eg. ['stim']['cell_1']['backgrounsd']=h.Vector)
-                                    else:
-                                        sim.allSimData[key].update({cell:list(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
-                            else:
-                                sim.allSimData[key] = list(sim.allSimData[key])+list(val) # udpate simData dicts which are Vectors
-                        elif key == 'LFP':
-                            sim.allSimData[k] += np.array(val)
-                        elif key not in singleNodeVecs:
-                            sim.allSimData[key].update(val)           # update simData dicts which are not Vectors
-
-                if len(sim.allSimData['spkt']) > 0:
+                    if not sim.cfg.gatherPacked:  # packed simData is unpacked after gathering cells
+                        for key,val in node['simData'].iteritems():  # update simData dics of dics of h.Vector
+                            if key in simDataVecs:          # simData dicts that contain Vectors
+                                if isinstance(val,dict):
+                                    for cell,val2 in val.iteritems():
+                                        if isinstance(val2,dict):
+                                            sim.allSimData[key].update(Dict({cell:Dict()}))
+                                            for stim,val3 in val2.iteritems():
+                                                sim.allSimData[key][cell].update({stim:list(val3)}) # udpate simData dicts which are dicts of dicts of Vectors (eg. ['stim']['cell_1']['backgrounsd']=h.Vector)
+                                        else:
+                                            sim.allSimData[key].update({cell:list(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
+                                else:
+                                    sim.allSimData[key] = list(sim.allSimData[key])+list(val) # udpate simData dicts which are Vectors
+                            elif key == 'LFP':
+                                sim.allSimData[k] += np.array(val)
+                            elif key == 'LFPPops':  # sum contribution of each group from all nodes
+                                for group,lfp in val.iteritems():
+                                    sim.allSimData[key][group] = sim.allSimData[key].get(group, 0) + np.array(lfp)
+                            elif key not in singleNodeVecs:
+                                sim.allSimData[key].update(val)           # update simData dicts which are not Vectors
+
+                if sim.cfg.gatherPacked:
+                    sim.allSimData = _unpackSimData([node['simData'] for node in gather], simDataVecs, singleNodeVecs)
+                elif len(sim.allSimData['spkt']) > 0:
                     sim.allSimData['spkt'], sim.allSimData['spkid'] = zip(*sorted(zip(sim.allSimData['spkt'], sim.allSimData['spkid']))) # sort spks
 
                 sim.net.allCells =  sorted(allCells, key=lambda k: k['gid'])
@@ -1338,29 +2173,32 @@ def gatherData ():
                 del item
 
     else:  # if single node, save data in same format as for multiple nodes for consistency
-        if sim.cfg.createNEURONObj:
+        if sim.cfg.createNEURONObj or sim.cfg.connTable:  # conns in table converted to dicts
             sim.net.allCells = [Dict(c.__getstate__()) for c in sim.net.cells]
         else:
             sim.net.allCells = [c.__dict__ for c in sim.net.cells]
         sim.net.allPops = ODict()
         for popLabel,pop in sim.net.pops.iteritems(): sim.net.allPops[popLabel] = pop.__getstate__() # can't use dict comprehension for OrderedDict
-        sim.allSimData = Dict()
-        for k in sim.simData.keys():  # initialize all keys of allSimData dict
-            sim.allSimData[k] = Dict()
-        for key,val in sim.simData.iteritems():  # update simData dics of dics of h.Vector
-                if key in simDataVecs+singleNodeVecs:          # simData dicts that contain Vectors
-                    if isinstance(val,dict):
-                        for cell,val2 in val.iteritems():
-                            if isinstance(val2,dict):
-                                sim.allSimData[key].update(Dict({cell:Dict()}))
-                                for stim,val3 in val2.iteritems():
-                                    sim.allSimData[key][cell].update({stim:list(val3)}) # udpate simData dicts which are dicts of dicts of Vectors (eg. ['stim']['cell_1']['backgrounsd']=h.Vector)
-                            else:
-                                sim.allSimData[key].update({cell:list(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
+        if sim.cfg.gatherPacked:
+            sim.allSimData = _unpackSimData([_packSimData(sim.simData, simDataVecs)], simDataVecs, singleNodeVecs)
+        else:
+            sim.allSimData = Dict()
+            for k in sim.simData.keys():  # initialize all keys of allSimData dict
+                sim.allSimData[k] = Dict()
+            for key,val in sim.simData.iteritems():  # update simData dics of dics of h.Vector
+                    if key in simDataVecs+singleNodeVecs:          # simData dicts that contain Vectors
+                        if isinstance(val,dict):
+                            for cell,val2 in val.iteritems():
+                                if isinstance(val2,dict):
+                                    sim.allSimData[key].update(Dict({cell:Dict()}))
+                                    for stim,val3 in val2.iteritems():
+                                        sim.allSimData[key][cell].update({stim:list(val3)}) # udpate simData dicts which are dicts of dicts of Vectors (eg. ['stim']['cell_1']['backgrounsd']=h.Vector)
+                                else:
+                                    sim.allSimData[key].update({cell:list(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
+                        else:
+                            sim.allSimData[key] = list(sim.allSimData[key])+list(val) # udpate simData dicts which are Vectors
                     else:
-                        sim.allSimData[key] = list(sim.allSimData[key])+list(val) # udpate simData dicts which are Vectors
-                else:
-                    sim.allSimData[key] = val           # update simData dicts which are not Vectors
+                        sim.allSimData[key] = val           # update simData dicts which are not Vectors
 
     ## Print statistics
     sim.pc.barrier()
@@ -1415,20 +2253,17 @@ def popAvgRates (trange = None, show = True):
         print 'Error: sim.allSimData not available; please call sim.gatherData()'
         return None
 
-    spkts = sim.allSimData['spkt']
-    spkids = sim.allSimData['spkid']
-
+    spikeIndex = sim.analysis.getSpikeIndex()
+    timeRange = trange  # all spikes if no trange
     if not trange:
         trange = [0, sim.cfg.duration]
-    else:
-        spkids,spkts = zip(*[(spkid,spkt) for spkid,spkt in zip(spkids,spkts) if trange[0] <= spkt <= trange[1]])
 
     avgRates = Dict()
     for pop in sim.net.allPops:
         numCells = float(len(sim.net.allPops[pop]['cellGids']))
         if numCells > 0:
             tsecs = float((trange[1]-trange[0]))/1000.0
-            avgRates[pop] = len([spkid for spkid in spkids if sim.net.allCells[int(spkid)]['tags']['pop']==pop])/numCells/tsecs
+            avgRates[pop] = len(spikeIndex.spikes(pop=pop, timeRange=timeRange)[0])/numCells/tsecs
             print '   %s : %.3f Hz'%(pop, avgRates[pop])
 
     return avgRates
@@ -1457,6 +2292,53 @@ def loadBalance ():
     return [max_comp_time, min_comp_time, avg_comp_time, load_balance]
 
 
+###############################################################################
+### Save cost of each cell (used to distribute cells by cost in following runs; cfg.balanceCells)
+###############################################################################
+def saveCellCosts (filename = None):
+    ''' Cost of each cell estimated from its sections, synapses and conns, and scaled so the cost of each node matches its measured 
+    computation time (pc.step_time); call after running the simulation and before gatherData (which may remove cell secs) '''
+    import sim
+    import json
+
+    costs = {cell.gid: _secsCost(getattr(cell, 'secs', None) or {}) + len(cell.conns) for cell in sim.net.cells}
+
+    # scale estimated costs by ratio of measured to estimated fraction of total computation of node
+    nodeCost = sum(costs.values())
+    totalCost = sim.pc.allreduce(nodeCost, 1)
+    stepTime = sim.pc.step_time()
+    totalStepTime = sim.pc.allreduce(stepTime, 1)
+    if nodeCost > 0 and totalStepTime > 0:
+        scale = (stepTime/totalStepTime) / (nodeCost/totalCost)
+        costs = {gid: cost*scale for gid,cost in costs.iteritems()}
+
+    data = [None]*sim.nhosts
+    data[0] = costs
+    gather = sim.pc.py_alltoall(data)
+    sim.pc.barrier()
+
+    if sim.rank == 0:
+        allCosts = {}
+        for node in gather:
+            allCosts.update(node)
+        if not filename: filename = sim.cfg.filename+'_cellCosts.json'
+        print('Saving cost of %d cells to %s ... ' % (len(allCosts), filename))
+        with open(filename, 'w') as fileObj:
+            json.dump({str(gid): cost for gid,cost in allCosts.iteritems()}, fileObj)
+        return filename
+
+
+###############################################################################
+### Estimated computational cost of cell from its sections: segments x (1 + mechanisms) + point processes and synapses
+###############################################################################
+def _secsCost (secs):
+    cost = 0
+    for sec in secs.values():
+        nseg = sec.get('geom', {}).get('nseg', 1)
+        cost += nseg * (1 + len(sec.get('mechs', {}))) + len(sec.get('pointps', {})) + len(sec.get('synMechs', []))
+    return max(cost, 1)
+
+
 ###############################################################################
 ### Gather data from nodes
 ###############################################################################
@@ -1503,6 +2385,8 @@ def _gatherCells ():
 def saveData (include = None):
     import sim
 
+    if sim.cfg.saveDistributed: return saveDataDistributed(include)  # each node saves its own data
+
     if sim.rank == 0 and not getattr(sim.net, 'allCells', None): needGather = True
     else: needGather = False
     if needGather: gatherData()
@@ -1556,6 +2440,7 @@ def saveData (include = None):
         if 'simConfig' in include: dataSave['simConfig'] = sim.cfg.__dict__
         if 'simData' in include: 
             if 'LFP' in sim.allSimData: sim.allSimData['LFP'] = sim.allSimData['LFP'].tolist() 
+            if 'LFPPops' in sim.allSimData: sim.allSimData['LFPPops'] = Dict({group: np.array(lfp).tolist() for group,lfp in sim.allSimData['LFPPops'].iteritems()})
             dataSave['simData'] = sim.allSimData
 
 
@@ -1588,7 +2473,7 @@ def saveData (include = None):
                 #dataSave = replaceDictODict(dataSave)  # not required since json saves as dict
                 print('Saving output as %s ... ' % (sim.cfg.filename+'.json '))
                 with open(sim.cfg.filename+'.json', 'w') as fileObj:
-                    json.dump(dataSave, fileObj)
+                    json.dump(dataSave, fileObj, default=_numpyToList)  # numpy arrays (eg. packed gather) saved as lists
                 print('Finished saving!')
 
             # Save to mat file
@@ -1598,12 +2483,10 @@ def saveData (include = None):
                 savemat(sim.cfg.filename+'.mat', tupleToList(replaceNoneObj(dataSave)))  # replace None and {} with [] so can save in .mat format
                 print('Finished saving!')
 
-            # Save to HDF5 file (uses very inefficient hdf5storage module which supports dicts)
+            # Save to HDF5 file (columnar layout with chunked and compressed datasets)
             if sim.cfg.saveHDF5:
-                dataSaveUTF8 = _dict2utf8(replaceNoneObj(dataSave)) # replace None and {} with [], and convert to utf
-                import hdf5storage
                 print('Saving output as %s... ' % (sim.cfg.filename+'.hdf5'))
-                hdf5storage.writes(dataSaveUTF8, filename=sim.cfg.filename+'.hdf5')
+                _saveHDF5(dataSave, sim.cfg.filename+'.hdf5')
                 print('Finished saving!')
 
             # Save to CSV file (currently only saves spikes)
@@ -1653,6 +2536,283 @@ def saveData (include = None):
             print('Nothing to save')
 
 
+###############################################################################
+### Save data of each node to a separate file (plus manifest saved by node 0)
+###############################################################################
+def saveDataDistributed (include = None):
+    import sim
+    import json
+
+    timing('start', 'saveTime')
+    if not include: include = sim.cfg.saveDataInclude
+    if 'net' in include: include = include + ['netPops', 'netCells']
+
+    # create folder if missing
+    targetFolder = os.path.dirname(sim.cfg.filename)
+    if sim.rank == 0 and targetFolder and not os.path.exists(targetFolder):
+        try:
+            os.mkdir(targetFolder)
+        except OSError:
+            print ' Could not create target folder: %s' % (targetFolder)
+    sim.pc.barrier()
+
+    # cells and conns of this node (same options as gatherData, but without modifying the cells)
+    nodeData = {'rank': sim.rank}
+    if 'netCells' in include:
+        connFormat = _setCompactConnFormat() if sim.cfg.compactConnFormat else None
+        nodeData['cells'] = []
+        for cell in sim.net.cells:
+            cellData = cell.__getstate__()
+            if not sim.cfg.saveCellSecs:
+                cellData['secs'] = None
+                cellData['secLists'] = None
+            if not sim.cfg.saveCellConns:
+                cellData['conns'] = []
+            elif connFormat and cellData['conns'] and isinstance(cellData['conns'][0], dict):
+                cellData['conns'] = [[conn[param] for param in connFormat] for conn in cellData['conns']]
+            nodeData['cells'].append(cellData)
+
+    # sim data of this node (as numpy arrays)
+    if 'simData' in include:
+        simDataVecs = ['spkt','spkid','stims']+sim.cfg.recordTraces.keys()
+        nodeData['simData'] = _unpackSimData([_packSimData(sim.simData, simDataVecs)], simDataVecs, ['t'])
+
+    nodeFilename = '%s_node%d.pkl' % (sim.cfg.filename, sim.rank)
+    with open(nodeFilename, 'wb') as fileObj:
+        pk.dump(ODict().undotify(nodeData), fileObj, protocol=pk.HIGHEST_PROTOCOL)  # Dict/ODict converted so can use binary protocol
+
+    # gather gid ranges of each node and save manifest
+    gids = sorted([cell.gid for cell in sim.net.cells])
+    nodeInfo = {'rank': sim.rank, 'file': os.path.basename(nodeFilename), 'gidRanges': _gidRanges(gids), 'numCells': len(gids),
+        'numSpikes': len(sim.simData['spkt']) if 'spkt' in sim.simData else 0}
+    data = [None]*sim.nhosts
+    data[0] = nodeInfo
+    gather = sim.pc.py_alltoall(data)
+    sim.pc.barrier()
+
+    if sim.rank == 0:
+        manifest = {'netpyne_version': sim.version(show=False), 'nhosts': sim.nhosts, 'include': include}
+        manifest['nodeFiles'] = sorted(gather, key=lambda k: k['rank'])
+        manifest['pops'] = [[popLabel, pop.__getstate__()['tags']] for popLabel,pop in sim.net.pops.iteritems()]
+        if 'simConfig' in include: manifest['simConfig'] = sim.cfg.__dict__
+        if 'netParams' in include: manifest['netParams'] = replaceFuncObj(sim.net.params.__dict__)
+
+        manifestFilename = sim.cfg.filename+'_manifest.json'
+        print('Saving output as %s (and %d node files) ... ' % (manifestFilename, sim.nhosts))
+        with open(manifestFilename, 'w') as fileObj:
+            json.dump(manifest, fileObj, default=_numpyToList)
+        print('Finished saving!')
+
+        if sim.cfg.timing:
+            timing('stop', 'saveTime')
+            print('  Done; saving time = %0.2f s.' % sim.timingData['saveTime'])
+
+        return os.getcwd()+'/'+manifestFilename
+
+
+###############################################################################
+### Encode sorted gids as list of [start, stop, step] ranges (eg. gids of node)
+###############################################################################
+def _gidRanges (gids):
+    ranges = []
+    i = 0
+    while i < len(gids):
+        j = i+1
+        step = gids[j]-gids[i] if j < len(gids) else 1
+        while j+1 < len(gids) and gids[j+1]-gids[j] == step:
+            j += 1
+        if j < len(gids):
+            ranges.append([gids[i], gids[j]+1, step])
+            i = j+1
+        else:
+            ranges.append([gids[i], gids[i]+1, 1])
+            i = j
+    return ranges
+
+
+###############################################################################
+### Save data to HDF5 file: spikes, traces and LFP as arrays; cells and conns as tables
+###############################################################################
+def _saveHDF5 (dataSave, filename):
+    import h5py
+    import json
+
+    strType = h5py.special_dtype(vlen=str)
+
+    def _dataset (group, name, values, dtype=np.float64):
+        values = np.asarray(values, dtype=dtype)
+        if values.size > 0:  # chunked and compressed
+            return group.create_dataset(name, data=values, chunks=True, compression='gzip', compression_opts=4, shuffle=True)
+        else:
+            return group.create_dataset(name, data=values)
+
+    def _json (group, name, obj):
+        group.create_dataset(name, data=json.dumps(obj, default=_numpyToList), dtype=strType)
+
+    with h5py.File(filename, 'w') as fileObj:
+        for key in ['netpyne_version', 'netpyne_changeset', 'netParams_version']:
+            if key in dataSave: fileObj.attrs[key] = str(dataSave[key])
+        if 'simConfig' in dataSave: _json(fileObj, 'simConfig', dataSave['simConfig'])
+
+        # net: params, pops, cells table (tags), conns table (edges)
+        if 'net' in dataSave:
+            netGroup = fileObj.create_group('net')
+            net = dataSave['net']
+            if 'params' in net: _json(netGroup, 'params', net['params'])
+            if 'pops' in net:
+                _json(netGroup, 'pops', [[popLabel, {k: v for k,v in pop.iteritems() if k != 'cellGids'}] for popLabel,pop in net['pops'].iteritems()])
+            if 'cells' in net:
+                connFormat = dataSave.get('simConfig', {}).get('compactConnFormat', False)
+                cells = sorted(net['cells'], key=lambda k: k['gid'])
+                _saveHDF5CellTable(netGroup, cells)
+                _saveHDF5ConnTable(netGroup, cells, connFormat if isinstance(connFormat, list) else None)
+                if any(cell.get('secs') for cell in cells):  # sections of each cell as json
+                    netGroup.create_dataset('cellSecs', data=[json.dumps(cell.get('secs'), default=_numpyToList) for cell in cells], dtype=strType)
+                if any(cell.get('stims') for cell in cells):  # stims of each cell as json
+                    netGroup.create_dataset('cellStims', data=[json.dumps(cell.get('stims'), default=_numpyToList) for cell in cells], dtype=strType)
+
+        # simData: spikes (time-sorted), traces (cell x time), LFP (time x electrode)
+        if 'simData' in dataSave:
+            simGroup = fileObj.create_group('simData')
+            other = {}
+            for key,val in dataSave['simData'].iteritems():
+                if key in ['spkt', 'spkid', 't']:
+                    continue
+                elif key == 'LFP':
+                    _dataset(simGroup, 'LFP', val)
+                elif key == 'LFPCells':
+                    cellsGroup = simGroup.create_group('LFPCells')
+                    for gid,lfp in val.iteritems(): _dataset(cellsGroup, str(gid), lfp)
+                elif key == 'LFPPops':
+                    popsGroup = simGroup.create_group('LFPPops')
+                    for group,lfp in val.iteritems(): _dataset(popsGroup, str(group), lfp)
+                elif key == 'stims':
+                    stimsGroup = simGroup.create_group('stims')
+                    for cellLabel,cellStims in val.iteritems():
+                        cellGroup = stimsGroup.create_group(cellLabel)
+                        for stimLabel,stimTimes in cellStims.iteritems(): _dataset(cellGroup, stimLabel, stimTimes)
+                elif isinstance(val, dict) and val and all(_cellLabelGid(label) is not None for label in val):
+                    labels = sorted(val, key=_cellLabelGid)
+                    numSteps = max(len(val[label]) for label in labels)
+                    traces = np.full((len(labels), numSteps), np.nan)
+                    for i,label in enumerate(labels):
+                        traces[i, :len(val[label])] = val[label]
+                    traceGroup = simGroup.create_group(key)
+                    _dataset(traceGroup, 'data', traces)
+                    _dataset(traceGroup, 'gids', [_cellLabelGid(label) for label in labels], np.int64)
+                else:
+                    other[key] = val
+
+            spkt = np.asarray(dataSave['simData'].get('spkt', []), dtype=np.float64)
+            spkid = np.asarray(dataSave['simData'].get('spkid', []), dtype=np.float64)
+            order = np.argsort(spkt, kind='mergesort')  # required for partial reads by time
+            _dataset(simGroup, 'spkt', spkt[order])
+            _dataset(simGroup, 'spkid', spkid[order])
+            if 't' in dataSave['simData']: _dataset(simGroup, 't', dataSave['simData']['t'])
+            if other: _json(simGroup, 'other', other)
+
+
+def _saveHDF5CellTable (group, cells):
+    ''' Save tags of cells as compound table (numbers as float, strings as fixed length strings, rest as json) '''
+    import json
+
+    tagKeys = sorted(set([key for cell in cells for key in cell['tags']]))
+    fields, jsonFields, columns = [('gid', np.int64)], [], {'gid': [cell['gid'] for cell in cells]}
+    for key in tagKeys:
+        values = [cell['tags'].get(key, None) for cell in cells]
+        if all(isinstance(v, Number) or v is None for v in values):
+            columns[key] = [np.nan if v is None else v for v in values]
+            fields.append((key, np.float64))
+        else:
+            if not all(isinstance(v, basestring) for v in values):
+                values = [json.dumps(v, default=_numpyToList) for v in values]
+                jsonFields.append(key)
+            columns[key] = [str(v) for v in values]
+            fields.append((key, 'S%d' % max(1, max(len(v) for v in columns[key]))))
+
+    table = np.zeros(len(cells), dtype=fields)
+    for key,_ in fields:
+        table[key] = columns[key]
+    dset = group.create_dataset('cells', data=table, chunks=True if len(cells) else None, compression='gzip' if len(cells) else None)
+    dset.attrs['jsonFields'] = json.dumps(jsonFields)
+
+
+def _saveHDF5ConnTable (group, cells, connFormat=None):
+    '''
+    Save conns of cells as edge table sorted by postGid (synMech, sec, preLabel and label as codes), with offset of each cell;
+    list-valued weight, delay or loc saved as variable length arrays, and rest of conn params (eg. threshold, plast, shape,
+    synsPerConn, gap junction ids) as json strings, one row per conn (only created if any conn needs them)
+    '''
+    import h5py
+    import json
+
+    codeFields = ['synMech', 'sec', 'preLabel', 'label']
+    numFields = ['weight', 'delay', 'loc']
+    categories = {field: {} for field in codeFields}
+    offsets = np.zeros(len(cells)+1, dtype=np.int64)
+    rows, lists, extras = [], {field: {} for field in numFields}, {}  # lists and extras indexed by row
+    notSaved = set()
+    for i,cell in enumerate(cells):
+        for conn in cell.get('conns', []):
+            if connFormat and isinstance(conn, (list, tuple)):
+                conn = dict(zip(connFormat, conn))
+            preGid = conn.get('preGid', None)
+            row = [cell['gid'], preGid if isinstance(preGid, Number) else -1]  # -1 for NetStims
+            extra = {}
+            for field in codeFields:
+                value = conn.get(field, None)
+                if isinstance(value, basestring):
+                    row.append(categories[field].setdefault(value, len(categories[field])))
+                else:
+                    row.append(-1)
+                    if value is not None: extra[field] = value
+            for field in numFields:
+                value = conn.get(field, None)
+                if isinstance(value, Number):
+                    row.append(value)
+                else:
+                    row.append(np.nan)
+                    if isinstance(value, (list, tuple, np.ndarray)) and all(isinstance(v, Number) for v in value):
+                        lists[field][len(rows)] = value
+                    elif value is not None:
+                        extra[field] = value
+            for key,value in conn.iteritems():
+                if key not in codeFields+numFields+['preGid']:
+                    extra[key] = value
+            if extra:
+                for key,value in extra.items():
+                    try:
+                        json.dumps(value, default=_numpyToList)
+                    except (TypeError, ValueError):
+                        notSaved.add(key)
+                        del extra[key]
+                if preGid is not None and not isinstance(preGid, Number) and preGid != 'NetStim':
+                    extra['preGid'] = preGid
+                extras[len(rows)] = json.dumps(extra, default=_numpyToList)
+            rows.append(tuple(row))
+        offsets[i+1] = len(rows)
+
+    fields = [('postGid', np.int64), ('preGid', np.int64)] + [(field, np.int32) for field in codeFields] + \
+        [('weight', np.float64), ('delay', np.float64), ('loc', np.float64)]
+    table = np.array(rows, dtype=fields)
+    dset = group.create_dataset('conns', data=table, chunks=True if len(rows) else None, compression='gzip' if len(rows) else None)
+    for field in codeFields:
+        dset.attrs[field+'s'] = json.dumps(sorted(categories[field], key=categories[field].get))
+    group.create_dataset('connOffsets', data=offsets)
+
+    for field in numFields:
+        if lists[field]:  # eg. weights and locs of conns with synsPerConn > 1 (empty for scalar values)
+            listsDset = group.create_dataset('connLists/'+field, (len(rows),), dtype=h5py.special_dtype(vlen=np.float64))
+            for row,value in lists[field].iteritems():
+                listsDset[row] = np.asarray(value, dtype=np.float64)
+    if extras:  # json of other conn params ('' if none)
+        extrasDset = group.create_dataset('connExtras', (len(rows),), dtype=h5py.special_dtype(vlen=str))
+        for row,value in extras.iteritems():
+            extrasDset[row] = value
+    if notSaved:
+        print '  Warning: conn params could not be saved to HDF5 (not serializable): %s' % (', '.join(sorted(notSaved)))
+
+
 ###############################################################################
 ### Load cell tags and conns using ijson (faster!) 
 ###############################################################################
@@ -1724,19 +2884,27 @@ def ijsonLoad(filename, tagsGidRange=None, connsGidRange=None, loadTags=True, lo
 def compactConnFormat():
     import sim
 
+    connFormat = _setCompactConnFormat()
+    for cell in sim.net.cells:
+        newConns = [[conn[param] for param in connFormat] for conn in cell.conns]
+        del cell.conns
+        cell.conns = newConns
+ 
+
+
+###############################################################################
+### Set list of keys of compact conn format (if cfg.compactConnFormat is not a list)
+###############################################################################
+def _setCompactConnFormat():
+    import sim
+
     if type(sim.cfg.compactConnFormat) is not list:
         if len(sim.net.params.stimTargetParams) > 0:  # if have stims, then require preLabel field
             sim.cfg.compactConnFormat = ['preGid', 'preLabel', 'sec', 'loc', 'synMech', 'weight', 'delay']
         else:
             sim.cfg.compactConnFormat = ['preGid', 'sec', 'loc', 'synMech', 'weight', 'delay']
-    
 
-    connFormat = sim.cfg.compactConnFormat
-    for cell in sim.net.cells:
-        newConns = [[conn[param] for param in connFormat] for conn in cell.conns]
-        del cell.conns
-        cell.conns = newConns
- 
+    return sim.cfg.compactConnFormat
 
 
 ###############################################################################
@@ -78,7 +78,9 @@ class Dict(dict):
 
 
     def dotify(self, x):
-        if isinstance(x, dict):
+        if isinstance(x, SharedDict):  # keep shared (read-only) dicts
+            return x
+        elif isinstance(x, dict):
             return Dict( (k, self.dotify(v)) for k,v in x.iteritems() )
         elif isinstance(x, (list, tuple)):
             return type(x)( self.dotify(v) for v in x )
@@ -86,7 +88,9 @@ class Dict(dict):
             return x
 
     def undotify(self, x):
-        if isinstance(x, dict):
+        if isinstance(x, SharedDict):  # keep shared (read-only) dicts; pickled as dict
+            return x
+        elif isinstance(x, dict):
             return dict( (k, self.undotify(v)) for k,v in x.iteritems() )
         elif isinstance(x, (list, tuple)):
             return type(x)( self.undotify(v) for v in x )
@@ -131,6 +135,39 @@ class Dict(dict):
         self = self.fromdict(d)
 
 
+###############################################################################
+# SharedDict class (read-only Dict shared by multiple objects, eg. section specs of cells created from the same rule)
+###############################################################################
+
+class SharedDict(Dict):
+
+    __slots__ = []
+
+    def __init__(self, *args, **kwargs):
+        for k,v in dict(*args, **kwargs).iteritems():
+            dict.__setitem__(self, k, SharedDict(v) if isinstance(v, dict) and not isinstance(v, SharedDict) else v)
+
+    def _readOnly(self, *args, **kwargs):
+        raise TypeError('SharedDict is read-only (shared by multiple objects); modify a copy obtained with copy()')
+
+    __setitem__ = __delitem__ = update = pop = popitem = clear = _readOnly
+
+    def setdefault(self, k, default=None):
+        if k in self:
+            return self[k]
+        self._readOnly()
+
+    def __missing__(self, key):
+        raise KeyError(key)
+
+    def copy(self):
+        ''' Returns modifiable (deep) copy as Dict '''
+        return Dict((k, v.copy() if isinstance(v, SharedDict) else self.dotify(v)) for k,v in self.iteritems())
+
+    def __reduce__(self):
+        return (SharedDict, (dict(self),))  # each shared object is pickled once (and remains shared when unpickled)
+
+
 ###############################################################################
 # ODict class (allows dot notation for ordered dicts)
 ###############################################################################
@@ -687,6 +724,16 @@ class SimConfig (object):
         self.createNEURONObj = True  #  create runnable network in NEURON when instantiating netpyne network metadata
         self.createPyStruct = True  # create Python structure (simulator-independent) when instantiating network
         self.addSynMechs = True  # whether to add synaptich mechanisms or not
+        self.vectorizedConn = False  # use vectorized engine (one random stream per postsyn cell) to generate probabilistic conns
+        self.compactCellTags = False  # when using multiple nodes, exchange only gid, pop and coordinates of cells (packed arrays) to find cells for conns and stims
+        self.gatherPacked = False  # gather spikes and traces as packed numpy arrays (kept as arrays in sim.allSimData); True (float64) or 'float32' (traces)
+        self.saveDistributed = False  # each node saves its cells, conns and simData to a separate file (filename_node<rank>.pkl), plus manifest (filename_manifest.json) saved by node 0
+        self.connTable = False  # store conns of each node in columnar table (struct of arrays) and use per-cell views in cell.conns; set to folder path to use memory-mapped files
+        self.streamInterval = None  # interval (ms) at which sim.runSimWithStreaming() appends spikes and traces of each node to binary files (filename_stream_node<rank>_*.dat) and clears them from memory
+        self.checkpointInterval = None  # interval (ms) at which sim.runSimWithCheckpoints() saves the state of each node (filename_checkpoint*), used by sim.restoreCheckpoint() to resume the simulation
+        self.balanceCells = False  # distribute cells across nodes by estimated cost (True) or cost measured in previous run (filename saved by sim.saveCellCosts()), instead of round-robin; gids and conns unchanged
+        self.compiledCellRules = False  # match cellParams rules once per signature of cell tags and create compartmental cells from compiled construction plan of each rule
+        self.sharedCellSpecs = False  # geom, mechs, ions and topol of sections of cells created from the same cellParams rule reference a shared read-only spec, copied only when modified (eg. by modifyCells)
         self.includeParamsLabel = True  # include label of param rule that created that cell, conn or stim
         self.gatherOnlySimData = False  # omits gathering of net+cell data thus reducing gatherData time
         self.compactConnFormat = False  # replace dict format with compact list format for conns (need to provide list of keys to include)
@@ -704,6 +751,7 @@ class SimConfig (object):
         self.recordStim = False  # record spikes of cell stims
         self.recordLFP = [] # list of 3D locations to record LFP from
         self.saveLFPCells = False  # Store LFP generate individually by each cell 
+        self.saveLFPPops = False  # Store LFP generated by each population (True) or by each group of cells with same value of a tag (tag name, eg. 'cellType')
         self.recordStep = 0.1 # Step size in ms to save data (eg. V traces, LFP, etc)
         self.recordTime = True  # record time step of recording
 
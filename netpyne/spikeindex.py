@@ -0,0 +1,225 @@
+"""
+spikeindex.py
+
+Contains SpikeIndex class: spike times sorted by (gid, time) with CSR offsets per gid and gids of each pop,
+used to get the spikes of sets of cells in time windows; and functions to calculate spike train stats of each cell
+(rate, ISI mean and CV, local variation, Fano factor and bursts) from spikes sorted by (gid, time)
+
+Contributors: salvadordura@gmail.com
+"""
+
+import numpy as np
+
+
+###############################################################################
+#
+# SPIKE TRAIN STATS
+#
+###############################################################################
+
+statsKeys = ['gid', 'numSpikes', 'rate', 'isiMean', 'isiCV', 'lv', 'fano', 'numBursts', 'burstFraction']
+
+
+###############################################################################
+# Stats of each cell from spike times grouped by cell (sorted by time within cell) 
+###############################################################################
+def _trainStats (gids, counts, times, timeRange, burstISI=10.0, fanoBin=100.0):
+    ''' 
+    Stats of spike trains of cells with gids (array), where times has the spikes of each cell consecutively (counts[i] spikes of gid[i]);
+    ISI-based stats are nan for cells with not enough spikes (isiMean, isiCV: 2 spikes; lv: 3 spikes), fano is nan for cells without spikes.
+    Values of each spike (or ISI ending at the next spike of the same cell) are summed per cell with np.add.reduceat over the cell segments 
+    '''
+    numCells = len(gids)
+    numSpikes = len(times)
+    duration = float(timeRange[1] - timeRange[0])
+    stats = {'gid': gids, 'numSpikes': counts, 'rate': counts * 1e3 / duration if duration > 0 else np.zeros(numCells)}
+
+    starts = np.cumsum(counts) - counts  # first spike of each cell
+    spiking = counts > 0
+    isLast = np.zeros(numSpikes, dtype=bool)  # last spike of each cell
+    isLast[starts[spiking] + counts[spiking] - 1] = True
+
+    def cellSums(values, segStarts=starts, dtype=float):  # sum of values of the spikes (or runs) of each cell
+        sums = np.zeros(numCells, dtype=dtype)
+        if len(values) > 0:
+            sums[spiking] = np.add.reduceat(values, segStarts[spiking], dtype=dtype)
+        return sums
+
+    # inter-spike intervals (isis[i] = interval from spike i to next spike of the same cell; 0 for last spike)
+    isis = np.zeros(numSpikes)
+    isis[:-1] = np.diff(times)
+    isis[isLast] = 0.0
+    numIsis = np.maximum(counts - 1, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        isiMean = cellSums(isis) / numIsis
+        isiVar = np.maximum(cellSums(isis * isis) / numIsis - isiMean**2, 0.0)
+        stats['isiMean'] = isiMean
+        stats['isiCV'] = np.sqrt(isiVar) / isiMean
+
+        # local variation (LV) of consecutive ISIs of the same cell
+        pairTerms = np.zeros(numSpikes)
+        pairTerms[:-2] = ((isis[:-2] - isis[1:-1]) / (isis[:-2] + isis[1:-1]))**2
+        pairTerms[:-2][isLast[:-2] | isLast[1:-1]] = 0.0  # pairs of ISIs of different cells
+        numPairs = numIsis - 1
+        stats['lv'] = np.where(numPairs > 0, 3.0 * cellSums(pairTerms) / numPairs, np.nan)
+
+        # Fano factor of spike counts in bins of size fanoBin (sum of squared counts from runs of spikes in same bin)
+        numBins = max(int(duration // fanoBin), 1)
+        spikeBins = ((times - timeRange[0]) * (1.0 / fanoBin)).astype(int)  # times >= start, so truncation = floor
+        np.minimum(spikeBins, numBins-1, out=spikeBins)
+        runStarts = np.ones(numSpikes, dtype=bool)
+        runStarts[1:] = (spikeBins[1:] != spikeBins[:-1]) | isLast[:-1]
+        runStarts = np.flatnonzero(runStarts)
+        runLengths = np.diff(np.append(runStarts, numSpikes))
+        binMean = counts / float(numBins)
+        stats['fano'] = (cellSums(runLengths**2, np.searchsorted(runStarts, starts)) / numBins - binMean**2) / binMean
+
+    # bursts: runs of ISIs <= burstISI (>= 2 spikes)
+    burstIsis = (isis <= burstISI) & ~isLast
+    burstStarts = burstIsis.copy()
+    burstStarts[1:] &= ~burstIsis[:-1]  # burst ISI not preceded by burst ISI (last spike of previous cell is never burst ISI) 
+    burstSpikes = burstIsis.copy()
+    burstSpikes[1:] |= burstIsis[:-1]  # spikes at start or end of burst ISI 
+    stats['numBursts'] = cellSums(burstStarts, dtype=int)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats['burstFraction'] = np.where(spiking, cellSums(burstSpikes, dtype=int) / counts.astype(float), np.nan)
+
+    return stats
+
+
+###############################################################################
+# Stats of each cell from spike gids and times (any order)
+###############################################################################
+def spikeStats (spkinds, spkts, timeRange, burstISI=10.0, fanoBin=100.0):
+    ''' Return dict with arrays of stats (see statsKeys) of cells with spikes in spkinds (one entry per gid, sorted) within timeRange ([start, stop], inclusive) '''
+    times = np.asarray(spkts, dtype=float)
+    inds = np.asarray(spkinds, dtype=float).astype(int)
+    mask = (times >= timeRange[0]) & (times <= timeRange[1])
+    times, inds = times[mask], inds[mask]
+    order = np.lexsort((times, inds))
+    times, inds = times[order], inds[order]
+    gids, counts = np.unique(inds, return_counts=True)
+    return _trainStats(gids, counts, times, timeRange, burstISI, fanoBin)
+
+
+###############################################################################
+#
+# SPIKE INDEX CLASS
+#
+###############################################################################
+class SpikeIndex (object):
+    ''' Spike times sorted by (gid, time) with CSR offsets (spikes of gid in [offsets[gid], offsets[gid+1])) and gids of each pop '''
+
+    def __init__ (self, spkt, spkid, popGids=None):
+        self.spkt = spkt  # source spike times and gids (used to check if index is current)
+        self.spkid = spkid
+        self.numSpikes = len(spkt)
+
+        times = np.asarray(spkt, dtype=float)
+        gids = np.asarray(spkid, dtype=float).astype(int)
+        # sort by gid, then time: argsort of integer key (gid, rank of time), faster than lexsort
+        timeOrder = np.arange(len(times)) if np.all(times[1:] >= times[:-1]) else np.argsort(times)
+        timeRanks = np.empty(len(times), dtype=int)
+        timeRanks[timeOrder] = np.arange(len(times))
+        order = np.argsort(gids * len(times) + timeRanks)
+        self.times = times[order]
+        self.gids = gids[order]
+        self.maxGid = int(self.gids[-1]) if len(self.gids) else -1
+        self.offsets = np.searchsorted(self.gids, np.arange(self.maxGid+2))  # CSR offsets (row = gid)
+
+        self.popGids = {}  # sorted array of gids of each pop
+        self.popRanges = {}  # [first, last] gid of pops with consecutive gids
+        for pop,gidList in (popGids or {}).iteritems():
+            self.popGids[pop] = np.unique(np.asarray(gidList, dtype=int))
+            popGidArray = self.popGids[pop]
+            if len(popGidArray) and popGidArray[-1]-popGidArray[0]+1 == len(popGidArray):
+                self.popRanges[pop] = [int(popGidArray[0]), int(popGidArray[-1])]
+
+
+    def isCurrent (self, spkt, spkid):
+        ''' Check if index was built from these spike arrays (and they were not modified in size) '''
+        return self.spkt is spkt and self.spkid is spkid and self.numSpikes == len(spkt) == len(spkid)
+
+
+    def _rangeRows (self, first, last):
+        ''' Rows (in gid-sorted arrays) of the spikes of gids first to last '''
+        first, last = max(first, 0), min(last, self.maxGid)
+        if first > last:
+            return np.array([], dtype=int)
+        return np.arange(self.offsets[first], self.offsets[last+1])
+
+
+    def _gidRows (self, gids):
+        ''' Rows (in gid-sorted arrays) of the spikes of gids (array of unique sorted gids) '''
+        gids = gids[(gids >= 0) & (gids <= self.maxGid)]
+        if len(gids) == 0:
+            return np.array([], dtype=int)
+        if gids[-1]-gids[0]+1 == len(gids):  # consecutive gids (eg. pop): single slice
+            return self._rangeRows(gids[0], gids[-1])
+        starts = self.offsets[gids]
+        counts = self.offsets[gids+1] - starts
+        total = counts.sum()
+        if total == 0:
+            return np.array([], dtype=int)
+        segStarts = np.cumsum(counts) - counts  # position of first spike of each gid in output
+        return np.repeat(starts - segStarts, counts) + np.arange(total)
+
+
+    def spikes (self, gids=None, timeRange=None, pop=None, sortByTime=False):
+        '''
+        Return arrays of spike gids and times of cells (gids=None and pop=None for all cells) within timeRange ([start, stop], inclusive)
+        Spikes are sorted by gid and time, or by time (and gid) if sortByTime=True
+        '''
+        if pop is not None:
+            if pop in self.popRanges:
+                rows = self._rangeRows(*self.popRanges[pop])
+            else:
+                rows = self._gidRows(self.popGids.get(pop, np.array([], dtype=int)))
+            spkgids, spkts = self.gids[rows], self.times[rows]
+        elif gids is None:
+            spkgids, spkts = self.gids, self.times
+        else:
+            rows = self._gidRows(np.unique(np.asarray(list(gids), dtype=int)))
+            spkgids, spkts = self.gids[rows], self.times[rows]
+
+        if timeRange is not None:
+            mask = (spkts >= timeRange[0]) & (spkts <= timeRange[1])
+            spkgids, spkts = spkgids[mask], spkts[mask]
+        if sortByTime:
+            order = np.lexsort((spkgids, spkts))
+            spkgids, spkts = spkgids[order], spkts[order]
+        return spkgids, spkts
+
+
+    def counts (self, gids, timeRange=None):
+        ''' Return array with number of spikes of each gid within timeRange ([start, stop], inclusive) '''
+        gids = np.asarray(gids, dtype=int)
+        valid = (gids >= 0) & (gids <= self.maxGid)
+        counts = np.zeros(len(gids), dtype=int)
+        if timeRange is None:
+            cumCounts = np.arange(self.numSpikes+1)
+        else:  # cumulative number of spikes within timeRange
+            cumCounts = np.concatenate(([0], np.cumsum((self.times >= timeRange[0]) & (self.times <= timeRange[1]))))
+        counts[valid] = cumCounts[self.offsets[gids[valid]+1]] - cumCounts[self.offsets[gids[valid]]]
+        return counts
+
+
+    def stats (self, gids=None, timeRange=None, burstISI=10.0, fanoBin=100.0):
+        ''' 
+        Return dict with arrays of spike train stats (see statsKeys) of each gid (gids=None for all cells with spikes; sorted) 
+        within timeRange ([start, stop], inclusive; default: from 0 to last spike), calculated from the gid-sorted spike arrays
+        '''
+        if timeRange is None:
+            timeRange = [0, self.times.max() if self.numSpikes else 0]
+        if gids is None:  # all cells with spikes
+            gids = np.flatnonzero(np.diff(self.offsets))
+            times = self.times
+        else:
+            gids = np.unique(np.asarray(list(gids), dtype=int))
+            times = self.times[self._gidRows(gids)]
+        if self.numSpikes and (timeRange[0] > self.times.min() or timeRange[1] < self.times.max()):  # remove spikes out of timeRange
+            times = times[(times >= timeRange[0]) & (times <= timeRange[1])]
+            counts = self.counts(gids, timeRange)
+        else:
+            counts = self.counts(gids)
+        return _trainStats(gids, counts, times, timeRange, burstISI, fanoBin)
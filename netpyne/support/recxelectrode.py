@@ -54,12 +54,18 @@ class RecXElectrode(object):
 
         self.nsites = self.pos.shape[1]
         self.transferResistances = {}   # V_e = transfer_resistance*Im
+        self.transferResistancesCache = {}  # transfer resistances of cells with same morphology and position (key = cacheKey)
     
     def getTransferResistance(self, gid):
         return self.transferResistances[gid]
     
-    def calcTransferResistance(self, gid, seg_coords):
-        """Precompute mapping from segment to electrode locations"""
+    def calcTransferResistance(self, gid, seg_coords, cacheKey=None):
+        """Precompute mapping from segment to electrode locations (all sites and segments at once);
+        cells with same cacheKey (eg. population and position) reuse the same mapping"""
+        if cacheKey is not None and cacheKey in self.transferResistancesCache:
+            self.transferResistances[gid] = self.transferResistancesCache[cacheKey]
+            return
+
         sigma = 0.3  # mS/mm 
 
         # Value used in NEURON extracellular recording example ("extracellular_stim_and_rec")
@@ -70,30 +76,25 @@ class RecXElectrode(object):
 
         r05 = (seg_coords['p0'] + seg_coords['p1'])/2
         dl = seg_coords['p1'] - seg_coords['p0']
-        
-        nseg = r05.shape[1]
-        
-        tr = np.zeros((self.nsites,nseg))
-        # tr_NEURON = np.zeros((self.nsites,nseg))  # used to compare with NEURON extracellular example
+        dlmag = np.linalg.norm(dl, axis=0)  # length of each segment
 
-        for j in xrange(self.nsites):   # calculate mapping for each site on the electrode
-            rel = np.expand_dims(self.pos[:, j], axis=1)   # coordinates of a j-th site on the electrode
-            rel_05 = rel - r05  # distance between electrode and segment centers
-            r2 = np.einsum('ij,ij->j', rel_05, rel_05)    # compute dot product column-wise, the resulting array has as many columns as original
-            
-            rlldl = np.einsum('ij,ij->j', rel_05, dl)    # compute dot product column-wise, the resulting array has as many columns as original
-            dlmag = np.linalg.norm(dl, axis=0)  # length of each segment
-            rll = abs(rlldl/dlmag)   # component of r parallel to the segment axis it must be always positive
-            rT2 = r2 - rll**2  # square of perpendicular component
-            up = rll + dlmag/2
-            low = rll - dlmag/2
-            num = up + np.sqrt(up**2 + rT2)
-            den = low + np.sqrt(low**2 + rT2)
-            tr[j, :] = np.log(num/den)/dlmag  # units of (1/um) use with imemb_ (total seg current)
+        # geometry of each site (rows) and segment (columns)
+        rel_05 = self.pos[:, :, np.newaxis] - r05[:, np.newaxis, :]  # distance between electrode sites and segment centers (xyz x sites x segs)
+        r2 = np.einsum('ijk,ijk->jk', rel_05, rel_05)  # squared distance
+        rlldl = np.einsum('ijk,ik->jk', rel_05, dl)  # dot product with segment axis
+        rll = abs(rlldl/dlmag)   # component of r parallel to the segment axis it must be always positive
+        rT2 = r2 - rll**2  # square of perpendicular component
+        up = rll + dlmag/2
+        low = rll - dlmag/2
+        num = up + np.sqrt(up**2 + rT2)
+        den = low + np.sqrt(low**2 + rT2)
+        tr = np.log(num/den)/dlmag  # units of (1/um) use with imemb_ (total seg current)
 
-            # Consistent with NEURON extracellular recording example
-            # r = np.sqrt(rel_05[0,:]**2 + rel_05[1,:]**2 + rel_05[2,:]**2)
-            # tr_NEURON[j, :] = (rho / 4 / math.pi)*(1/r)*0.01
+        # Consistent with NEURON extracellular recording example
+        # r = np.sqrt(rel_05[0,:]**2 + rel_05[1,:]**2 + rel_05[2,:]**2)
+        # tr_NEURON = (rho / 4 / math.pi)*(1/r)*0.01
 
         tr *= 1/(4*math.pi*sigma)  # units: 1/um / (mS/mm) = mm/um / mS = 1e3 * kOhm = MOhm
         self.transferResistances[gid] = tr
+        if cacheKey is not None:
+            self.transferResistancesCache[cacheKey] = tr